@@ -1,19 +1,34 @@
 import dash
+from flask import Response
 from flask_caching import Cache
 
+from utils.metrics import metrics
+
 # get bootstrap stylesheet
 external_stylesheets = [
 "https://stackpath.bootstrapcdn.com/bootstrap/4.2.1/css/bootstrap.min.css"
 ]
 
-# create app instance
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# create app instance; callback responses such as the forecast bundle are
+# gzipped with Flask-Compress
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=True)
 
 # set cache config
+# entries are memory-mapped by every worker; use a tmpfs directory such as
+# /dev/shm/covid-dashboard as CACHE_DIR to keep them in shared memory
 config = {
-    "CACHE_TYPE": "FileSystemCache",
+    "CACHE_TYPE": "utils.arrow_cache.ArrowCache",
     "CACHE_DIR": "cache"
 }
 
 # initialize cache for underlying flask app
 cache = Cache(app.server, config=config)
+
+
+@app.server.route("/metrics")
+def metrics_endpoint() -> Response:
+    """
+    Stage latencies, cache and model load counters and peak RSS in the
+    Prometheus text format
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,194 @@
+/*
+ * Client-side rendering of the prediction chart of a single country from
+ * the forecast bundle stored in the "forecast-bundle" dcc.Store (built by
+ * utils.plotting.forecast_bundle). Switching between single countries needs
+ * no request to the server; the chart matches plot_country_prediction.
+ * Selections of several countries, and of a single country until the bundle
+ * has arrived, are passed on to the server through the
+ * "comparison-selection" store, which is only written when they change.
+ * Likewise, the server is only asked for the interpretation panel while it
+ * is shown and the interpreted country changes, and for a what-if scenario
+ * only while a slider is moved away from zero.
+ *
+ * Decode and render times of the last bundle and chart are kept in
+ * window.dash_clientside.forecast.timings.
+ */
+(function() {
+    var forecast = {
+        timings: {},
+
+        // decoded arrays of the current bundle, reused across countries
+        decoded: null,
+
+        // whether the server currently shows a comparison or a fallback chart
+        comparing: false,
+
+        // country index of the interpretation panel, null if hidden
+        interpreted: null,
+
+        // last scenario request as JSON, null if no scenario is requested
+        scenario: null,
+
+        decode: function(bundle) {
+            if (forecast.decoded && forecast.decoded.version === bundle.version) {
+                return forecast.decoded;
+            }
+            var start = performance.now();
+            var float32 = function(text) {
+                var bytes = atob(text);
+                var buffer = new Uint8Array(bytes.length);
+                for (var i = 0; i < bytes.length; i++) {
+                    buffer[i] = bytes.charCodeAt(i);
+                }
+                return new Float32Array(buffer.buffer);
+            };
+
+            // one date per day, from the first known day to the last predicted;
+            // predictions start the day after the last known one
+            var lastKnown = new Date(bundle.last_known + "T00:00:00Z");
+            var dates = [];
+            for (var day = 1 - bundle.encoder_length; day <= bundle.decoder_length; day++) {
+                var date = new Date(lastKnown.getTime() + day * 86400000);
+                dates.push(date.toISOString().slice(0, 10));
+            }
+
+            forecast.decoded = {
+                version: bundle.version,
+                dates: dates,
+                history: float32(bundle.history),
+                prediction: float32(bundle.prediction),
+                lower: float32(bundle.lower),
+                upper: float32(bundle.upper)
+            };
+            forecast.timings.decode_ms = performance.now() - start;
+            return forecast.decoded;
+        },
+
+        render_selection: function(country_indices, bundle, train_end) {
+            var no_update = window.dash_clientside.no_update;
+            var hidden = {display: "none"};
+            if (country_indices === null || country_indices === undefined) {
+                country_indices = [];
+            }
+            if (!Array.isArray(country_indices)) {
+                country_indices = [country_indices];
+            }
+            // comparisons of several countries, and single countries until
+            // the bundle arrived, are drawn by the server
+            if (country_indices.length > 1 || (country_indices.length === 1 && !bundle)) {
+                forecast.comparing = true;
+                return [no_update, hidden, country_indices];
+            }
+            // clear a previous comparison once, otherwise leave the server alone
+            var comparison = forecast.comparing ? null : no_update;
+            forecast.comparing = false;
+            if (country_indices.length === 0 || !bundle) {
+                return [no_update, hidden, comparison];
+            }
+
+            var start = performance.now();
+            var index = country_indices[0];
+            var name = bundle.names[index];
+            var row = bundle.rows[index];
+            var layout = {
+                title: {text: name},
+                xaxis: {title: {text: ""}},
+                yaxis: {title: {text: "New Cases (7-day Avg.)"}}
+            };
+            if (row === undefined || row < 0) {
+                layout.annotations = [{
+                    text: "No prediction available for " + name + ".",
+                    xref: "paper", yref: "paper", x: 0.5, y: 0.5, showarrow: false
+                }];
+                return [{data: [], layout: layout}, {display: "block"}, comparison];
+            }
+
+            var data = forecast.decode(bundle);
+            var enc = bundle.encoder_length;
+            var dec = bundle.decoder_length;
+            var pad = function(values, before, after) {
+                var padded = new Array(before).fill(null);
+                for (var i = 0; i < values.length; i++) {
+                    padded.push(isNaN(values[i]) ? null : values[i]);
+                }
+                return padded.concat(new Array(after).fill(null));
+            };
+            var history = data.history.subarray(row * enc, (row + 1) * enc);
+            var slice = function(values) {
+                return values.subarray(row * dec, (row + 1) * dec);
+            };
+
+            var observed = pad(history, 0, dec);
+            var upper = pad(slice(data.upper), enc, 0);
+            var lower = pad(slice(data.lower), enc, 0);
+            var traces = [
+                {
+                    x: data.dates.concat(data.dates.slice().reverse()),
+                    y: upper.concat(lower.slice().reverse()),
+                    fill: "toself",
+                    fillcolor: "rgba(0,100,80,0.2)",
+                    line: {color: "rgba(255,255,255,0)"},
+                    showlegend: false,
+                    type: "scatter"
+                },
+                {x: data.dates, y: observed, name: "Observed", showlegend: true, type: "scatter"},
+                {
+                    x: data.dates,
+                    y: pad(slice(data.prediction), enc, 0),
+                    line: {color: "rgb(0,100,80)"},
+                    name: "Predicted",
+                    type: "scatter"
+                }
+            ];
+
+            if (train_end) {
+                var known = observed.filter(function(value) { return value !== null; });
+                layout.shapes = [{
+                    type: "line", xref: "x", yref: "paper", x0: train_end, x1: train_end, y0: 0, y1: 1,
+                    line: {dash: "dash", width: 2, color: "purple"}
+                }];
+                layout.annotations = [{
+                    x: train_end, y: Math.max.apply(null, known),
+                    text: "End of Model Training Data", showarrow: false, xshift: -80
+                }];
+            }
+
+            forecast.timings.render_ms = performance.now() - start;
+            return [{data: traces, layout: layout}, {display: "block"}, comparison];
+        },
+
+        select_interpretation: function(country_indices, toggle) {
+            if (!Array.isArray(country_indices)) {
+                country_indices = country_indices === null || country_indices === undefined ? [] : [country_indices];
+            }
+            var shown = Array.isArray(toggle) && toggle.indexOf("show") >= 0;
+            var index = shown && country_indices.length === 1 ? country_indices[0] : null;
+            if (index === forecast.interpreted) {
+                return window.dash_clientside.no_update;
+            }
+            forecast.interpreted = index;
+            return index;
+        },
+
+        // takes the slider values in percent after the selected countries,
+        // in the order of utils.scenarios.SCENARIO_COVARIATES
+        select_scenario: function(country_indices) {
+            if (!Array.isArray(country_indices)) {
+                country_indices = country_indices === null || country_indices === undefined ? [] : [country_indices];
+            }
+            var changes = Array.prototype.slice.call(arguments, 1).map(function(value) {
+                return typeof value === "number" ? value : 0;
+            });
+            var active = country_indices.length > 0 && changes.some(function(value) { return value !== 0; });
+            var request = active ? {countries: country_indices, changes: changes} : null;
+            var key = JSON.stringify(request);
+            if (key === forecast.scenario) {
+                return window.dash_clientside.no_update;
+            }
+            forecast.scenario = key;
+            return request;
+        }
+    };
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {forecast: forecast});
+})();
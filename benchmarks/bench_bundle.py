@@ -0,0 +1,103 @@
+"""
+Benchmark comparing the forecast bundle drawn in the browser with figures
+built on the server for every country switch.
+
+Usage:
+    python -m benchmarks.bench_bundle [--locations 230] [--mbps 10] [--rtt 50]
+
+Uses a synthetic forecast with the encoder and decoder lengths of
+run_config.yml. Sizes are reported as sent, gzipped like Dash's callback
+responses. Time to interactive is estimated as server time, transfer at the
+given bandwidth and one round trip; the browser's own decode and render
+times of the bundle are available in window.dash_clientside.forecast.timings.
+"""
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.forecast_store import Forecast
+from utils.plotting import forecast_bundle, plot_country_prediction
+from utils.run_config import load_run_config
+
+from typing import Callable, Tuple
+
+
+def synthetic_forecast(n_locations: int, encoder_length: int, decoder_length: int,
+                       n_quantiles: int = 7) -> Forecast:
+    """
+    Forecast with smooth, positive case counts for every location
+    """
+    rng = np.random.default_rng(0)
+    days = np.arange(encoder_length + decoder_length)
+    scale = rng.lognormal(5, 1.5, (n_locations, 1))
+    phase = rng.uniform(0, 2 * np.pi, (n_locations, 1))
+    values = (scale * (1.2 + np.sin(days / 40 + phase))).astype(np.float32)
+    spread = np.linspace(0.6, 1.4, n_quantiles, dtype=np.float32)
+    prediction = values[:, encoder_length:]
+    return Forecast(
+        locations=np.array(["L{:03d}".format(i) for i in range(n_locations)]),
+        levels=np.linspace(0.02, 0.98, n_quantiles, dtype=np.float32),
+        quantiles=prediction[..., None] * spread,
+        prediction=prediction,
+        encoder_target=values[:, :encoder_length],
+        encoder_lengths=np.full(n_locations, encoder_length, dtype=np.int32),
+        decoder_lengths=np.full(n_locations, decoder_length, dtype=np.int32)
+    )
+
+
+def timed(function: Callable[[], bytes], repeat: int = 5) -> Tuple[float, bytes]:
+    """
+    Median seconds of a call and its last result
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Forecast bundle vs server-side figures")
+    parser.add_argument("--locations", type=int, default=230)
+    parser.add_argument("--mbps", type=float, default=10, help="bandwidth in Mbit/s")
+    parser.add_argument("--rtt", type=float, default=50, help="round trip time in ms")
+    parser.add_argument("--config", default="run_config.yml")
+    args = parser.parse_args()
+
+    config = load_run_config(args.config)
+    forecast = synthetic_forecast(args.locations, config.max_encoder_length, config.max_pred_length)
+    names = np.array(["Location {}".format(i) for i in range(args.locations)], dtype=object)
+    last_known = pd.Timestamp("2021-03-01")
+
+    def transfer_ms(n_bytes: int) -> float:
+        return n_bytes * 8 / (args.mbps * 1e6) * 1e3 + args.rtt
+
+    bundle_seconds, bundle = timed(lambda: json.dumps(
+        forecast_bundle(forecast, forecast.locations, names, last_known, "benchmark")
+    ).encode())
+    figure_seconds, figure = timed(lambda: plot_country_prediction(
+        forecast, 0, "Location 0", last_known, "2021-02-20"
+    ).to_json().encode())
+    bundle_gzip = len(gzip.compress(bundle, compresslevel=6))
+    figure_gzip = len(gzip.compress(figure, compresslevel=6))
+
+    bundle_tti = bundle_seconds * 1e3 + transfer_ms(bundle_gzip)
+    figure_tti = figure_seconds * 1e3 + transfer_ms(figure_gzip)
+    print("{} locations, {} Mbit/s, {:.0f} ms round trip".format(args.locations, args.mbps, args.rtt))
+    print("bundle (once per model and snapshot): {:.1f} ms to build, {:.0f} kB, {:.0f} kB gzipped, "
+          "~{:.0f} ms until interactive".format(
+              bundle_seconds * 1e3, len(bundle) / 1e3, bundle_gzip / 1e3, bundle_tti))
+    print("server figure (every switch):         {:.1f} ms to build, {:.0f} kB, {:.0f} kB gzipped, "
+          "~{:.0f} ms per switch".format(
+              figure_seconds * 1e3, len(figure) / 1e3, figure_gzip / 1e3, figure_tti))
+    print("bundle pays off after {:.1f} country switches; each switch after it needs "
+          "no request".format(bundle_tti / figure_tti))
+
+
+if __name__ == "__main__":
+    main()
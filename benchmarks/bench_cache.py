@@ -0,0 +1,93 @@
+"""
+Benchmark comparing cache hit latency of the ArrowCache backend against
+flask_caching's FileSystemCache for a prediction_timeseries-sized value.
+
+Usage:
+    python -m benchmarks.bench_cache [path/to/owid-covid-data.json]
+
+Without a path, a synthetic frame of similar shape is used. If torch is
+installed, a dictionary of tensors stands in for the TimeSeriesDataSet.
+"""
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from flask_caching.backends.filesystemcache import FileSystemCache
+
+from utils import data_retrieval
+from utils.arrow_cache import ArrowCache
+
+
+def synthetic_frame(n_locations: int = 230, n_days: int = 187,
+                    n_reals: int = 21) -> pd.DataFrame:
+    """
+    Frame shaped like the prediction data built in prediction_timeseries
+    """
+    rng = np.random.default_rng(0)
+    n_rows = n_locations * n_days
+    frame = pd.DataFrame(
+        rng.random((n_rows, n_reals)),
+        columns=["real_{}".format(i) for i in range(n_reals)]
+    )
+    frame.insert(0, "location", np.repeat(
+        ["LOC{:03d}".format(i) for i in range(n_locations)], n_days
+    ))
+    frame["date"] = pd.Timestamp("2021-01-01") + pd.to_timedelta(
+        np.tile(np.arange(n_days), n_locations), unit="D"
+    )
+    frame["time_idx"] = np.tile(np.arange(n_days), n_locations)
+    frame["month"] = frame.date.dt.month.astype(str).astype("category")
+    return frame
+
+
+def value_to_cache(frame: pd.DataFrame) -> list:
+    """
+    Cache value mimicking [prediction data, TimeSeriesDataSet]
+    """
+    try:
+        import torch
+    except ImportError:
+        return [frame, {"reals": frame.select_dtypes("float").to_numpy()}]
+
+    reals = torch.tensor(frame.select_dtypes("float").to_numpy(), dtype=torch.float32)
+    return [frame, {"reals": reals, "groups": torch.zeros(len(frame), 1, dtype=torch.long)}]
+
+
+def hit_latency(cache, value, repeat: int = 20) -> float:
+    """
+    Median wall-clock time of a cache hit in seconds
+    """
+    cache.set("prediction_timeseries", value, timeout=600)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cache.get("prediction_timeseries")
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        frame, _, _ = data_retrieval.prepare_data(pd.read_json(sys.argv[1], orient="index"))
+        # cached prediction data is imputed, see prediction_timeseries
+        reals = frame.select_dtypes("number").columns
+        frame[reals] = frame[reals].fillna(0)
+    else:
+        frame = synthetic_frame()
+    value = value_to_cache(frame)
+
+    print(f"rows: {len(frame)}, frame size: {frame.memory_usage(deep=True).sum() / 1e6:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as fs_dir, tempfile.TemporaryDirectory() as arrow_dir:
+        filesystem = hit_latency(FileSystemCache(fs_dir), value)
+        arrow = hit_latency(ArrowCache(arrow_dir), value)
+
+    print(f"FileSystemCache hit: {filesystem * 1e3:8.2f} ms")
+    print(f"ArrowCache hit:      {arrow * 1e3:8.2f} ms")
+    print(f"speedup:             {filesystem / arrow:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
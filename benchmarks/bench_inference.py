@@ -0,0 +1,99 @@
+"""
+Benchmark comparing prediction throughput under concurrent clients when
+inference runs in the request threads and when it runs in the inference
+pool.
+
+Usage:
+    python -m benchmarks.bench_inference path/to/owid-covid-data.json [clients ...]
+
+Uses the checkpoints in models/ and needs torch and pytorch_forecasting.
+Each client sends 8 requests for a random checkpoint. With "shared" data all
+clients predict on the same snapshot, so the pool can answer concurrent
+requests for the same model with one forward pass; with "distinct" data every
+request counts as new data.
+"""
+import random
+import sys
+import threading
+import time
+
+from typing import Callable, List
+
+from utils import data_retrieval
+from utils.asset_loader import model_loader
+from utils.forecast_store import predict_forecast
+from utils.inference_pool import InferencePool
+from utils.prediction_data import (build_prediction_timeseries, dataset_for_checkpoint,
+                                   reference_parameters)
+from utils.run_config import load_run_config, referenced_columns
+
+REQUESTS_PER_CLIENT: int = 8
+
+
+def throughput(request: Callable[[str, str], None], paths: List[str], clients: int,
+               shared: bool) -> float:
+    """
+    Requests per second completed by concurrent client threads
+
+    Args:
+        request (Callable): runs one request for a checkpoint path and data key
+        paths (List): checkpoint paths to choose from
+        clients (int): number of concurrent clients
+        shared (bool): if True, all requests use the same data key
+    """
+    def client(client_id: int) -> None:
+        rng = random.Random(client_id)
+        for i in range(REQUESTS_PER_CLIENT):
+            data_key = "shared" if shared else "{}-{}".format(client_id, i)
+            request(rng.choice(paths), data_key)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clients * REQUESTS_PER_CLIENT / (time.perf_counter() - start)
+
+
+def main() -> None:
+    clients = [int(arg) for arg in sys.argv[2:]] or [1, 4, 8]
+    config = load_run_config()
+    paths = [entry["value"] for entry in model_loader.get_dropdown_entries()]
+
+    data, _, _ = data_retrieval.stream_prepared_data(sys.argv[1], referenced_columns(config))
+    parameters = reference_parameters(paths)
+    pred_df, pred_ts = build_prediction_timeseries(data, config, parameters)
+
+    def inline(model_path: str, data_key: str) -> None:
+        dataset = dataset_for_checkpoint(model_path, pred_df, pred_ts, parameters)
+        predict_forecast(model_loader.load_asset(model_path), dataset)
+
+    pool = InferencePool("models", ".ckpt")
+    pool.start(preload=paths)
+
+    def pooled(model_path: str, data_key: str) -> None:
+        pool.submit(model_path, pred_df, pred_ts, data_key).result()
+
+    try:
+        # load models in both setups before timing
+        for path in paths:
+            inline(path, "warm-up")
+            pooled(path, "warm-up")
+
+        print("{:>8s} {:>9s} {:>12s} {:>12s}".format("clients", "data", "inline/s", "pool/s"))
+        for n in clients:
+            for shared in (False, True):
+                print("{:8d} {:>9s} {:12.2f} {:12.2f}".format(
+                    n,
+                    "shared" if shared else "distinct",
+                    throughput(inline, paths, n, shared),
+                    throughput(pooled, paths, n, shared)
+                ))
+        print(pool.stats())
+    finally:
+        pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark reporting resident size of the prediction data at each stage of
+the pipeline, with and without the compact dtype plan.
+
+Usage:
+    python -m benchmarks.bench_memory path/to/owid-covid-data.json
+
+The TimeSeriesDataSet stage is only reported if pytorch_forecasting is
+installed.
+"""
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+from utils import data_retrieval
+from utils.arrow_cache import ArrowCache
+from utils.dtype_plan import dataset_bytes, frame_bytes, memory_report
+from utils.prediction_data import build_prediction_frame, build_prediction_timeseries
+from utils.run_config import load_run_config, referenced_columns
+
+
+def cache_entry_bytes(value) -> int:
+    """
+    Size of a value's entry in the application's cache backend
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ArrowCache(cache_dir).set("entry", value)
+        return sum(
+            os.path.getsize(os.path.join(cache_dir, file))
+            for file in os.listdir(cache_dir)
+        )
+
+
+def main() -> None:
+    config = load_run_config()
+    data, _, _ = data_retrieval.stream_prepared_data(sys.argv[1], referenced_columns(config))
+
+    # the plan is applied at the end of build_prediction_frame; compare with
+    # the frame as it was before
+    pred_df, _ = build_prediction_frame(data.copy(), config)
+    uncompacted = pred_df.astype({
+        col: "float64" for col in pred_df.select_dtypes("float32").columns
+    })
+    uncompacted["location"] = uncompacted["location"].astype(object)
+
+    stages = {
+        "data_loader (prepared frame)": frame_bytes(data),
+        "prediction frame, float64/object": frame_bytes(uncompacted),
+        "prediction frame, dtype plan": frame_bytes(pred_df),
+        "cache entry, float64/object": cache_entry_bytes(uncompacted),
+        "cache entry, dtype plan": cache_entry_bytes(pred_df),
+    }
+
+    try:
+        _, pred_ts = build_prediction_timeseries(data.copy(), config)
+        stages["TimeSeriesDataSet"] = dataset_bytes(pred_ts)
+    except ImportError:
+        pass
+
+    print(memory_report(stages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark comparing the vectorized prepare_data against the previous
+per-country append loop on a full-size OWID snapshot.
+
+Usage:
+    python -m benchmarks.bench_prepare_data [path/to/owid-covid-data.json]
+
+If no path is given the current snapshot is downloaded from OWID.
+"""
+import sys
+import time
+
+import pandas as pd
+
+from utils import data_retrieval
+
+URL: str = "https://covid.ourworldindata.org/data/owid-covid-data.json"
+
+
+def legacy_concatenate(raw_ys: pd.Series) -> pd.DataFrame:
+    """
+    Previous implementation building the long frame one country at a time
+    (DataFrame.append is spelled as pd.concat to run on recent pandas)
+    """
+    ys = pd.DataFrame(raw_ys[0])
+    ys["location"] = raw_ys.index[0]
+    ys = ys.set_index("location")
+    ys = ys.reset_index()
+
+    for i in range(1, len(raw_ys)):
+        new_ys = pd.DataFrame(raw_ys[i])
+        new_ys["location"] = raw_ys.index[i]
+        ys = pd.concat([ys, new_ys])
+
+    return ys
+
+
+def vectorized_concatenate(raw_ys: pd.Series) -> pd.DataFrame:
+    """
+    Single pass explode as used by data_retrieval.prepare_data
+    """
+    records = raw_ys.explode().dropna()
+    ys = pd.DataFrame(records.tolist())
+    ys.insert(0, "location", records.index.to_numpy())
+    return ys
+
+
+def legacy_prepare_data(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Run prepare_data with the legacy concatenation step swapped in
+    """
+    xs = df.drop(columns="data")
+    ys = legacy_concatenate(df.data)
+    data = ys.join(xs, on='location', rsuffix="_x").drop(columns='location_x')
+    data['date'] = pd.to_datetime(data['date'])
+    data['time_idx'] = (data['date'] - data['date'].min()).dt.days
+    data["continent"] = data["continent"].fillna('Global')
+    data["tests_units"] = data["tests_units"].fillna('NA')
+    data["month"] = data.date.dt.month.astype(str).astype("category")
+    data["continent"] = data["continent"].astype("category")
+    data["tests_units"] = data["tests_units"].astype("category")
+    data.index = range(0, data.shape[0])
+    return data
+
+
+def timed(func, *args, repeat: int = 3) -> float:
+    """
+    Best wall-clock time of `repeat` calls in seconds
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    source = sys.argv[1] if len(sys.argv) > 1 else URL
+    if source.startswith("http"):
+        raw = data_retrieval.retrieve_data_from_url(source)
+    else:
+        raw = pd.read_json(source, orient="index")
+
+    print(f"locations: {len(raw)}, rows: {raw.data.str.len().sum()}")
+
+    # make sure both paths produce the same frame before timing them
+    expected = legacy_prepare_data(raw)
+    actual, _, _ = data_retrieval.prepare_data(raw)
+    pd.testing.assert_frame_equal(actual, expected)
+
+    legacy = timed(legacy_concatenate, raw.data)
+    vectorized = timed(vectorized_concatenate, raw.data)
+    full = timed(data_retrieval.prepare_data, raw)
+
+    print(f"legacy concatenation:     {legacy:8.3f}s")
+    print(f"vectorized concatenation: {vectorized:8.3f}s")
+    print(f"speedup:                  {legacy / vectorized:8.1f}x")
+    print(f"full prepare_data:        {full:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
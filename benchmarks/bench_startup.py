@@ -0,0 +1,63 @@
+"""
+Benchmark reporting the import time of the application's entry point and
+whether heavy ML modules are imported at startup.
+
+Usage:
+    python -m benchmarks.bench_startup [module]
+
+Runs `python -X importtime -c "import <module>"` (default: covid_dashboard)
+in a fresh interpreter and summarizes its output. Run it on two revisions to
+compare startup before and after a change.
+"""
+import subprocess
+import sys
+
+from typing import Dict, Tuple
+
+# modules that should only be imported once a prediction is requested
+HEAVY_MODULES: Tuple[str, ...] = ("torch", "pytorch_forecasting", "pytorch_lightning", "wandb")
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """
+    Cumulative import time in microseconds per imported module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times: Dict[str, int] = {}
+    nested: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # nesting is shown by indentation of the name column
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        target = times if depth == 0 else nested
+        target[name.strip()] = int(cumulative)
+    return {**nested, **times}
+
+
+def main() -> None:
+    module = sys.argv[1] if len(sys.argv) > 1 else "covid_dashboard"
+    times = import_times(module)
+
+    print(f"import {module}: {times[module] / 1e6:.3f}s")
+    print("slowest imports:")
+    others = {name: micros for name, micros in times.items() if name != module}
+    for name, micros in sorted(others.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {name:40s} {micros / 1e6:8.3f}s")
+
+    loaded = [name for name in HEAVY_MODULES if name in times]
+    print("heavy modules imported at startup:", ", ".join(loaded) or "none")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Offline benchmark suite timing the data and prediction pipeline on
+synthetic OWID data at several scales.
+
+Usage:
+    python -m benchmarks.bench_suite [--output results.json] [--repeat 3]
+                                     [--scales 20x200 100x300 230x400]
+
+For each scale (locations x days) a fixture is generated and served from a
+local file server. The suite then times these stages:
+- retrieve_data_from_url
+- prepare_data
+- the prediction_timeseries pipeline
+- model.predict with a tiny TFT checkpoint
+- plot_country_prediction
+
+Results go to a JSON file to compare across revisions. Stages that need
+torch and pytorch_forecasting are reported as skipped if those aren't
+installed.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fixtures import serve_directory, write_owid_fixture, write_tiny_checkpoint
+from utils import data_retrieval
+from utils.run_config import load_run_config
+
+from typing import Any, Callable, Dict, List, Tuple
+
+DEFAULT_SCALES: List[str] = ["20x200", "100x300", "230x400"]
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[Dict[str, float], Any]:
+    """
+    Wall-clock times of repeated calls
+
+    Returns:
+        tuple: min, median and max seconds, and the last call's result
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": float(np.median(times)),
+        "max": max(times),
+        "repeat": repeat
+    }, result
+
+
+def run_scale(n_locations: int, n_days: int, missing: float, repeat: int,
+              config_path: str, work_dir: str) -> Dict[str, Any]:
+    """
+    Time all stages for one fixture size
+    """
+    from utils.prediction_data import (build_prediction_timeseries, last_known_date,
+                                       load_dataset_parameters)
+
+    config = load_run_config(config_path)
+    path = write_owid_fixture(
+        os.path.join(work_dir, "owid-{}x{}.json".format(n_locations, n_days)),
+        config, n_locations, n_days, missing
+    )
+    server, base_url = serve_directory(work_dir)
+    stages: Dict[str, Any] = {}
+
+    try:
+        stages["retrieve_data_from_url"], raw = measure(
+            lambda: data_retrieval.retrieve_data_from_url(
+                "{}/{}".format(base_url, os.path.basename(path))
+            ),
+            repeat
+        )
+    finally:
+        server.shutdown()
+
+    stages["prepare_data"], (data, _, _) = measure(
+        lambda: data_retrieval.prepare_data(raw), repeat
+    )
+
+    try:
+        import torch
+    except ImportError:
+        for stage in ("prediction_timeseries", "model.predict", "plot_country_prediction"):
+            stages[stage] = "skipped: torch not installed"
+        return {"locations": n_locations, "days": n_days, "rows": len(data), "stages": stages}
+
+    from utils.asset_loader import ModelLoader
+    from utils.forecast_store import predict_forecast
+    from utils.plotting import plot_country_prediction
+
+    model_dir = os.path.join(work_dir, "models-{}x{}".format(n_locations, n_days))
+    os.makedirs(model_dir, exist_ok=True)
+    checkpoint = write_tiny_checkpoint(os.path.join(model_dir, "tiny.ckpt"), data.copy(), config)
+    parameters = load_dataset_parameters(checkpoint)
+
+    stages["prediction_timeseries"], (pred_df, pred_ts) = measure(
+        lambda: build_prediction_timeseries(data.copy(), config, parameters), repeat
+    )
+
+    model = ModelLoader(model_dir, ".ckpt").load_asset(checkpoint)
+    stages["model.predict"], forecast = measure(
+        lambda: predict_forecast(model, pred_ts), repeat
+    )
+
+    last_known = last_known_date(pred_df, config.max_pred_length)
+    stages["plot_country_prediction"], _ = measure(
+        lambda: plot_country_prediction(forecast, 0, "Location", last_known), repeat
+    )
+
+    return {"locations": n_locations, "days": n_days, "rows": len(data), "stages": stages}
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Versions and revision the results were measured on
+    """
+    revision = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    versions = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+    for module in ("torch", "pytorch_forecasting"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return {
+        "revision": revision or None,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "versions": versions,
+        "timestamp": pd.Timestamp.now(tz="UTC").isoformat()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run offline pipeline benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to write")
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES,
+                        help="fixture sizes as <locations>x<days>")
+    parser.add_argument("--missing", type=float, default=0.1, help="share of values left out")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--config", default="run_config.yml")
+    args = parser.parse_args()
+
+    results = {"environment": environment(), "scales": []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in args.scales:
+            n_locations, n_days = (int(part) for part in scale.split("x"))
+            result = run_scale(n_locations, n_days, args.missing, args.repeat,
+                               args.config, work_dir)
+            results["scales"].append(result)
+
+            for stage, timing in result["stages"].items():
+                summary = timing if isinstance(timing, str) else "{:9.1f} ms".format(timing["median"] * 1e3)
+                print("{:>10s} {:<25s} {}".format(scale, stage, summary), file=sys.stderr)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("results written to {}".format(args.output), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
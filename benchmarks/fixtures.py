@@ -0,0 +1,220 @@
+"""
+Synthetic fixtures for offline benchmarks: OWID-shaped JSON, a local file
+server standing in for covid.ourworldindata.org and a tiny TFT checkpoint.
+
+Usage:
+    python -m benchmarks.fixtures out.json [--locations 50] [--days 300] [--missing 0.1]
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.run_config import load_run_config
+
+from typing import Any, Dict, List, Tuple
+
+CONTINENTS: List[str] = ["Africa", "Asia", "Europe", "North America", "Oceania", "South America"]
+
+TESTS_UNITS: List[str] = ["tests performed", "people tested", "samples tested"]
+
+
+def owid_fixture(config: Any, n_locations: int = 50, n_days: int = 300,
+                 missing: float = 0.1, seed: int = 0) -> Dict[str, Any]:
+    """
+    OWID-shaped data: static columns per location and a list of daily records
+
+    As in the OWID file, missing daily values are left out of the record, and
+    locations with an "OWID_" code are aggregates without a continent.
+
+    Args:
+        config (Config): run configuration naming the static reals, time
+        varying reals and target to generate
+        n_locations (int): number of locations, one in ten is an aggregate
+        n_days (int): number of days per location
+        missing (float): share of daily values and static values left out
+        seed (int): random seed
+
+    Returns:
+        Dict: JSON-serializable data keyed by ISO code
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-03-01", periods=n_days, freq="D").strftime("%Y-%m-%d")
+    daily_columns = [
+        col for col in [*config.time_varying_known_reals, config.targets]
+        if col != "time_idx"
+    ]
+
+    # smooth, positive, trending series per location and column
+    t = np.arange(n_days)
+    phase = rng.uniform(0, 2 * np.pi, (n_locations, len(daily_columns), 1))
+    scale = rng.lognormal(5, 1.5, (n_locations, len(daily_columns), 1))
+    values = scale * (1.2 + np.sin(t / 40 + phase)) * (1 + t / n_days)
+    values *= rng.lognormal(0, 0.05, values.shape)
+    keep = rng.random(values.shape) >= missing
+
+    data = {}
+    for i in range(n_locations):
+        aggregate = i % 10 == 9
+        iso = "OWID_{:03d}".format(i) if aggregate else "L{:02d}".format(i)
+        location = {
+            "location": "Location {}".format(i),
+            **{
+                col: float(rng.lognormal(3, 1))
+                for col in config.static_reals
+                if rng.random() >= missing
+            }
+        }
+        if not aggregate:
+            location["continent"] = CONTINENTS[i % len(CONTINENTS)]
+
+        tests_units = TESTS_UNITS[i % len(TESTS_UNITS)]
+        location["data"] = [
+            {
+                "date": date,
+                **({} if aggregate else {"tests_units": tests_units}),
+                **{
+                    col: round(float(values[i, j, d]), 3)
+                    for j, col in enumerate(daily_columns)
+                    if keep[i, j, d]
+                }
+            }
+            for d, date in enumerate(dates)
+        ]
+        data[iso] = location
+
+    return data
+
+
+def write_owid_fixture(path: str, config: Any, n_locations: int = 50, n_days: int = 300,
+                       missing: float = 0.1, seed: int = 0) -> str:
+    """
+    Write OWID-shaped JSON, see owid_fixture
+
+    Returns:
+        str: path written to
+    """
+    with open(path, "w") as file:
+        json.dump(owid_fixture(config, n_locations, n_days, missing, seed), file)
+    return path
+
+
+def serve_directory(directory: str, etag: bool = True) -> Tuple[http.server.HTTPServer, str]:
+    """
+    Serve files from a directory on a free local port in a daemon thread
+
+    Like the OWID server, responses carry Last-Modified and, optionally, an
+    ETag, and conditional requests are answered with 304 Not Modified.
+
+    Args:
+        directory (str): directory to serve
+        etag (bool): if True, files are served with an ETag derived from
+        their size and modification time
+
+    Returns:
+        tuple: server (call shutdown() when done) and its base URL
+    """
+    handler = functools.partial(_QuietHandler, directory=directory, etag=etag)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="fixture-server", daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, *args: Any, etag: bool = True, **kwargs: Any):
+        self.etag = None
+        self.with_etag = etag
+        super().__init__(*args, **kwargs)
+
+    def send_head(self) -> Any:
+        path = self.translate_path(self.path)
+        if self.with_etag and os.path.isfile(path):
+            stat = os.stat(path)
+            self.etag = '"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+            if self.headers.get("If-None-Match") == self.etag:
+                self.send_response(http.server.HTTPStatus.NOT_MODIFIED)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    def end_headers(self) -> None:
+        if self.etag is not None:
+            self.send_header("ETag", self.etag)
+        super().end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def write_tiny_checkpoint(path: str, data: pd.DataFrame, config: Any) -> str:
+    """
+    Train a TFT with minimal sizes for a single step and save its checkpoint
+    with the training dataset parameters next to it
+
+    The model's forecasts are meaningless, but it has the structure and
+    input pipeline of the checkpoints in models/, so it can be used to time
+    loading and prediction.
+
+    Args:
+        path (str): checkpoint path ending in .ckpt
+        data (DataFrame): prepared OWID data, e.g. from a fixture
+        config (Config): run configuration as defined in run_config.yml
+
+    Returns:
+        str: path of the checkpoint
+    """
+    import pytorch_lightning as pl
+    from pytorch_forecasting import TemporalFusionTransformer
+    from pytorch_forecasting.metrics import QuantileLoss
+
+    from utils.prediction_data import (compact_imputed_data, fit_prediction_timeseries,
+                                       save_dataset_parameters)
+
+    data, impute_dummies = compact_imputed_data(data, config)
+    dataset = fit_prediction_timeseries(data, config, impute_dummies, predict=False)
+
+    model = TemporalFusionTransformer.from_dataset(
+        dataset,
+        hidden_size=4,
+        attention_head_size=1,
+        hidden_continuous_size=2,
+        output_size=7,
+        loss=QuantileLoss()
+    )
+    trainer = pl.Trainer(
+        max_epochs=1,
+        limit_train_batches=1,
+        logger=False,
+        checkpoint_callback=False,
+        weights_summary=None,
+        progress_bar_refresh_rate=0
+    )
+    trainer.fit(model, dataset.to_dataloader(train=True, batch_size=64, num_workers=0))
+    trainer.save_checkpoint(path)
+    save_dataset_parameters(dataset, path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write OWID-shaped JSON for benchmarks")
+    parser.add_argument("path", help="file to write")
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--days", type=int, default=300)
+    parser.add_argument("--missing", type=float, default=0.1,
+                        help="share of values left out")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--config", default="run_config.yml")
+    args = parser.parse_args()
+
+    write_owid_fixture(args.path, load_run_config(args.config), args.locations,
+                       args.days, args.missing, args.seed)
+    print("wrote {} ({:.1f} MB)".format(args.path, os.path.getsize(args.path) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
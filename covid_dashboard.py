@@ -1,21 +1,60 @@
 from app import app, cache
 import dash
+import importlib
+import threading
 from typing import Any, List
 from dash_components.dashboard_format import dashboard_layout
 from dash_components.callbacks import assign_callbacks
+from dash_components.api import assign_api_routes
+from utils.asset_loader import model_loader
+from utils.forecast_store import forecast_store
+from utils.inference_pool import inference_pool
+from utils.scheduler import scheduler
 
-def main() -> None:
+# heavy modules only needed for predictions; they are imported in the
+# background so the layout is served right away
+WARM_UP_MODULES: List[str] = ["torch", "pytorch_forecasting"]
+
+def main(preload_models: bool = True, refresh_interval: float = 600,
+         inference_workers: int = 2) -> None:
     """
     Entry point for the application
+
+    Args:
+        preload_models (bool): if True, checkpoints in models/ are loaded in
+        the background while the server starts
+        refresh_interval (float): seconds between background refreshes of
+        data and forecasts; refreshing is disabled if 0
+        inference_workers (int): number of worker processes running
+        predictions; predictions run in the callback threads if 0
     """
     set_layout(app, dashboard_layout)
     assign_callbacks(app)
+    assign_api_routes(app)
+
+    warm_up_imports(WARM_UP_MODULES)
+
+    model_paths = [entry["value"] for entry in model_loader.get_dropdown_entries()]
+    if inference_workers:
+        # models are held by the workers instead of the server process
+        inference_pool.workers = inference_workers
+        inference_pool.start(preload=model_paths if preload_models else None)
+        forecast_store.set_runner(inference_pool.forecast)
+    elif preload_models:
+        model_loader.preload()
+
+    if refresh_interval:
+        scheduler.start(refresh_interval)
 
     try:
 
         app.run_server(debug=False)
 
     finally:
+        scheduler.stop()
+        forecast_store.set_runner(None)
+        inference_pool.stop()
+
         # clear application cache on exit
         with app.server.app_context():
             cache.clear()
@@ -23,6 +62,28 @@ def main() -> None:
 
 
 
+def warm_up_imports(modules: List[str]) -> threading.Thread:
+    """
+    Import modules in a background thread, so the first callback using them
+    doesn't pay for the import
+
+
+    Args:
+        modules (List): names of modules to import
+
+
+    Returns:
+        Thread: daemon thread running the imports
+    """
+
+    def import_all() -> None:
+        for module in modules:
+            importlib.import_module(module)
+
+    thread = threading.Thread(target=import_all, name="import-warm-up", daemon=True)
+    thread.start()
+    return thread
+
 def set_layout(application: dash.Dash, layout: List[Any]) -> None:
     """
     Sets a layout for a dash application
@@ -0,0 +1,289 @@
+"""
+Module containing a REST API serving stored forecasts to other services.
+
+Routes on the Flask server underlying the Dash app:
+    GET /api/v1/models
+    GET /api/v1/forecasts/<model>[?locations=DEU,FRA]
+    GET /api/v1/forecasts/<model>/<iso_code>
+
+Forecasts are returned as a long table with one row per location and
+forecast day, either as columnar JSON (default) or as an Arrow IPC stream
+(?format=arrow or Accept: application/vnd.apache.arrow.stream). Responses are
+read from the forecasts precomputed by the scheduler, carry an ETag and
+Last-Modified tied to the model and data snapshot and are gzipped if the
+client accepts it, so bulk pulls cost neither inference nor serialization
+once a forecast has been requested.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from flask import Response, jsonify, request
+
+from utils.asset_loader import model_loader
+from utils.forecast_store import Forecast, forecast_store
+from utils.metrics import metrics
+from utils.prediction_data import last_known_date, reference_parameters
+from utils.scheduler import NotReady, scheduler
+
+from typing import Dict, Hashable, List, Optional, Tuple, TYPE_CHECKING
+
+# only the Flask server of the app is used
+if TYPE_CHECKING:
+    import dash
+
+API_PREFIX: str = "/api/v1"
+
+# response formats by name and their media types
+FORMATS: Dict[str, str] = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+
+def forecast_table(forecast: Forecast, rows: List[int], last_known: pd.Timestamp) -> pa.Table:
+    """
+    Long table of point and quantile forecasts, one row per location and
+    forecast day
+
+    Args:
+        forecast (Forecast): stored forecast for all locations
+        rows (List): rows of the locations in the forecast arrays
+        last_known (Timestamp): most recent date with known data; horizon 1
+        is the day after
+
+    Returns:
+        Table: columns location, date, horizon, prediction and one column
+        per quantile level, named e.g. "q0.9"
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    horizon = forecast.prediction.shape[1]
+    steps = np.arange(horizon)
+
+    # locations predicted for fewer days have no rows for the others
+    predicted = (steps[None, :] < forecast.decoder_lengths[rows][:, None]).ravel()
+    dates = (last_known.normalize() + pd.to_timedelta(steps + 1, unit="D")).to_numpy()
+
+    columns = {
+        "location": np.repeat(forecast.locations[rows], horizon)[predicted],
+        "date": np.tile(dates.astype("datetime64[D]"), len(rows))[predicted],
+        "horizon": np.tile((steps + 1).astype(np.int16), len(rows))[predicted],
+        "prediction": forecast.prediction[rows].ravel()[predicted]
+    }
+    quantiles = forecast.quantiles[rows].reshape(-1, len(forecast.levels))[predicted]
+    for i, level in enumerate(forecast.levels):
+        columns["q{:g}".format(level)] = quantiles[:, i]
+
+    return pa.table(columns)
+
+
+def encode_table(table: pa.Table, header: Dict[str, object], response_format: str) -> bytes:
+    """
+    Serialize a forecast table with descriptive header fields
+
+    Args:
+        table (Table): table as built by forecast_table
+        header (Dict): JSON-serializable fields describing the forecast;
+        stored as schema metadata in Arrow
+        response_format (str): "json" or "arrow"
+
+    Returns:
+        bytes: columnar JSON, or an Arrow IPC stream
+    """
+    if response_format == "arrow":
+        table = table.replace_schema_metadata(
+            {key: json.dumps(value) for key, value in header.items()}
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        values = column.to_numpy()
+        if values.dtype.kind == "f":
+            # shortest representation of float32 values in JSON
+            values = values.astype(np.float64).round(3)
+        elif values.dtype.kind == "M":
+            values = np.datetime_as_string(values, unit="D")
+        columns[name] = values.tolist()
+    return json.dumps({**header, "columns": columns}, separators=(",", ":")).encode()
+
+
+class BodyCache:
+    """
+    LRU cache of encoded response bodies bounded by their total size, so
+    repeated pulls of a forecast skip serialization and compression
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024**2):
+        self.__max_bytes = max_bytes
+        self.__bytes = 0
+        self.__entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self.__lock:
+            body = self.__entries.get(key)
+            if body is not None:
+                self.__entries.move_to_end(key)
+        metrics.increment("api_body_cache_requests", result="miss" if body is None else "hit")
+        return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        with self.__lock:
+            if key in self.__entries:
+                self.__bytes -= len(self.__entries.pop(key))
+            self.__entries[key] = body
+            self.__bytes += len(body)
+            while self.__bytes > self.__max_bytes and len(self.__entries) > 1:
+                self.__bytes -= len(self.__entries.popitem(last=False)[1])
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+
+# initialize body cache to be used in app
+body_cache = BodyCache()
+
+
+def model_names() -> Dict[str, str]:
+    """
+    Checkpoint paths by model name, the checkpoint's file name without ending
+    """
+    return {
+        os.path.splitext(entry["label"])[0]: entry["value"]
+        for entry in model_loader.get_dropdown_entries()
+    }
+
+
+def error(status: int, message: str, **fields: object) -> Tuple[Response, int]:
+    return jsonify({"error": message, **fields}), status
+
+
+def requested_format() -> Optional[str]:
+    """
+    Response format from the format parameter or the Accept header, None
+    if an unknown format is requested
+    """
+    if "format" in request.args:
+        name = request.args["format"]
+        return name if name in FORMATS else None
+    media_type = request.accept_mimetypes.best_match(
+        list(FORMATS.values()), default=FORMATS["json"]
+    )
+    return next(name for name, value in FORMATS.items() if value == media_type)
+
+
+def forecast_response(model_name: str, iso_codes: Optional[List[str]]) -> Response:
+    """
+    Forecasts of a model for some or all locations as a conditional response
+
+    Args:
+        model_name (str): name of the checkpoint in models/
+        iso_codes (List): locations to return; all locations if None
+    """
+    model_path = model_names().get(model_name)
+    if model_path is None:
+        return error(404, "unknown model", model=model_name)
+    response_format = requested_format()
+    if response_format is None:
+        return error(400, "unknown format", formats=list(FORMATS))
+
+    # same published data and stored forecasts as the dashboard
+    try:
+        results = scheduler.latest()
+    except NotReady:
+        return error(503, "forecasts are still loading")
+    pred_df, pred_ts = results["prediction_timeseries"]
+    key = forecast_store.key(model_path, pred_df)
+    forecast = forecast_store.get(
+        model_path, pred_df, pred_ts, model_loader.load_asset,
+        reference_parameters(list(model_names().values()))
+    )
+
+    # requests for all locations share one cached body
+    selection = tuple(iso_codes) if iso_codes is not None else None
+    if iso_codes is None:
+        iso_codes = forecast.locations.tolist()
+    rows = [forecast.row(iso_code) for iso_code in iso_codes]
+    missing = [iso_code for iso_code, row in zip(iso_codes, rows) if row is None]
+    if missing:
+        return error(404, "no forecast for locations", locations=missing)
+
+    gzipped = request.accept_encodings.quality("gzip") > 0
+    body_key = (*key, response_format, selection, gzipped)
+    body = body_cache.get(body_key)
+    if body is None:
+        # the prediction data ends with the forecast horizon
+        last_known = last_known_date(pred_df, forecast.prediction.shape[1])
+        header = {
+            "model": model_name,
+            "model_version": key[0],
+            "data_version": key[1],
+            "last_known_date": str(last_known.date()),
+            "quantiles": [round(float(level), 4) for level in forecast.levels]
+        }
+        table = forecast_table(forecast, rows, last_known)
+        body = encode_table(table, header, response_format)
+        if gzipped:
+            body = gzip.compress(body, compresslevel=6)
+        body_cache.put(body_key, body)
+
+    response = Response(body, mimetype=FORMATS[response_format])
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.vary.add("Accept")
+
+    # the entity changes with model, data, format, selection and encoding
+    response.set_etag(hashlib.sha1(repr(body_key).encode()).hexdigest()[:20])
+    modified = forecast_store.modified(key)
+    if modified is not None:
+        response.last_modified = modified
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def assign_api_routes(app: "dash.Dash") -> None:
+    """
+    Add the forecast API routes to the Flask server of an application
+    """
+    server = app.server
+
+    @server.route(API_PREFIX + "/models")
+    @metrics.timed("api_models")
+    def api_models() -> Response:
+        """
+        Names of the models forecasts can be requested for
+        """
+        return jsonify({"models": sorted(model_names())})
+
+    @server.route(API_PREFIX + "/forecasts/<model_name>")
+    @metrics.timed("api_forecasts")
+    def api_forecasts(model_name: str) -> Response:
+        """
+        Forecasts of a model for all locations, or the comma-separated ISO
+        codes in the locations parameter
+        """
+        locations = request.args.get("locations")
+        iso_codes = [code for code in locations.split(",") if code] if locations else None
+        return forecast_response(model_name, iso_codes)
+
+    @server.route(API_PREFIX + "/forecasts/<model_name>/<iso_code>")
+    @metrics.timed("api_location_forecast")
+    def api_location_forecast(model_name: str, iso_code: str) -> Response:
+        """
+        Forecasts of a model for a single location
+        """
+        return forecast_response(model_name, [iso_code])
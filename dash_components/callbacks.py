@@ -6,20 +6,24 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import pandas as pd
-import pytorch_forecasting as ptf
-import wandb
 
-from dash.dependencies import Input, Output, State
-from pytorch_forecasting.data import GroupNormalizer
-from pytorch_forecasting.data.timeseries import TimeSeriesDataSet
-from pytorch_forecasting.metrics import QuantileLoss
-from wandb.sdk.wandb_config import Config
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 
 from app import app, cache
 from utils.asset_loader import data_loader, model_loader
-from utils.plotting import plot_country_prediction
-
-from typing import Union, Any, List
+from utils.forecast_store import forecast_store
+from utils.location_catalog import LocationCatalog, load_iso_names
+from utils.metrics import metrics
+from utils.plotting import (figure_cache, forecast_bundle, plot_country_comparison,
+                            plot_country_prediction, plot_interpretation, plot_scenarios)
+from utils.prediction_data import build_prediction_timeseries, last_known_date, reference_parameters
+from utils.run_config import load_run_config, referenced_columns
+from utils.scenarios import MAX_SCENARIO_LOCATIONS, SCENARIO_COVARIATES, scenario_runner
+from utils.scheduler import NotReady, scheduler
+from utils.single_flight import single_flight
+
+from typing import Union, Any, Dict, List
 
 def assign_callbacks(app: dash.Dash) -> None:
     """
@@ -32,117 +36,74 @@ def assign_callbacks(app: dash.Dash) -> None:
     # IDEA: add entry for model name in yml to make sure models can only bbe used with the
     # right config file
     CONF: str = "run_config.yml"
-    run = wandb.init(mode="disabled", config=CONF)
-    config: Config = run.config
+    config = load_run_config(CONF)
+
+    # shown by the server-side charts until the first scheduler round is published
+    LOADING: str = "Data is still loading, please try again in a moment."
 
 
     # load most recent data into cache to be used across callbacks
     # see https://dash.plotly.com/sharing-data-between-callbacks
     # as to why this is necessary
-    @cache.cached(timeout=600)
+    # concurrent misses, also from other worker processes, share one build
+    @single_flight.cached(cache, "prediction_timeseries", timeout=600)
+    @metrics.timed("prediction_timeseries")
     def prediction_timeseries() -> List[Any]:
         """
         Load most recent dataset to use in predictions and construct Timeseries
         object to run preedictions on.
         """
 
-        # load data from URL
-        data = data_loader.load_asset_from_url(URL)
-
-
-        # get observations with insufficient data points
-
-        indices_to_drop = data.groupby("location").agg("size").loc[
-           (data.groupby("location").agg("size") <
-            config.max_encoder_length)
-           |
-           (data.groupby("location").agg("size") <
-            config.max_pred_length)
-        ].index.to_list()
-
-        #set training cutoff programatically
-        config.training_cutoff = data['time_idx'].max() - config.max_pred_length
-
-        # adjust data to match training format
-        data.drop(index=data.loc[data.location.isin(indices_to_drop)].index, inplace=True)
-        data = data.sort_values('location')
-
-        # make new columns indicating what will be imputed
-        cols_with_missing = (col for col in [
-            *config.static_reals,
-            *config.time_varying_known_reals,
-            config.targets
-        ] if data[col].isnull().any())
-
-        for col in cols_with_missing:
-            data[col + '_was_missing'] = data[col].isnull()
-
-        data[[
-            *config.static_reals,
-            *config.time_varying_known_reals,
-            config.targets
-        ]] = data[[
-        *config.static_reals,
-        *config.time_varying_known_reals,
-        config.targets]].fillna(0)
+        # stream data from URL, keeping only the columns used by the model
+        data = data_loader.load_asset_from_url(URL, referenced_columns(config))
 
+        # reuse fitted encoders and normalizers stored with the models
+        return build_prediction_timeseries(data, config, shared_parameters())
 
-        impute_dummies = [col for
-                          col in data.columns if col.endswith("_was_missing")]
-
-        data[impute_dummies] = data[impute_dummies].astype("str").astype("category")
-
-        # if the dataset still contains missing values for the target, count them and drop them
-        missing_targets = data.loc[data[config.targets].isna()][["location","date"]].copy(deep=True)
-        data.drop(index=missing_targets.index, inplace=True)
+    def model_paths() -> List[str]:
+        """
+        Paths of the checkpoints available for prediction
+        """
+        return [entry["value"] for entry in model_loader.get_dropdown_entries()]
 
-        # from pytorch tutorial
-        # select last 180 days
-        encoder_data = data[
-        lambda x: x.time_idx > x.time_idx.max() - config.max_encoder_length
-        ]
+    def shared_parameters() -> Dict[str, Any]:
+        """
+        Training dataset parameters the shared prediction dataset is built
+        from, None if no checkpoint has them stored
+        """
+        return reference_parameters(model_paths())
 
-        last_data = data[lambda x: x.time_idx == x.time_idx.max()]
-        decoder_data = pd.concat(
-            [
-                last_data.assign(
-                date=lambda x: x.date + pd.DateOffset(days=i))
-                for i in range(1, config.max_pred_length + 1)
-            ],
-            ignore_index=True,
-        )
+    def refresh_prediction_timeseries(results: Dict[str, Any]) -> List[Any]:
+        """
+        Scheduler job rebuilding the cached prediction data
+        """
+        with app.server.app_context():
+            cache.delete("prediction_timeseries")
+            return prediction_timeseries()
 
-        # add time index consistent with "data"
-        decoder_data["time_idx"] = decoder_data["date"].dt.year * 356 + decoder_data["date"].dt.day
-        decoder_data["time_idx"] += encoder_data["time_idx"].max() + 1 - decoder_data["time_idx"].min()
-
-        # adjust additional time feature(s)
-        decoder_data["month"] = decoder_data.date.dt.month.astype(str).astype("category")  # categories have be strings
-
-        # combine encoder and decoder data
-        new_prediction_data = pd.concat([encoder_data, decoder_data], ignore_index=True)
-
-        # create time series object
-        pred_ts = TimeSeriesDataSet(
-            new_prediction_data,
-            group_ids=["location"],
-            time_idx="time_idx",
-            static_categoricals=['location', 'continent', 'tests_units'],
-            static_reals = config.static_reals,
-            time_varying_known_categoricals=['month', *impute_dummies], #allow for missings to be flagged on country-level over time - needs to be assumed in forecasts
-            time_varying_known_reals=config.time_varying_known_reals,
-            target_normalizer=GroupNormalizer(groups=['location'], transformation=config.transformation),
-            add_relative_time_idx=True,
-            add_target_scales=True,
-            add_encoder_length=True,
-            target= config.targets,
-            max_encoder_length=config.max_encoder_length,
-            max_prediction_length=config.max_pred_length,
-            predict_mode=True,
-            allow_missings=True,
-        )
+    def build_location_catalog(results: Dict[str, Any]) -> LocationCatalog:
+        """
+        Scheduler job indexing the locations of fresh prediction data
+        """
+        pred_df, pred_ts = results["prediction_timeseries"]
+        return LocationCatalog.from_prediction_data(pred_df, load_iso_names())
 
-        return [new_prediction_data, pred_ts]
+    def precompute_forecasts(results: Dict[str, Any]) -> List[str]:
+        """
+        Scheduler job running predictions of all models on fresh data
+        """
+        pred_df, pred_ts = results["prediction_timeseries"]
+        paths = model_paths()
+        for model_path in paths:
+            forecast_store.get(model_path, pred_df, pred_ts, model_loader.load_asset,
+                               shared_parameters())
+        return paths
+
+    # callbacks read the scheduler's latest results, which are replaced only
+    # once data and forecasts of a refresh are complete
+    scheduler.register("prediction_timeseries", refresh_prediction_timeseries)
+    scheduler.register("locations", build_location_catalog)
+    scheduler.register("forecasts", precompute_forecasts)
 
     # new_prediction_data, pred_ts = prediction_timeseries()
 
@@ -151,108 +112,272 @@ def assign_callbacks(app: dash.Dash) -> None:
         Input("training-data-dropdown", "value"),
         prevent_initial_call=True
     )
+    @metrics.timed("callback_update_latest_training_date")
     def update_latest_training_date(path):
         """
         Callback to update last available training date
         """
-        df = data_loader.load_asset(path)
-
-        date = df.date.max()
+        # answered from snapshot metadata without loading the frame
+        date = data_loader.latest_date(path)
         return date
 
+    @app.callback(
+        Output("data-loading", "disabled"),
+        Input("data-loading", "n_intervals")
+    )
+    def stop_data_loading_retries(n_intervals):
+        """
+        Callback to stop retrying once the scheduler published its first round
+        """
+        return scheduler.ready
+
     @app.callback(
         Output("country-selector", "options"),
         Input("latest-training-date","children"),
+        Input("data-loading", "n_intervals"),
         prevent_initial_call=True
     )
-    def update_country_selection(date):
+    @metrics.timed("callback_update_country_selection")
+    def update_country_selection(date, n_intervals):
         """
         Callback to update country list with allowed country indices
         Strictly this won't depend on the las training date, due to the way
         we prepare the data, but we need an input to trigger population of the index
         """
         if date:
-            # get full prediction data (as df)
-            pred_df, pred_ts = prediction_timeseries()
-
-            # mapping of ISO3 names to country names
-            iso_name_df = pd.read_csv("iso3.csv")
-            iso_name_dict = dict(zip(iso_name_df.ISO3, iso_name_df.name))
-
-            # build new index to account for dropped observations
-            new_index = dict(
-                tuple(
-                    zip(
-                       pred_df.location.unique(),
-                       range(0,pred_df.location.nunique())
-                    )
-                )
-            )
-
-            # associate full names with index values of preedictions
-            options = [
-                {"label": iso_name_dict[location], "value": index}
-                if (not location.startswith("OWID")) else
-                {"label": location, "value": index}
-                for location, index in new_index.items()
-            ]
-
-            return options
+            # options are built once per data snapshot; retried while loading
+            try:
+                return scheduler.get("locations").dropdown_options()
+            except NotReady:
+                raise PreventUpdate
         else:
             return None
 
     @app.callback(
-        Output("plotting-area", "children"),
+        Output("forecast-bundle", "data"),
+        Output("forecast-bundle-version", "data"),
+        Input("model-dropdown", "value"),
+        Input("latest-training-date", "children"),
+        Input("forecast-bundle-refresh", "n_intervals"),
+        Input("data-loading", "n_intervals"),
+        State("forecast-bundle-version", "data"),
+        prevent_initial_call=True
+    )
+    @metrics.timed("callback_load_forecast_bundle")
+    def load_forecast_bundle(model_path, train_end, n_intervals, loading_intervals,
+                             loaded_version):
+        """
+        Callback sending the forecasts of all countries to the browser once
+        per model and data snapshot, so single countries are drawn there
+        """
+        if not model_path:
+            raise PreventUpdate
+
+        # retried while the first round is loading
+        try:
+            results = scheduler.latest()
+        except NotReady:
+            raise PreventUpdate
+        pred_df, pred_ts = results["prediction_timeseries"]
+        version = "-".join(forecast_store.key(model_path, pred_df))
+        if version == loaded_version:
+            raise PreventUpdate
+
+        forecast = forecast_store.get(model_path, pred_df, pred_ts, model_loader.load_asset,
+                                      shared_parameters())
+        locations = results["locations"]
+        bundle = forecast_bundle(forecast, locations.iso_codes, locations.names,
+                                 last_known_date(pred_df, config.max_pred_length), version)
+        return bundle, version
+
+    # selecting a single country runs in the browser once the bundle arrived
+    app.clientside_callback(
+        ClientsideFunction(namespace="forecast", function_name="render_selection"),
+        Output("country-graph", "figure"),
+        Output("country-graph", "style"),
+        Output("comparison-selection", "data"),
         Input("country-selector", "value"),
-        State("model-dropdown", "value"),
+        Input("forecast-bundle", "data"),
+        Input("latest-training-date", "children")
+    )
+
+    @app.callback(
+        Output("plotting-area", "children"),
+        Input("comparison-selection", "data"),
+        Input("comparison-layout", "value"),
+        # a new model redraws the comparison, as the bundle does for single
+        # countries
+        Input("model-dropdown", "value"),
         State("latest-training-date","children"),
         prevent_initial_call=True
     )
-    def plot_prediction(country_index, model_path, train_end):
+    @metrics.timed("callback_plot_prediction")
+    def plot_prediction(country_indices, comparison_layout, model_path, train_end):
         """
-        Callback to load model and load prediction for country
+        Callback comparing the predictions of several countries; single
+        countries are drawn in the browser from the forecast bundle, and here
+        only until the bundle arrived
         """
+        if not country_indices or not model_path:
+            return None
+        single = len(country_indices) == 1
 
-        # load specified model
-        model = model_loader.load_asset(model_path)
+        # get full prediction data (as df) and locations of the same refresh
+        try:
+            results = scheduler.latest()
+        except NotReady:
+            return html.P(LOADING)
+        pred_df, pred_ts = results["prediction_timeseries"]
 
-        # get full prediction data (as df)
-        pred_df, pred_ts = prediction_timeseries()
+        last_known = last_known_date(pred_df, config.max_pred_length)
 
-        day_zero = pred_df.date.max()
+        # get country name for plot title --> takes care of OWID aggregates
+        locations = results["locations"]
+        iso_codes = [locations.iso_codes[index] for index in country_indices]
 
-        # mapping of ISO3 names to country names
-        iso_name_df = pd.read_csv("iso3.csv")
-        iso_name_dict = dict(zip(iso_name_df.ISO3, iso_name_df.name))
+        # figures are built once per model, data snapshot and selection
+        figure_key = (
+            *forecast_store.key(model_path, pred_df), *iso_codes,
+            *(("single", train_end) if single else (comparison_layout,))
+        )
+        figure = figure_cache.get(figure_key)
+        if figure is not None:
+            return dcc.Graph(figure=figure)
+
+        # predictions for all countries are computed once per model and data
+        forecast = forecast_store.get(model_path, pred_df, pred_ts, model_loader.load_asset,
+                                      shared_parameters())
+
+        # locations unknown to the model's training data have no forecast
+        rows = [forecast.row(iso_code) for iso_code in iso_codes]
+        missing = [
+            locations.name(index) for index, row in zip(country_indices, rows)
+            if row is None
+        ]
+        if missing:
+            return html.P("No prediction available for {}.".format(", ".join(missing)))
 
-        # build new index to map index -> iso
-        new_index = dict(
-            tuple(
-                zip(
-                   range(0,pred_df.location.nunique()),
-                   pred_df.location.unique()
-               )
+        if single:
+            figure = plot_country_prediction(
+                forecast, rows[0], locations.name(country_indices[0]), last_known, train_end
             )
-        )
+        else:
+            # one batched forecast serves all selected countries
+            figure = plot_country_comparison(
+                forecast, rows, [locations.name(index) for index in country_indices],
+                last_known, comparison_layout
+            )
+        figure_cache.put(figure_key, figure)
 
+        return dcc.Graph(
+            figure=figure,
+            )
 
-        # get country name for plot title --> take care of OWID aggregates
-        country_name = (
-            new_index[country_index]
-            if new_index[country_index].startswith("OWID") else
-            iso_name_dict[new_index[country_index]]
-        )
+    # the interpretation panel is only requested while it is shown
+    app.clientside_callback(
+        ClientsideFunction(namespace="forecast", function_name="select_interpretation"),
+        Output("interpretation-selection", "data"),
+        Input("country-selector", "value"),
+        Input("interpretation-toggle", "value")
+    )
 
-        # make predictions on TimeSeries object
-        predictions, new_x = model.predict(pred_ts, mode="raw", return_x=True)
+    @app.callback(
+        Output("interpretation-area", "children"),
+        Input("interpretation-selection", "data"),
+        Input("model-dropdown", "value"),
+        prevent_initial_call=True
+    )
+    @metrics.timed("callback_plot_interpretation")
+    def plot_interpretation_panel(country_index, model_path):
+        """
+        Callback to show attention and variable importances of a country,
+        read from the arrays stored with the model's forecast
+        """
+        if country_index is None or not model_path:
+            return None
 
-        # prepare data needed for plot
-        figure = plot_country_prediction(model, predictions, new_x, country_index, country_name,
-                                    day_zero, train_end)
+        try:
+            results = scheduler.latest()
+        except NotReady:
+            return html.P(LOADING)
+        pred_df, pred_ts = results["prediction_timeseries"]
+        locations = results["locations"]
+        iso_code = locations.iso_codes[country_index]
+
+        figure_key = (*forecast_store.key(model_path, pred_df), iso_code, "interpretation")
+        figure = figure_cache.get(figure_key)
+        if figure is not None:
+            return dcc.Graph(figure=figure)
+
+        # computed in the forward pass of the forecast, never on its own
+        interpretation = forecast_store.interpretation(
+            model_path, pred_df, pred_ts, model_loader.load_asset, shared_parameters()
+        )
+        forecast = forecast_store.get(model_path, pred_df, pred_ts, model_loader.load_asset,
+                                      shared_parameters())
+        row = forecast.row(iso_code)
+        if interpretation is None or row is None:
+            return html.P("No interpretation available for {}.".format(
+                locations.name(country_index)
+            ))
+
+        figure = plot_interpretation(interpretation, row, locations.name(country_index),
+                                     last_known_date(pred_df, config.max_pred_length))
+        figure_cache.put(figure_key, figure)
+
+        return dcc.Graph(figure=figure)
+
+    # scenarios are only requested while a slider is away from zero
+    app.clientside_callback(
+        ClientsideFunction(namespace="forecast", function_name="select_scenario"),
+        Output("scenario-request", "data"),
+        Input("country-selector", "value"),
+        *[Input("scenario-" + col, "value") for col in SCENARIO_COVARIATES]
+    )
 
-        return dcc.Graph(
-            figure=figure,
+    @app.callback(
+        Output("scenario-area", "children"),
+        Input("scenario-request", "data"),
+        Input("model-dropdown", "value"),
+        prevent_initial_call=True
+    )
+    @metrics.timed("callback_plot_scenario")
+    def plot_scenario(request, model_path):
+        """
+        Callback to predict the variants of a what-if scenario for the
+        selected countries only, in a single forward pass
+        """
+        if request is None or not model_path:
+            return None
+
+        country_indices = request["countries"]
+        if len(country_indices) > MAX_SCENARIO_LOCATIONS:
+            return html.P("Scenarios are limited to {} countries.".format(MAX_SCENARIO_LOCATIONS))
+
+        try:
+            results = scheduler.latest()
+        except NotReady:
+            return html.P(LOADING)
+        pred_df, pred_ts = results["prediction_timeseries"]
+        locations = results["locations"]
+        iso_codes = [locations.iso_codes[index] for index in country_indices]
+        changes = {
+            col: percent / 100 for col, percent in zip(SCENARIO_COVARIATES, request["changes"])
+        }
+
+        try:
+            scenario = scenario_runner.run(
+                model_path, pred_df, pred_ts, iso_codes, changes, model_loader.load_asset,
+                forecast_store.key(model_path, pred_df)
             )
+        except ValueError:
+            return html.P("No scenario available for {}.".format(
+                ", ".join(locations.name(index) for index in country_indices)
+            ))
+
+        # windows are ordered like the dataset, not like the selection
+        names = {iso_code: locations.name(index) for iso_code, index in zip(iso_codes, country_indices)}
+        figure = plot_scenarios(scenario, [names[iso_code] for iso_code in scenario.locations],
+                                last_known_date(pred_df, config.max_pred_length))
 
-    # end wandb run
-    run.finish()
+        return dcc.Graph(figure=figure)
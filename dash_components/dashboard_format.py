@@ -6,6 +6,7 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 from utils.asset_loader import data_loader, model_loader
+from utils.scenarios import SCENARIO_COVARIATES
 
 intro = html.Div(id="intro-root",
     children=[
@@ -115,8 +116,8 @@ plotting_controls = html.Div(id="plotting-control-root",
                         dbc.Spinner(
                             dcc.Dropdown(
                             id="country-selector",
-                            placeholder="Choose a Country",
-                            multi=False,
+                            placeholder="Choose one or more Countries",
+                            multi=True,
                             style={
                                 "MarginTop": "30px",
                                 "MarginBottom": "30px",
@@ -129,6 +130,51 @@ plotting_controls = html.Div(id="plotting-control-root",
                     ],
                     style={"size": 1, "offset": 3}
                 ),
+                dbc.Col(
+                    children=[
+                        dbc.Row(
+                            html.B("Comparison Layout")
+                        ),
+                        dcc.RadioItems(
+                            id="comparison-layout",
+                            options=[
+                                {"label": "Overlay", "value": "overlay"},
+                                {"label": "Small Multiples", "value": "multiples"}
+                            ],
+                            value="overlay",
+                            labelStyle={"display": "inline-block", "margin-right": "10px"}
+                        ),
+                        dcc.Checklist(
+                            id="interpretation-toggle",
+                            options=[{"label": "Show Model Interpretation", "value": "show"}],
+                            value=[]
+                        )
+                    ],
+                    width=3
+                ),
+                dbc.Col(
+                    children=[
+                        dbc.Row(
+                            html.B("What-If Scenario")
+                        ),
+                        # change of each covariate over the prediction horizon
+                        *[
+                            html.Div([
+                                html.Label(col.replace("_", " ").capitalize()),
+                                dcc.Slider(
+                                    id="scenario-" + col,
+                                    min=-100,
+                                    max=100,
+                                    step=10,
+                                    value=0,
+                                    marks={-100: "-100%", 0: "0%", 100: "+100%"}
+                                )
+                            ])
+                            for col in SCENARIO_COVARIATES
+                        ]
+                    ],
+                    width=3
+                ),
             ]
         ),
     ]
@@ -136,9 +182,34 @@ plotting_controls = html.Div(id="plotting-control-root",
 
 plotting_area = html.Div(id="plotting-area-root",
     children=[
+        # forecasts of all countries, drawn in the browser by
+        # assets/forecast_bundle.js when a single country is selected
+        dcc.Store(id="forecast-bundle"),
+        dcc.Store(id="forecast-bundle-version"),
+        # countries drawn by the server, written by the browser for several
+        # countries or for one while the forecast bundle is loading
+        dcc.Store(id="comparison-selection"),
+        # country to interpret, written by the browser while the panel is shown
+        dcc.Store(id="interpretation-selection"),
+        # countries and covariate changes of a what-if scenario, written by
+        # the browser while a scenario slider is not at zero
+        dcc.Store(id="scenario-request"),
+        # checks for a newer data snapshot at the scheduler's default interval
+        dcc.Interval(id="forecast-bundle-refresh", interval=600 * 1000),
+        # retries loading country options and forecasts until the first
+        # scheduler round is published; disabled afterwards
+        dcc.Interval(id="data-loading", interval=2 * 1000),
         dbc.Row(
-            dbc.Col(id="plotting-area",
-                children=None,
+            dbc.Col(
+                children=[
+                    dcc.Graph(id="country-graph", style={"display": "none"}),
+                    # comparisons of several countries are built on the server
+                    html.Div(id="plotting-area"),
+                    # attention and variable importances from stored arrays
+                    html.Div(id="interpretation-area"),
+                    # scenario variants predicted for the selected countries
+                    html.Div(id="scenario-area")
+                ],
                 style={"size": 1,
                 "offset": 3,
                 "MarginTop": "30px",
@@ -0,0 +1,44 @@
+"""
+Shared fixtures: the run configuration and small synthetic OWID data
+"""
+import json
+
+import pytest
+
+from benchmarks.fixtures import owid_fixture
+from utils.run_config import load_run_config
+
+
+@pytest.fixture(scope="session")
+def config():
+    return load_run_config("run_config.yml")
+
+
+@pytest.fixture
+def owid_data(config):
+    """
+    OWID-shaped data for a few locations, with an explicit null in a daily
+    numeric column as OWID sometimes sends
+    """
+    data = owid_fixture(config, n_locations=12, n_days=60, seed=1)
+    data["L01"]["data"][5]["stringency_index"] = None
+    return data
+
+
+@pytest.fixture
+def owid_path(tmp_path, owid_data):
+    path = tmp_path / "owid-covid-data.json"
+    path.write_text(json.dumps(owid_data))
+    return path
+
+
+@pytest.fixture
+def app_dir(monkeypatch, tmp_path):
+    """
+    Empty working directory with the data/ and models/ directories listed
+    by the module-level loaders of utils.asset_loader
+    """
+    (tmp_path / "data").mkdir()
+    (tmp_path / "models").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+from benchmarks.fixtures import owid_fixture
+from utils import data_retrieval
+from utils.forecast_store import Forecast
+from utils.prediction_data import build_prediction_frame, last_known_date
+
+
+@pytest.fixture
+def prepared(config):
+    raw = pd.DataFrame.from_dict(owid_fixture(config, n_locations=12, n_days=250), "index")
+    data, _, _ = data_retrieval.prepare_data(raw)
+    pred_df, _ = build_prediction_frame(data, config)
+    return data, pred_df
+
+
+def constant_forecast(locations, horizon, n_quantiles=7):
+    prediction = np.ones((len(locations), horizon), dtype=np.float32)
+    return Forecast(
+        locations=np.asarray(locations, dtype=str),
+        levels=np.linspace(0.02, 0.98, n_quantiles, dtype=np.float32),
+        quantiles=prediction[..., None] * np.linspace(0.5, 1.5, n_quantiles, dtype=np.float32),
+        prediction=prediction,
+        encoder_target=np.ones((len(locations), 10), dtype=np.float32),
+        encoder_lengths=np.full(len(locations), 10, dtype=np.int32),
+        decoder_lengths=np.full(len(locations), horizon, dtype=np.int32)
+    )
+
+
+def test_last_known_date_leaves_out_horizon(prepared, config):
+    data, pred_df = prepared
+
+    assert last_known_date(pred_df, config.max_pred_length) == data.date.max()
+
+
+@pytest.fixture
+def client(monkeypatch, app_dir, prepared, config):
+    from dash_components import api
+
+    _, pred_df = prepared
+    forecast = constant_forecast(pd.unique(pred_df.location.astype(str)), config.max_pred_length)
+    monkeypatch.setattr(api, "model_names", lambda: {"tiny": "models/tiny.ckpt"})
+    monkeypatch.setattr(api.scheduler, "latest",
+                        lambda: {"prediction_timeseries": (pred_df, None)})
+    monkeypatch.setattr(api.forecast_store, "key", lambda model_path, data: ("model", "data"))
+    monkeypatch.setattr(api.forecast_store, "get", lambda *args, **kwargs: forecast)
+    monkeypatch.setattr(api.forecast_store, "modified", lambda key: None)
+    api.body_cache.clear()
+
+    server = Flask(__name__)
+    api.assign_api_routes(SimpleNamespace(server=server))
+    yield server.test_client()
+    api.body_cache.clear()
+
+
+def test_forecast_dates_follow_last_known_date(client, prepared, config):
+    data, _ = prepared
+    last_known = data.date.max()
+
+    response = client.get("/api/v1/forecasts/tiny/L00")
+    assert response.status_code == 200
+    body = response.get_json()
+
+    assert body["last_known_date"] == str(last_known.date())
+    expected = [
+        str((last_known + pd.Timedelta(days=h)).date())
+        for h in range(1, config.max_pred_length + 1)
+    ]
+    assert body["columns"]["date"] == expected
+    assert body["columns"]["horizon"] == list(range(1, config.max_pred_length + 1))
+
+
+def test_forecasts_unavailable_while_first_round_loads(monkeypatch, client):
+    from dash_components import api
+
+    def not_ready():
+        raise api.NotReady("precomputed data is still loading")
+
+    monkeypatch.setattr(api.scheduler, "latest", not_ready)
+
+    response = client.get("/api/v1/forecasts/tiny/L00")
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "forecasts are still loading"
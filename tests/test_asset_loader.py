@@ -0,0 +1,23 @@
+
+def test_preload_skips_failing_checkpoints(monkeypatch, app_dir):
+    from utils.asset_loader import ModelLoader
+    from utils.metrics import metrics
+
+    for name in ("a.ckpt", "b.ckpt", "c.ckpt"):
+        (app_dir / "models" / name).write_bytes(b"weights")
+    loader = ModelLoader("models", ".ckpt")
+    loaded = []
+
+    def load_asset(path):
+        if path.endswith("a.ckpt"):
+            raise RuntimeError("corrupt checkpoint")
+        loaded.append(path)
+
+    monkeypatch.setattr(loader, "load_asset", load_asset)
+    loader.preload(background=False)
+
+    assert sorted(loaded) == ["models/b.ckpt", "models/c.ckpt"]
+    assert list(loader.preload_errors) == ["models/a.ckpt"]
+    assert "corrupt checkpoint" in loader.preload_errors["models/a.ckpt"]
+    counters = metrics.snapshot()["counters"]
+    assert counters[("model_preload_errors", (("path", "models/a.ckpt"),))] >= 1
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import owid_fixture
+from utils import data_retrieval
+from utils.backtest import origin_time_idx, window_hashes
+from utils.prediction_data import compact_imputed_data
+
+
+@pytest.fixture
+def daily_updates(config):
+    """
+    Imputed data as published on two consecutive days
+    """
+    raw = pd.DataFrame.from_dict(owid_fixture(config, n_locations=12, n_days=260), "index")
+    data, _, _ = data_retrieval.prepare_data(raw)
+    yesterday = data.loc[data.date < data.date.max()].copy()
+    return compact_imputed_data(yesterday, config)[0], compact_imputed_data(data, config)[0]
+
+
+def test_origins_stay_fixed_as_days_are_added(daily_updates, config):
+    yesterday, today = daily_updates
+    step = 7
+
+    before = origin_time_idx(yesterday, config, n_origins=4, step=step)
+    after = origin_time_idx(today, config, n_origins=4, step=step)
+
+    assert all(origin % step == 0 for origin in before + after)
+    assert all(origin <= today.time_idx.max() - config.max_pred_length for origin in after)
+    # at most the newest origin is new
+    assert set(after[1:]) <= set(before)
+
+
+def test_stored_windows_match_after_an_update(daily_updates, config):
+    yesterday, today = daily_updates
+    origins = [
+        origin for origin in origin_time_idx(today, config, n_origins=4, step=7)
+        if origin in origin_time_idx(yesterday, config, n_origins=4, step=7)
+    ]
+    assert origins
+
+    assert window_hashes(today, config, origins) == window_hashes(yesterday, config, origins)
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from utils import data_retrieval
+from utils.run_config import referenced_columns
+
+
+def test_stream_matches_prepare_data(config, owid_data, owid_path):
+    columns = referenced_columns(config)
+    expected, _, _ = data_retrieval.prepare_data(pd.DataFrame.from_dict(owid_data, "index"))
+    actual, _, _ = data_retrieval.stream_prepared_data(str(owid_path), columns)
+
+    shared = [col for col in expected.columns if col in actual.columns]
+    assert set(columns) | {"time_idx", "month"} <= set(shared)
+    pdt.assert_frame_equal(actual[shared], expected[shared], check_dtype=False,
+                           check_categorical=False)
+    assert actual.stringency_index.dtype == np.float64
+
+
+def test_stream_reads_null_as_nan(owid_path, config):
+    data, _, _ = data_retrieval.stream_prepared_data(str(owid_path), referenced_columns(config))
+
+    row = data.loc[(data.location == "L01") & (data.date == "2020-03-06")]
+    assert len(row) == 1
+    assert np.isnan(row.stringency_index.iloc[0])
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.forecast_store import Forecast, ForecastStore
+
+
+def one_forecast():
+    return Forecast(
+        locations=np.asarray(["L00"]),
+        levels=np.asarray([0.5], dtype=np.float32),
+        quantiles=np.ones((1, 3, 1), dtype=np.float32),
+        prediction=np.ones((1, 3), dtype=np.float32),
+        encoder_target=np.ones((1, 5), dtype=np.float32),
+        encoder_lengths=np.full(1, 5, dtype=np.int32),
+        decoder_lengths=np.full(1, 3, dtype=np.int32)
+    )
+
+
+@pytest.fixture
+def store_args(monkeypatch, tmp_path):
+    # lock files of single_flight are kept relative to the working directory
+    (tmp_path / "cache").mkdir()
+    monkeypatch.chdir(tmp_path)
+    model_path = tmp_path / "model.ckpt"
+    model_path.write_bytes(b"weights")
+    pred_df = pd.DataFrame({"location": ["L00"] * 8, "time_idx": np.arange(8)})
+    return ForecastStore(str(tmp_path / "forecasts")), str(model_path), pred_df
+
+
+def test_concurrent_requests_compute_once(store_args):
+    store, model_path, pred_df = store_args
+    runs = []
+
+    def runner(*args):
+        runs.append(True)
+        time.sleep(0.3)
+        return one_forecast()
+
+    store.set_runner(runner)
+    forecasts = []
+    threads = [
+        threading.Thread(target=lambda: forecasts.append(store.get(model_path, pred_df, None, None)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert len(runs) == 1
+    assert len(forecasts) == 4
+
+
+def test_failed_computation_is_retried(store_args):
+    store, model_path, pred_df = store_args
+    outcomes = [RuntimeError("worker died"), one_forecast()]
+
+    def runner(*args):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    store.set_runner(runner)
+    with pytest.raises(RuntimeError, match="worker died"):
+        store.get(model_path, pred_df, None, None)
+
+    assert store.get(model_path, pred_df, None, None).row("L00") == 0
+    assert outcomes == []
@@ -0,0 +1,47 @@
+import time
+
+import pandas as pd
+import pytest
+
+from utils.forecast_store import RunnerUnavailable
+from utils.inference_pool import InferenceError, InferencePool, PoolUnhealthy
+
+
+def test_requests_of_dead_worker_fail_fast(tmp_path):
+    # workers can't list a missing model directory and exit on start
+    pool = InferencePool(str(tmp_path / "missing"), ".ckpt", workers=1, liveness_interval=0.1)
+    pool.start()
+    try:
+        future = pool.submit(str(tmp_path / "model.ckpt"), pd.DataFrame(), None)
+        with pytest.raises(InferenceError, match="exit code"):
+            future.result(timeout=60)
+        assert pool.stats()["worker_restarts"] >= 1
+        assert pool.stats()["pending_batches"] == 0
+    finally:
+        pool.stop()
+
+
+def test_crashing_worker_restarts_are_bounded(tmp_path):
+    pool = InferencePool(
+        str(tmp_path / "missing"), ".ckpt", workers=1, liveness_interval=0.05,
+        restart_backoff=0.05, max_restarts=3, restart_window=60
+    )
+    pool.start()
+    try:
+        deadline = time.monotonic() + 60
+        while pool.healthy and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not pool.healthy
+
+        # no restarts once the pool gave up on the worker
+        time.sleep(0.5)
+        assert pool.stats()["worker_restarts"] == 3
+        assert not pool.stats()["healthy"]
+
+        # the forecast store computes inline instead of waiting for the pool
+        with pytest.raises(RunnerUnavailable):
+            pool.submit(str(tmp_path / "model.ckpt"), pd.DataFrame(), None)
+        with pytest.raises(PoolUnhealthy, match="died 4 times"):
+            pool.forecast(str(tmp_path / "model.ckpt"), pd.DataFrame(), None)
+    finally:
+        pool.stop()
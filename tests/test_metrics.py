@@ -0,0 +1,14 @@
+from utils.metrics import MetricsRegistry
+
+
+def test_render_escapes_label_values():
+    registry = MetricsRegistry()
+    registry.increment("model_loads", path='models/a"b\\c\nd.ckpt')
+    registry.observe('stage "quoted"', 0.01)
+
+    text = registry.render()
+
+    assert 'covid_dashboard_model_loads_total{path="models/a\\"b\\\\c\\nd.ckpt"} 1' in text
+    assert 'stage="stage \\"quoted\\""' in text
+    # every sample stays on its own line
+    assert all(line.startswith(("#", "covid_dashboard_")) for line in text.splitlines())
@@ -0,0 +1,51 @@
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.fixtures import owid_fixture, write_tiny_checkpoint
+from utils import data_retrieval
+from utils.model_export import artifact_path, export_checkpoint, parity_report
+
+
+def test_parity_report_gates_on_mae_and_quantile_loss():
+    reference = {"mae": 100.0, "quantile_loss": 10.0, "seconds": 1.0}
+
+    assert parity_report(reference, {"mae": 101.0, "quantile_loss": 10.1, "seconds": 0.5})["passed"]
+    # faster artifacts may still be refused for accuracy
+    assert not parity_report(reference, {"mae": 103.0, "quantile_loss": 10.0, "seconds": 0.5})["passed"]
+    assert not parity_report(reference, {"mae": 100.0, "quantile_loss": 10.3, "seconds": 0.5})["passed"]
+    # more accurate artifacts pass
+    assert parity_report(reference, {"mae": 90.0, "quantile_loss": 9.0, "seconds": 2.0})["passed"]
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory, config):
+    pytest.importorskip("torch")
+    pytest.importorskip("pytorch_forecasting")
+
+    raw = pd.DataFrame.from_dict(owid_fixture(config, n_locations=12, n_days=220), "index")
+    data, _, _ = data_retrieval.prepare_data(raw)
+    path = write_tiny_checkpoint(str(tmp_path_factory.mktemp("models") / "tiny.ckpt"), data, config)
+    return path, data
+
+
+def test_export_refused_when_parity_fails(checkpoint, config):
+    path, data = checkpoint
+
+    # no artifact can be more than 100% better than the fp32 model
+    report = export_checkpoint(path, data.copy(), config, tolerance=-1.0)
+
+    assert not report["parity"]["passed"]
+    assert report["artifact"] is None
+    assert not os.path.exists(artifact_path(path))
+
+
+def test_export_stored_when_parity_passes(checkpoint, config):
+    path, data = checkpoint
+
+    report = export_checkpoint(path, data.copy(), config, tolerance=float("inf"))
+
+    assert report["parity"]["passed"]
+    assert report["artifact"] == artifact_path(path)
+    assert os.path.exists(report["artifact"])
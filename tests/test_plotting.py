@@ -0,0 +1,67 @@
+import base64
+
+import numpy as np
+import pandas as pd
+
+from utils.forecast_store import Forecast
+from utils.plotting import forecast_bundle, plot_country_comparison, plot_country_prediction
+
+
+def ramp_forecast(n_locations=3, encoder_length=10, horizon=5, n_quantiles=3):
+    prediction = np.ones((n_locations, horizon), dtype=np.float32)
+    return Forecast(
+        locations=np.asarray(["L{:02d}".format(i) for i in range(n_locations)]),
+        levels=np.linspace(0.1, 0.9, n_quantiles, dtype=np.float32),
+        quantiles=prediction[..., None] * np.linspace(0.5, 1.5, n_quantiles, dtype=np.float32),
+        prediction=prediction,
+        encoder_target=np.tile(np.arange(encoder_length, dtype=np.float32), (n_locations, 1)),
+        encoder_lengths=np.full(n_locations, encoder_length, dtype=np.int32),
+        decoder_lengths=np.full(n_locations, horizon, dtype=np.int32)
+    )
+
+
+def test_charts_predict_from_the_day_after_the_last_known_one():
+    forecast = ramp_forecast()
+    last_known = pd.Timestamp("2021-03-01")
+    first_predicted = np.datetime64("2021-03-02")
+
+    observed, predicted = plot_country_prediction(forecast, 0, "L00", last_known).data[1:]
+    assert pd.Timestamp(observed.x[np.nanargmax(observed.y)]) == last_known
+    assert predicted.x[np.flatnonzero(~np.isnan(predicted.y))[0]] == first_predicted
+
+    # the predicted line starts at the last known value
+    history, prediction = plot_country_comparison(
+        forecast, [0, 1], ["L00", "L01"], last_known, max_history_points=10
+    ).data[:2]
+    assert history.x[-1] == np.datetime64(last_known)
+    assert prediction.x[0] == np.datetime64(last_known)
+    assert prediction.x[1] == first_predicted
+
+    bundle = forecast_bundle(forecast, forecast.locations, forecast.locations, last_known, "v")
+    assert bundle["last_known"] == "2021-03-01"
+
+
+def test_short_encoders_end_on_the_last_known_day():
+    # encoders are right-padded: the second location only knows 6 days
+    forecast = ramp_forecast(n_locations=2)
+    forecast.encoder_lengths[1] = 6
+    forecast.encoder_target[1, 6:] = 0
+    last_known = pd.Timestamp("2021-03-01")
+
+    fig = plot_country_comparison(
+        forecast, [0, 1], ["L00", "L01"], last_known, max_history_points=10
+    )
+    history, prediction = fig.data[2:4]
+    assert history.y[-1] == 5
+    assert np.isnan(history.y[:4]).all()
+    assert prediction.y[0] == 5
+
+    observed = plot_country_prediction(forecast, 1, "L01", last_known).data[1]
+    known = ~np.isnan(observed.y)
+    assert observed.y[known].tolist() == list(range(6))
+    assert pd.Timestamp(observed.x[np.flatnonzero(known)[-1]]) == last_known
+
+    bundle = forecast_bundle(forecast, forecast.locations, forecast.locations, last_known, "v")
+    history = np.frombuffer(base64.b64decode(bundle["history"]), dtype="<f4").reshape(2, -1)
+    assert history[1, -1] == 5
+    assert np.isnan(history[1, :4]).all()
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pandas.testing as pdt
+import pytest
+
+from benchmarks.fixtures import serve_directory
+from utils import data_retrieval
+from utils.run_config import referenced_columns
+
+
+@pytest.fixture
+def loader(app_dir):
+    from utils.asset_loader import DataLoader
+
+    return DataLoader("data", snapshot_location="snapshots")
+
+
+def serve(owid_path, etag=True):
+    server, base_url = serve_directory(str(owid_path.parent), etag=etag)
+    return server, base_url + "/" + owid_path.name
+
+
+def spy(monkeypatch, module, name):
+    """
+    Record the results of a function while still calling it
+    """
+    results = []
+    function = getattr(module, name)
+
+    def recorded(*args, **kwargs):
+        results.append(function(*args, **kwargs))
+        return results[-1]
+
+    monkeypatch.setattr(module, name, recorded)
+    return results
+
+
+@pytest.mark.parametrize("etag", [True, False], ids=["etag", "last-modified"])
+def test_unchanged_source_returns_stored_snapshot(monkeypatch, loader, owid_path, config, etag):
+    columns = referenced_columns(config)
+    server, url = serve(owid_path, etag=etag)
+    try:
+        first = loader.refresh_asset_from_url(url, columns)
+        name = "latest-" + loader.snapshot_name(url)
+        info = loader.snapshots.metadata(name)
+        assert (info["etag"] is not None) == etag
+        assert info["last_modified"] is not None
+        mtime = os.path.getmtime(loader.snapshots.path_for(name))
+
+        responses = spy(monkeypatch, data_retrieval, "conditional_request")
+        saved = spy(monkeypatch, loader.snapshots, "save")
+        second = loader.refresh_asset_from_url(url, columns)
+    finally:
+        server.shutdown()
+
+    # the server answered 304 and nothing was parsed or written
+    assert responses == [None]
+    assert saved == []
+    assert os.path.getmtime(loader.snapshots.path_for(name)) == mtime
+    pdt.assert_frame_equal(second, first)
+
+
+def test_delta_merge_matches_full_parse(loader, owid_data, owid_path, config):
+    columns = referenced_columns(config)
+
+    # the first download ends ten days earlier for every location
+    truncated = {
+        iso: {**location, "data": location["data"][:-10]}
+        for iso, location in owid_data.items()
+    }
+    owid_path.write_text(json.dumps(truncated))
+
+    server, url = serve(owid_path)
+    try:
+        loader.refresh_asset_from_url(url, columns)
+        owid_path.write_text(json.dumps(owid_data))
+        # make sure the new file differs in modification time as well
+        stat = os.stat(owid_path)
+        os.utime(owid_path, (stat.st_atime + 5, stat.st_mtime + 5))
+        merged = loader.refresh_asset_from_url(url, columns)
+    finally:
+        server.shutdown()
+
+    # merged snapshots are ordered by location and date
+    full, _, _ = data_retrieval.stream_prepared_data(str(owid_path), columns)
+    full = full.sort_values(["location", "date"], kind="mergesort", ignore_index=True)
+    assert list(merged.columns) == list(full.columns)
+    pdt.assert_frame_equal(merged, full, check_categorical=False)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.scenarios import ScenarioRunner, per_capita_level, scenario_variants
+
+
+class IdentityScaler:
+    def transform(self, frame):
+        return frame.to_numpy()
+
+
+def test_per_capita_level_ignores_unknown_values():
+    pred_df = pd.DataFrame({
+        "new_vaccinations_smoothed": [0.0, 100.0, 50.0, 10.0],
+        "population": [1e3, 1e4, 1e3, 0.0]
+    })
+
+    assert per_capita_level(pred_df, "new_vaccinations_smoothed") == pytest.approx(0.03)
+    assert per_capita_level(pred_df.assign(new_vaccinations_smoothed=0.0),
+                            "new_vaccinations_smoothed") == 0.0
+
+
+def test_zero_baseline_is_changed_relative_to_peers():
+    torch = pytest.importorskip("torch")
+
+    # location 0 has its own values, location 1 only imputed zeros
+    raw = np.array([[10.0, 20.0, np.nan], [0.0, 0.0, 0.0]])
+    prepared = {
+        "x": {"decoder_cont": torch.zeros(2, 3, 1)},
+        "raw": {"new_vaccinations_smoothed": raw},
+        "reference": {"new_vaccinations_smoothed": np.array([[10.0, 20.0, np.nan], [40.0, 40.0, 40.0]])},
+        "positions": {"new_vaccinations_smoothed": 0},
+        "scalers": {"new_vaccinations_smoothed": IdentityScaler()}
+    }
+    variants = scenario_variants({"new_vaccinations_smoothed": 0.5}, steps=2)
+
+    x = ScenarioRunner.variant_batch(prepared, variants)
+    values = x["decoder_cont"][..., 0].numpy().reshape(2, 2, 3)
+
+    np.testing.assert_allclose(values[0], [[10, 20, 0], [0, 0, 0]])
+    np.testing.assert_allclose(values[1], [[15, 30, 0], [20, 20, 20]])
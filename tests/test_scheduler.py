@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+from utils.scheduler import NotReady, PrecomputeScheduler
+
+
+def test_readers_wait_for_first_round_at_most_timeout():
+    scheduler = PrecomputeScheduler(first_round_timeout=0.1)
+    release = threading.Event()
+    scheduler.register("data", lambda results: release.wait(30) and "ready")
+    scheduler.start(interval=60)
+    try:
+        # the request thread doesn't run or wait for the whole round
+        with pytest.raises(NotReady):
+            scheduler.latest()
+        assert not scheduler.ready
+
+        release.set()
+        scheduler.first_round_timeout = 30
+        assert scheduler.get("data") == "ready"
+        assert scheduler.ready
+    finally:
+        scheduler.stop()
+
+
+def test_unstarted_scheduler_runs_first_round_in_caller():
+    scheduler = PrecomputeScheduler()
+    scheduler.register("data", lambda results: "ready")
+
+    assert scheduler.get("data") == "ready"
@@ -0,0 +1,90 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+from utils.metrics import metrics
+from utils.single_flight import LOCK_SUFFIX, SingleFlight
+
+
+def calls(kind):
+    counters = metrics.snapshot()["counters"]
+    return {
+        dict(labels)["result"]: count for (metric, labels), count in counters.items()
+        if metric == "single_flight_calls" and dict(labels)["kind"] == kind
+    }
+
+
+def run_threads(n, target):
+    results, errors = [], []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return results, errors
+
+
+def test_threads_share_one_computation(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+    computations = []
+
+    def compute():
+        computations.append(True)
+        # keep the computation in flight until the other threads wait for it
+        time.sleep(0.3)
+        return 42
+
+    results, errors = run_threads(8, lambda: flight.do("test-threads", "key-1", compute))
+
+    assert (results, errors) == ([42] * 8, [])
+    assert len(computations) == 1
+    assert calls("test-threads") == {"computed": 1, "shared_thread": 7}
+
+
+def test_errors_reach_waiting_threads(tmp_path):
+    flight = SingleFlight(str(tmp_path))
+
+    def compute():
+        time.sleep(0.3)
+        raise ValueError("failed")
+
+    results, errors = run_threads(4, lambda: flight.do("test-errors", "key-1", compute))
+
+    assert results == []
+    assert len(errors) == 4
+    assert all(isinstance(e, ValueError) for e in errors)
+    # the failed call isn't kept, the next one computes again
+    assert flight.do("test-errors", "key-1", lambda: 1) == 1
+
+
+def test_result_stored_by_lock_holder_is_looked_up(tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    flight = SingleFlight(str(tmp_path))
+    store = {}
+    name = hashlib.sha1(b"key-1").hexdigest() + LOCK_SUFFIX
+
+    # stands in for another process computing the result
+    with open(os.path.join(str(tmp_path), name), "a") as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(flight.do(
+            "test-process", "key-1", lambda: "computed", lookup=lambda: store.get("key-1")
+        )))
+        thread.start()
+        time.sleep(0.2)
+        store["key-1"] = "stored"
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    thread.join(timeout=30)
+
+    assert results == ["stored"]
+    assert calls("test-process") == {"shared_process": 1}
@@ -0,0 +1,224 @@
+"""
+Module containing a flask_caching backend storing values in memory-mapped
+files, so cache hits don't copy or unpickle large objects.
+
+Values are pickled with protocol 5. DataFrames are written as Arrow IPC and
+torch tensors as raw buffers, both out-of-band next to the pickle stream in
+a single file per key. Loading memory-maps the file copy-on-write, so all
+processes reading an entry share its pages through the OS page cache.
+Pointing CACHE_DIR at a tmpfs such as /dev/shm keeps entries in shared
+memory.
+"""
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from flask_caching.backends.base import BaseCache
+
+from utils.metrics import metrics
+
+from typing import Any, Dict, List, Optional
+
+# file layout: header, buffer table, pickle stream, 64 byte aligned buffers
+MAGIC: bytes = b"ARWC"
+HEADER = struct.Struct("<4sdQI")
+BUFFER_ENTRY = struct.Struct("<QQ")
+ALIGNMENT: int = 64
+SUFFIX: str = ".arrowcache"
+
+
+def _frame_from_arrow(buffer: Any) -> pd.DataFrame:
+    """
+    Rebuild a DataFrame from an Arrow IPC buffer without copying columns
+    that pandas can hold as views
+    """
+    table = pa.ipc.open_file(pa.py_buffer(buffer)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _tensor_from_buffer(buffer: Any, dtype: str, shape: tuple) -> Any:
+    """
+    Rebuild a torch tensor as a view on a raw buffer
+    """
+    import torch
+
+    array = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    return torch.from_numpy(array)
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickler moving DataFrames and tensors out-of-band
+    """
+
+    def reducer_override(self, obj: Any) -> Any:
+        if type(obj) is pd.DataFrame:
+            return self._reduce_frame(obj)
+
+        # tensors can only exist if torch has been imported already
+        torch = sys.modules.get("torch")
+        if torch is not None and type(obj) is torch.Tensor and obj.layout == torch.strided:
+            array = np.ascontiguousarray(obj.detach().cpu().numpy())
+            return (
+                _tensor_from_buffer,
+                (pickle.PickleBuffer(array), array.dtype.str, array.shape)
+            )
+
+        return NotImplemented
+
+    @staticmethod
+    def _reduce_frame(frame: pd.DataFrame) -> Any:
+        # Arrow needs unique string column names and typed columns; anything
+        # else is pickled as usual
+        if not frame.columns.is_unique or not all(isinstance(c, str) for c in frame.columns):
+            return NotImplemented
+        try:
+            table = pa.Table.from_pandas(frame)
+        except (pa.ArrowException, TypeError, ValueError):
+            return NotImplemented
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        return (_frame_from_arrow, (pickle.PickleBuffer(sink.getvalue()),))
+
+
+class ArrowCache(BaseCache):
+    """
+    Cache backend storing one memory-mappable file per key in a directory
+
+    Args:
+        cache_dir (str): directory to store entries in
+        default_timeout (int): timeout in seconds if none is given on set
+    """
+
+    def __init__(self, cache_dir: str, default_timeout: int = 300, **kwargs: Any):
+        super().__init__(default_timeout=default_timeout)
+        self.__cache_dir = cache_dir
+        os.makedirs(self.__cache_dir, exist_ok=True)
+
+    @classmethod
+    def factory(cls, app: Any, config: Dict[str, Any], args: List[Any],
+                kwargs: Dict[str, Any]) -> "ArrowCache":
+        args.insert(0, config["CACHE_DIR"])
+        return cls(*args, **kwargs)
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.__cache_dir, digest + SUFFIX)
+
+    def get(self, key: str) -> Any:
+        value = self._read(key)
+        metrics.increment("cache_requests", result="miss" if value is None else "hit")
+        return value
+
+    def _read(self, key: str) -> Any:
+        try:
+            with open(self._path(key), "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (OSError, ValueError):
+            return None
+
+        try:
+            magic, expires, payload_size, n_buffers = HEADER.unpack_from(mapped, 0)
+        except struct.error:
+            return None
+        if magic != MAGIC:
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+
+        view = memoryview(mapped)
+        offset = HEADER.size
+        buffers = []
+        for _ in range(n_buffers):
+            start, length = BUFFER_ENTRY.unpack_from(mapped, offset)
+            buffers.append(view[start:start + length])
+            offset += BUFFER_ENTRY.size
+
+        payload = view[offset:offset + payload_size]
+        return pickle.loads(payload, buffers=buffers)
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        timeout = self._normalize_timeout(timeout)
+        expires = time.time() + timeout if timeout else 0.0
+
+        buffers: List[pickle.PickleBuffer] = []
+        try:
+            payload = self._dumps(value, buffers)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return False
+
+        raws = [buffer.raw() for buffer in buffers]
+
+        # lay out buffers after header, buffer table and pickle stream
+        offset = HEADER.size + len(raws) * BUFFER_ENTRY.size + len(payload)
+        entries = []
+        for raw in raws:
+            offset += -offset % ALIGNMENT
+            entries.append((offset, raw.nbytes))
+            offset += raw.nbytes
+
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, expires, len(payload), len(raws)))
+                for entry in entries:
+                    file.write(BUFFER_ENTRY.pack(*entry))
+                file.write(payload)
+                for (start, _), raw in zip(entries, raws):
+                    file.write(b"\0" * (start - file.tell()))
+                    file.write(raw)
+            # readers keep their mapping of the replaced file
+            os.replace(tmp_path, path)
+        except OSError:
+            return False
+
+        return True
+
+    @staticmethod
+    def _dumps(value: Any, buffers: List[pickle.PickleBuffer]) -> bytes:
+        stream = io.BytesIO()
+        _Pickler(stream, protocol=5, buffer_callback=buffers.append).dump(value)
+        return stream.getvalue()
+
+    def add(self, key: str, value: Any, timeout: Optional[int] = None) -> bool:
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return False
+        return True
+
+    def has(self, key: str) -> bool:
+        try:
+            with open(self._path(key), "rb") as file:
+                magic, expires, _, _ = HEADER.unpack(file.read(HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return magic == MAGIC and (not expires or expires >= time.time())
+
+    def clear(self) -> bool:
+        cleared = True
+        for file in os.listdir(self.__cache_dir):
+            if file.endswith(SUFFIX):
+                try:
+                    os.remove(os.path.join(self.__cache_dir, file))
+                except OSError:
+                    cleared = False
+        return cleared
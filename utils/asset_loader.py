@@ -1,9 +1,24 @@
 from abc import ABC, abstractmethod
-import data_retrieval
+from collections import OrderedDict
+import logging
 import os
+import threading
+import time
+import traceback
 import pandas as pd
-from pytorch_forecasting import TemporalFusionTransformer
-from typing import List, Dict, Any
+from typing import List, Dict, Any, TYPE_CHECKING
+from utils import data_retrieval
+from utils.model_export import exported_artifact, load_artifact, serialized_size
+from utils.metrics import metrics
+from utils.snapshot_store import SnapshotStore
+
+# torch and pytorch_forecasting are imported on first model load to keep
+# application startup fast
+if TYPE_CHECKING:
+    import torch
+    from pytorch_forecasting import TemporalFusionTransformer
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -44,21 +59,92 @@ class DataLoader(BaseLoader):
     """
     Class for loading Datasets from OWID
     """
-    def __init__(self, load_location: str, asset_type_ending: str="", url:str = ""):
+    def __init__(self, load_location: str, asset_type_ending: str="", url:str = "",
+                 snapshot_location: str = "snapshots"):
         super().__init__(load_location, asset_type_ending)
+        self.snapshots = SnapshotStore(snapshot_location)
 
-    def load_asset(self, path: str) -> pd.DataFrame:
+    @metrics.timed("data_load")
+    def load_asset(self, path: str, columns: List[str] = None) -> pd.DataFrame:
         """
         Load dataset coming from OWID Covid Data and return cleaned DataFrame
+
+        The prepared data is kept as a parquet snapshot, so the JSON is only
+        parsed again if the source file changes.
         """
-        raw = pd.read_json(path, orient="index")
-        data_asset, x, info = data_retrieval.prepare_data(raw)
+        name = self.snapshot_name(path)
+        if not self.snapshots.is_fresh(name, path):
+            raw = pd.read_json(path, orient="index")
+            data_asset, x, info = data_retrieval.prepare_data(raw)
+            self.snapshots.save(name, data_asset, source=path)
+
+        return self.snapshots.load(name, columns)
+
+    @metrics.timed("data_refresh")
+    def refresh_asset_from_url(self, url: str, columns: List[str]) -> pd.DataFrame:
+        """
+        Conditionally download dataset and append new dates to its snapshot
+        """
+        name = "latest-" + self.snapshot_name(url)
+        stored = None
+        etag = last_modified = None
+
+        if self.snapshots.is_fresh(name):
+            info = self.snapshots.metadata(name)
+            # snapshots built for different columns can't be extended
+            if info.get("columns") == list(columns):
+                stored = self.snapshots.load(name)
+                etag = info.get("etag")
+                last_modified = info.get("last_modified")
+
+        r = data_retrieval.conditional_request(url, etag, last_modified)
+        if r is None:
+            return stored
+
+        since = data_retrieval.last_dates(stored) if stored is not None else None
+        with r:
+            new, x, info = data_retrieval.stream_prepared_data(r.raw, columns, since)
+
+        data_asset = data_retrieval.merge_new_dates(stored, new)
+        self.snapshots.save(
+            name,
+            data_asset,
+            source=url,
+            columns=list(columns),
+            etag=r.headers.get("ETag"),
+            last_modified=r.headers.get("Last-Modified")
+        )
         return data_asset
 
-    def load_asset_from_url(self, url: str):
+    def latest_date(self, path: str) -> pd.Timestamp:
+        """
+        Most recent date in a dataset, read from its snapshot's metadata
+        """
+        name = self.snapshot_name(path)
+        if not self.snapshots.is_fresh(name, path):
+            self.load_asset(path, columns=["date"])
+
+        return pd.Timestamp(self.snapshots.metadata(name)["date_max"])
+
+    @staticmethod
+    def snapshot_name(path: str) -> str:
+        """
+        Name of the snapshot for a dataset file
+        """
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def load_asset_from_url(self, url: str, columns: List[str] = None):
         """
         Load dataset coming from OWID Covid Data and return cleaned DataFrame
+
+        If columns are given, the JSON is streamed and only those columns are
+        kept, which keeps peak memory close to the size of the result. The
+        result is kept as a snapshot, which is only updated if the server
+        reports a change, and then only with the dates not seen before.
         """
+        if columns is not None:
+            return self.refresh_asset_from_url(url, columns)
+
         raw = data_retrieval.retrieve_data_from_url(url)
         data_asset, x, info = data_retrieval.prepare_data(raw)
         return data_asset
@@ -71,17 +157,135 @@ class DataLoader(BaseLoader):
 class ModelLoader(BaseLoader):
     """
     Class for loading TFT models from checkpoint files
+
+    Loaded models are kept on CPU in eval mode in an LRU registry bounded by
+    the number of models and their resident size in bytes. If a checkpoint
+    was exported with utils.model_export, the quantized artifact is loaded
+    instead of the full checkpoint.
     """
-    def __init__(self, load_location: str, asset_type_ending: str):
+    def __init__(self, load_location: str, asset_type_ending: str,
+                 max_models: int = 4, max_bytes: int = 2 * 1024**3,
+                 prefer_artifacts: bool = True):
         super().__init__(load_location, asset_type_ending)
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.prefer_artifacts = prefer_artifacts
+        self.__models: "OrderedDict[str, TemporalFusionTransformer]" = OrderedDict()
+        self.__stats: Dict[str, Dict[str, float]] = {}
+        self.__lock = threading.Lock()
+        self.__path_locks: Dict[str, threading.Lock] = {}
+        # traceback per checkpoint that failed to preload
+        self.preload_errors: Dict[str, str] = {}
 
-    def load_asset(self, path: str) -> TemporalFusionTransformer:
+    def load_asset(self, path: str) -> "TemporalFusionTransformer":
         """
-        Load model from checkpoint file
+        Load model from checkpoint file, or return it from the registry
         """
-        model = TemporalFusionTransformer.load_from_checkpoint(path)
+        import torch
+        from pytorch_forecasting import TemporalFusionTransformer
+
+        with self.__lock:
+            path_lock = self.__path_locks.setdefault(path, threading.Lock())
+
+        # concurrent requests for the same checkpoint wait for a single load
+        with path_lock:
+            with self.__lock:
+                if path in self.__models:
+                    self.__models.move_to_end(path)
+                    metrics.increment("model_requests", result="resident")
+                    return self.__models[path]
+
+            start = time.perf_counter()
+            artifact = exported_artifact(path) if self.prefer_artifacts else None
+            if artifact is not None:
+                model = load_artifact(artifact)
+            else:
+                model = TemporalFusionTransformer.load_from_checkpoint(
+                    path, map_location=torch.device("cpu")
+                )
+                model.eval()
+            load_seconds = time.perf_counter() - start
+            metrics.observe("model_load", load_seconds)
+            metrics.increment("model_loads", source="checkpoint" if artifact is None else "artifact")
+
+            with self.__lock:
+                self.__models[path] = model
+                self.__stats[path] = {
+                    "load_seconds": load_seconds,
+                    "artifact": artifact,
+                    # quantized weights are packed outside of parameters()
+                    "resident_bytes": (serialized_size(model) if artifact is not None
+                                       else self.resident_size(model)),
+                    "loads": self.__stats.get(path, {}).get("loads", 0) + 1
+                }
+                self._evict(keep=path)
+
         return model
 
+    def preload(self, background: bool = True) -> threading.Thread:
+        """
+        Load all checkpoints in the load location into the registry; a
+        checkpoint failing to load is logged and skipped
+
+        Args:
+            background (bool): if True, models are loaded in a daemon thread
+
+        Returns:
+            Thread: thread loading the models (already joined if not in
+            background)
+        """
+        paths = [entry["value"] for entry in self.get_dropdown_entries()]
+
+        def load_all() -> None:
+            for path in paths[:self.max_models]:
+                try:
+                    self.load_asset(path)
+                except Exception:
+                    # it is loaded (or fails again) on request
+                    self.preload_errors[path] = traceback.format_exc()
+                    metrics.increment("model_preload_errors", path=path)
+                    logger.exception("preloading %s failed", path)
+
+        thread = threading.Thread(target=load_all, name="model-preload", daemon=True)
+        thread.start()
+        if not background:
+            thread.join()
+        return thread
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load time, resident size and load count per checkpoint, and whether
+        it is currently held in the registry
+        """
+        with self.__lock:
+            return {
+                path: {**stats, "resident": path in self.__models}
+                for path, stats in self.__stats.items()
+            }
+
+    @staticmethod
+    def resident_size(model: "torch.nn.Module") -> int:
+        """
+        Size of a model's parameters and buffers in bytes
+        """
+        tensors = [*model.parameters(), *model.buffers()]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _evict(self, keep: str) -> None:
+        """
+        Drop least recently used models until the registry is within bounds
+        """
+        def total_bytes() -> int:
+            return sum(self.__stats[path]["resident_bytes"] for path in self.__models)
+
+        while len(self.__models) > 1 and (
+            len(self.__models) > self.max_models or total_bytes() > self.max_bytes
+        ):
+            oldest = next(iter(self.__models))
+            if oldest == keep:
+                break
+            del self.__models[oldest]
+
     # def get_dropdown_entries(self) -> List[Dict[str,str]]:
     #     entries = super().get_dropdown_entries()
     #     return entries
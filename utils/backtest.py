@@ -0,0 +1,321 @@
+"""
+Module containing a rolling-origin backtest of model checkpoints
+
+Usage:
+    python -m utils.backtest models/smooth_jazz_5.ckpt [more.ckpt ...]
+        [--data URL_OR_PATH] [--origins 12] [--step 7] [--workers 2]
+
+Each origin is a day at which a forecast is made from the data known up to
+that day and compared with the following max_pred_length days. Forecasts of
+all origins are evaluated in large batches across a process pool and
+compared with a baseline repeating the last known value. Results per origin
+are stored in backtests/, so adding an origin or a model only computes the
+missing windows.
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils import data_retrieval
+from utils.prediction_data import (compact_imputed_data, fit_prediction_timeseries,
+                                   load_dataset_parameters, timeseries_from_parameters)
+from utils.run_config import load_run_config, referenced_columns
+
+from typing import Any, Dict, List, Optional, Tuple
+
+URL: str = "https://covid.ourworldindata.org/data/owid-covid-data.json"
+
+# bumped whenever the stored fields change, so older files are ignored
+FORMAT_VERSION: int = 1
+
+# arrays stored per model and origin
+WINDOW_FIELDS: Tuple[str, ...] = (
+    "locations", "levels", "quantiles", "prediction", "target", "baseline"
+)
+
+
+def origin_time_idx(data: pd.DataFrame, config: Any, n_origins: int, step: int) -> List[int]:
+    """
+    Last known time index of each forecast origin, most recent first
+
+    Origins lie on a fixed grid of multiples of step, so they stay the same
+    as new days are published and stored windows can be reused; the most
+    recent origin leaves at least max_pred_length known days to compare
+    with.
+    """
+    last = int(data.time_idx.max()) - config.max_pred_length
+    last -= last % step
+    first = config.max_encoder_length - 1
+    return [origin for origin in range(last, first - 1, -step)][:n_origins]
+
+
+def window_hashes(data: pd.DataFrame, config: Any, origins: List[int]) -> Dict[int, str]:
+    """
+    Content hash of the data each origin's forecasts and targets depend on,
+    so a stored window is recomputed if OWID revises values inside it
+    """
+    # rows in a fixed order, as imputation doesn't keep the order of days
+    order = np.lexsort((data.time_idx.to_numpy(), data.location.astype(str).to_numpy()))
+    data = data.iloc[order]
+    row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    time_idx = data.time_idx.to_numpy()
+    hashes = {}
+    for origin in origins:
+        in_window = (
+            (time_idx > origin - config.max_encoder_length)
+            & (time_idx <= origin + config.max_pred_length)
+        )
+        hashes[origin] = hashlib.sha1(row_hashes[in_window].tobytes()).hexdigest()[:16]
+    return hashes
+
+
+def pinball_loss(quantile_values: np.ndarray, target: np.ndarray,
+                 quantiles: List[float]) -> np.ndarray:
+    """
+    Quantile loss averaged over quantiles
+
+    Args:
+        quantile_values (ndarray): (..., quantiles) forecasts
+        target (ndarray): (...) actual values
+        quantiles (List): quantile levels of the last axis
+
+    Returns:
+        ndarray: (...) loss
+    """
+    errors = target[..., None] - quantile_values
+    levels = np.asarray(quantiles, dtype=np.float32)
+    return np.maximum(levels * errors, (levels - 1) * errors).mean(axis=-1)
+
+
+def _evaluate_origins(checkpoint_path: str, data: pd.DataFrame, impute_dummies: List[str],
+                      config: Any, origins: List[int], batch_size: int,
+                      num_threads: int) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Forecasts and baseline of a checkpoint for a chunk of origins, run in a
+    worker process
+
+    All windows of the chunk go into one dataset, which is predicted in
+    batches of batch_size.
+    """
+    import torch
+
+    torch.set_num_threads(num_threads)
+
+    from utils.asset_loader import ModelLoader
+
+    parameters = load_dataset_parameters(checkpoint_path)
+    if parameters is not None:
+        dataset = timeseries_from_parameters(parameters, data, predict=False)
+    else:
+        dataset = fit_prediction_timeseries(data, config, impute_dummies, predict=False)
+
+    # keep the full-length windows whose decoder starts right after an origin
+    windows = dataset.decoded_index
+    keep = (
+        windows.time_idx_first_prediction.isin([origin + 1 for origin in origins])
+        & (windows.time_idx_last - windows.time_idx_first_prediction + 1 == config.max_pred_length)
+    ).to_numpy()
+    dataset.index = dataset.index[keep].reset_index(drop=True)
+    windows = windows[keep].reset_index(drop=True)
+
+    model = ModelLoader(os.path.dirname(checkpoint_path) or ".", ".ckpt").load_asset(checkpoint_path)
+    with torch.no_grad():
+        predictions, x = model.predict(
+            dataset, mode="raw", return_x=True, batch_size=batch_size
+        )
+
+    quantiles = model.loss.to_quantiles(predictions["prediction"]).cpu().numpy().astype(np.float32)
+    point = model.loss.to_prediction(predictions["prediction"]).cpu().numpy().astype(np.float32)
+    target = x["decoder_target"].cpu().numpy().astype(np.float32)
+
+    # baseline: last known value carried forward
+    encoder_target = x["encoder_target"].cpu().numpy()
+    last_known = encoder_target[np.arange(len(encoder_target)), x["encoder_lengths"].cpu().numpy() - 1]
+    baseline = np.repeat(last_known[:, None], target.shape[1], axis=1).astype(np.float32)
+
+    levels = np.asarray(model.loss.quantiles, dtype=np.float32)
+    origin_of_window = windows.time_idx_first_prediction.to_numpy() - 1
+    return {
+        origin: {
+            "locations": windows.location.to_numpy()[rows].astype(str),
+            "levels": levels,
+            "quantiles": quantiles[rows],
+            "prediction": point[rows],
+            "target": target[rows],
+            "baseline": baseline[rows]
+        }
+        for origin in origins
+        for rows in [origin_of_window == origin]
+    }
+
+
+class BacktestStore:
+    """
+    Stores the evaluated windows of each model and origin on disk, keyed by
+    the checkpoint's and the window data's content hashes
+    """
+
+    def __init__(self, location: str = "backtests"):
+        self.__location = location
+        os.makedirs(self.__location, exist_ok=True)
+
+    def path(self, model_hash: str, origin: int, data_hash: str) -> str:
+        return os.path.join(
+            self.__location,
+            "{}-{}-{}-v{}.npz".format(model_hash, origin, data_hash, FORMAT_VERSION)
+        )
+
+    def load(self, path: str) -> Optional[Dict[str, np.ndarray]]:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            return {field: arrays[field] for field in WINDOW_FIELDS}
+
+    def save(self, path: str, window: Dict[str, np.ndarray]) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **window)
+        os.replace(tmp_path, path)
+
+
+def run_backtest(checkpoint_paths: List[str], data: pd.DataFrame, config: Any,
+                 n_origins: int = 12, step: int = 7, workers: int = 2,
+                 batch_size: int = 1024, store: Optional[BacktestStore] = None
+                 ) -> Dict[str, Dict[int, Dict[str, np.ndarray]]]:
+    """
+    Evaluate checkpoints at rolling forecast origins
+
+    Args:
+        checkpoint_paths (List): checkpoints to evaluate
+        data (DataFrame): prepared OWID data
+        config (Config): run configuration as defined in run_config.yml
+        n_origins (int): number of forecast origins
+        step (int): days between origins
+        workers (int): number of worker processes
+        batch_size (int): number of windows per forward pass
+        store (BacktestStore): stored windows to reuse and extend
+
+    Returns:
+        Dict: evaluated windows by checkpoint path and origin
+    """
+    from utils.forecast_store import forecast_store
+
+    store = store or BacktestStore()
+    data, impute_dummies = compact_imputed_data(data, config)
+    origins = origin_time_idx(data, config, n_origins, step)
+    data_hashes = window_hashes(data, config, origins)
+
+    results: Dict[str, Dict[int, Dict[str, np.ndarray]]] = {}
+    missing: Dict[str, List[int]] = {}
+    for checkpoint_path in checkpoint_paths:
+        model_hash = forecast_store.checkpoint_hash(checkpoint_path)
+        results[checkpoint_path] = {}
+        for origin in origins:
+            window = store.load(store.path(model_hash, origin, data_hashes[origin]))
+            if window is None:
+                missing.setdefault(checkpoint_path, []).append(origin)
+            else:
+                results[checkpoint_path][origin] = window
+
+    # split the missing origins of each model into one chunk per worker
+    tasks = [
+        (checkpoint_path, list(chunk))
+        for checkpoint_path, model_origins in missing.items()
+        for chunk in np.array_split(model_origins, min(workers, len(model_origins)))
+    ]
+    if tasks:
+        threads = max((os.cpu_count() or 1) // workers, 1)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                (checkpoint_path, pool.submit(
+                    _evaluate_origins, checkpoint_path, data, impute_dummies, config,
+                    [int(origin) for origin in chunk], batch_size, threads
+                ))
+                for checkpoint_path, chunk in tasks
+            ]
+            for checkpoint_path, future in futures:
+                model_hash = forecast_store.checkpoint_hash(checkpoint_path)
+                for origin, window in future.result().items():
+                    store.save(store.path(model_hash, origin, data_hashes[origin]), window)
+                    results[checkpoint_path][origin] = window
+
+    return results
+
+
+def error_table(results: Dict[str, Dict[int, Dict[str, np.ndarray]]]) -> pd.DataFrame:
+    """
+    Long table of absolute errors and quantile losses per model, origin,
+    location and horizon, for the model and the baseline
+    """
+    frames = []
+    for checkpoint_path, windows in results.items():
+        for origin, window in windows.items():
+            n_windows, horizon = window["target"].shape
+            target = window["target"]
+            frames.append(pd.DataFrame({
+                "model": os.path.basename(checkpoint_path),
+                "origin": origin,
+                "location": np.repeat(window["locations"], horizon),
+                "horizon": np.tile(np.arange(1, horizon + 1), n_windows),
+                "ae": np.abs(window["prediction"] - target).ravel(),
+                "quantile_loss": pinball_loss(window["quantiles"], target, window["levels"]).ravel(),
+                "baseline_ae": np.abs(window["baseline"] - target).ravel(),
+                # a point forecast has the same value at every quantile
+                "baseline_quantile_loss": pinball_loss(
+                    window["baseline"][..., None], target, [0.5]
+                ).ravel(),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def summary_table(errors: pd.DataFrame, by: str) -> pd.DataFrame:
+    """
+    MAE and mean quantile loss of each model and the baseline, grouped by
+    "location" or "horizon", with the model's skill over the baseline
+    """
+    table = errors.groupby(["model", by], observed=True).agg(
+        mae=("ae", "mean"),
+        quantile_loss=("quantile_loss", "mean"),
+        baseline_mae=("baseline_ae", "mean"),
+        baseline_quantile_loss=("baseline_quantile_loss", "mean"),
+        windows=("ae", "size")
+    )
+    table["mae_skill"] = 1 - table.mae / table.baseline_mae
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of checkpoints")
+    parser.add_argument("checkpoints", nargs="+", help="checkpoint paths, e.g. models/*.ckpt")
+    parser.add_argument("--data", default=URL, help="OWID JSON file or URL")
+    parser.add_argument("--config", default="run_config.yml")
+    parser.add_argument("--origins", type=int, default=12, help="number of forecast origins")
+    parser.add_argument("--step", type=int, default=7, help="days between origins")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--output", default="backtests", help="directory for result tables")
+    args = parser.parse_args()
+
+    config = load_run_config(args.config)
+    data, _, _ = data_retrieval.stream_prepared_data(args.data, referenced_columns(config))
+    results = run_backtest(args.checkpoints, data, config, args.origins, args.step,
+                           args.workers, args.batch_size, BacktestStore(args.output))
+
+    errors = error_table(results)
+    for by in ("location", "horizon"):
+        table = summary_table(errors, by)
+        path = os.path.join(args.output, "per_{}.csv".format(by))
+        table.to_csv(path)
+        print("written {}".format(path))
+
+    print(summary_table(errors.assign(all="all"), "all").to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import ijson
 import numpy as np
 import pandas as pd
 import requests
 
+from array import array
 from json.decoder import JSONDecodeError
 from requests.exceptions import MissingSchema, ConnectionError
 
@@ -58,17 +60,28 @@ def prepare_data(df):
     info["x_nan_shares"] = dict(x_nan_shares)
     info["x_shape"] = xs.shape
 
-    # begin concatenating countries to get ys
-    ys = pd.DataFrame(raw_ys[0])
-    ys["location"] = raw_ys.index[0]
-    ys = ys.set_index("location")
-    ys = ys.reset_index()
+    # explode the nested per-location records into one long frame in a single
+    # pass instead of appending one country at a time
+    records = raw_ys.explode().dropna()
+    ys = pd.DataFrame(records.tolist())
+    ys.insert(0, "location", records.index.to_numpy())
 
-    # append other countries
-    for i in range(1,len(raw_ys)):
-        new_ys = pd.DataFrame(raw_ys[i])
-        new_ys["location"] = raw_ys.index[i]
-        ys = ys.append(new_ys)
+    return _combine_data(ys, xs, info)
+
+def _combine_data(ys, xs, info):
+    """
+    Joins long-format daily records with static location data and adds the
+    columns needed by pytorch_forecasting
+
+    Args:
+        ys (DataFrame): daily records with a leading location column
+        xs (DataFrame): static data indexed by location
+        info (dict): info dict to add missing data info on ys to
+
+    Returns:
+        tuple: Tuple containing xs, ys, and info on data
+
+    """
 
     # get nans in ys
     y_nan_sums = ys.isnull().sum()
@@ -105,3 +118,224 @@ def prepare_data(df):
     data.index = range(0,data.shape[0])
 
     return (data, xs, info)
+
+def stream_prepared_data(source, columns=None, since=None):
+    """
+    Incrementally parses OWID JSON from a URL or a local file and writes
+    location/day records straight into columnar buffers, so neither the full
+    JSON document nor the nested DataFrame is ever held in memory.
+
+    Args:
+        source (string or file-like): URL, local path or open binary stream
+        to retrieve JSON from
+        columns (list): columns to keep; if None, all columns are kept. Real
+        valued columns are buffered as float64 arrays
+        since (dict): last known date (YYYY-MM-DD) per location; records up to
+        and including that date are skipped
+
+    Returns:
+        tuple: Tuple containing xs, ys, and info on data, as in prepare_data
+
+    Raises:
+        Exception: Exceptions raised by imported pkgs
+
+    """
+
+    keep = None if columns is None else {"location", "date", *columns}
+    numeric = set() if columns is None else set(columns) - {
+        "location", "date", "continent", "tests_units"
+    }
+
+    since = since or {}
+
+    statics = {}
+    buffers = {"date": []}
+    locations = []
+    lengths = []
+    n_rows = 0
+
+    try:
+        with _open_stream(source) as stream:
+            for iso, country in ijson.kvitems(stream, "", use_float=True):
+                records = country.pop("data", [])
+                statics[iso] = {
+                    key: value for key, value in country.items()
+                    if keep is None or key in keep
+                }
+
+                last_date = since.get(iso)
+                n_kept = 0
+
+                for record in records:
+                    if last_date is not None and record["date"] <= last_date:
+                        continue
+
+                    # start new buffers when a column shows up for the first
+                    # time and pad them for the rows seen so far
+                    for key in record.keys() - buffers.keys():
+                        if keep is None or key in keep:
+                            buffers[key] = _new_buffer(key in numeric, n_rows)
+
+                    for key, buffer in buffers.items():
+                        value = record.get(key)
+                        # missing keys and explicit nulls are both missing
+                        if value is None and isinstance(buffer, array):
+                            value = np.nan
+                        buffer.append(value)
+                    n_rows += 1
+                    n_kept += 1
+
+                locations.append(iso)
+                lengths.append(n_kept)
+    except (ijson.JSONError, MissingSchema, ConnectionError) as e:
+        raise e
+
+    ys = pd.DataFrame({
+        "location": np.repeat(np.array(locations, dtype=object), lengths),
+        **{
+            key: np.frombuffer(buffer, dtype=np.float64)
+            if isinstance(buffer, array) else buffer
+            for key, buffer in buffers.items()
+        }
+    })
+
+    xs = pd.DataFrame.from_dict(statics, "index")
+
+    # get nans in xs
+    info = {}
+    info["x_nan_sums"] = dict(xs.isnull().sum())
+    info["x_nan_shares"] = dict(xs.isnull().mean())
+    info["x_shape"] = xs.shape
+
+    return _combine_data(ys, xs, info)
+
+def _open_stream(source):
+    """
+    Opens a binary stream on a URL or a local file
+
+    Args:
+        source (string or file-like): URL, local path or open binary stream
+
+    Returns:
+        file-like: raw binary stream usable as a context manager
+
+    """
+
+    if hasattr(source, "read"):
+        return source
+
+    if source.startswith(("http://", "https://")):
+        r = requests.get(source, stream=True)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return r.raw
+
+    return open(source, "rb")
+
+def _new_buffer(numeric, n_rows):
+    """
+    Creates a column buffer padded with missing values for n_rows
+
+    Args:
+        numeric (bool): if True, a float64 array is used instead of a list
+        n_rows (int): number of rows to pad
+
+    Returns:
+        array or list: column buffer
+
+    """
+
+    if numeric:
+        return array("d", [np.nan]) * n_rows
+
+    return [None] * n_rows
+
+def conditional_request(url, etag=None, last_modified=None):
+    """
+    Requests a URL as a stream, only if it changed since the last download
+
+    Args:
+        url (string): URL address to retrieve JSON from
+        etag (string): ETag header of the last download
+        last_modified (string): Last-Modified header of the last download
+
+    Returns:
+        Response: streaming response, or None if the server reports the
+        resource as not modified
+
+    Raises:
+        Exception: Exceptions raised by imported pkgs
+
+    """
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    try:
+        r = requests.get(url, headers=headers, stream=True)
+        r.raise_for_status()
+    except (MissingSchema, ConnectionError) as e:
+        raise e
+
+    if r.status_code == 304:
+        r.close()
+        return None
+
+    r.raw.decode_content = True
+    return r
+
+def last_dates(data):
+    """
+    Last available date per location in a prepared dataframe
+
+    Args:
+        data (DataFrame): dataframe as returned by prepare_data
+
+    Returns:
+        dict: mapping of location to date formatted as YYYY-MM-DD
+
+    """
+
+    return (
+        data.groupby("location", observed=True)["date"].max()
+        .dt.strftime("%Y-%m-%d")
+        .to_dict()
+    )
+
+def merge_new_dates(stored, new):
+    """
+    Appends newly available dates to a prepared dataframe, recomputing the
+    columns that depend on the full data (time index and categories)
+
+    Args:
+        stored (DataFrame): previously prepared data
+        new (DataFrame): prepared data only containing new dates
+
+    Returns:
+        DataFrame: merged data ordered by location and date
+
+    """
+
+    if stored is None:
+        return new
+    if new.empty:
+        return stored
+
+    categoricals = stored.select_dtypes("category").columns
+
+    data = pd.concat([stored, new], ignore_index=True)
+
+    # concatenating categoricals with different categories yields objects
+    for col in categoricals:
+        data[col] = data[col].astype(object).astype("category")
+
+    t_zero = data['date'].min()
+    data['time_idx'] = (data['date'] - t_zero).dt.days
+
+    data = data.sort_values(["location", "date"], kind="mergesort")
+    data.index = range(0,data.shape[0])
+
+    return data
@@ -0,0 +1,130 @@
+"""
+Module containing the compact dtype schema for prediction data and helpers
+to report memory use along the prediction pipeline
+"""
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict
+
+# suffix of the dummy columns flagging imputed values
+MISSING_FLAG_SUFFIX: str = "_was_missing"
+
+# dates are stored as days since this epoch
+EPOCH: pd.Timestamp = pd.Timestamp("1970-01-01")
+
+
+def dtype_plan(config: Any) -> Dict[str, str]:
+    """
+    Declared dtype per column of the prediction data for a run config
+
+    Reals become float32 (the precision the model works in), the time index
+    and dates int32 day offsets, and string columns categoricals. Imputation
+    flags are matched by suffix, see apply_dtype_plan.
+
+    Args:
+        config (Config): run configuration exposing static_reals,
+        time_varying_known_reals and targets as attributes
+
+    Returns:
+        Dict: dtype by column name
+    """
+    plan = {
+        col: "float32" for col in [
+            *config.static_reals,
+            *config.time_varying_known_reals,
+            config.targets
+        ]
+    }
+    plan.update({
+        "time_idx": "int32",
+        "date": "int32",
+        "location": "category",
+        "continent": "category",
+        "tests_units": "category",
+        "month": "category"
+    })
+    return plan
+
+
+def apply_dtype_plan(data: pd.DataFrame, plan: Dict[str, str]) -> pd.DataFrame:
+    """
+    Cast columns of a DataFrame according to a dtype plan
+
+    Args:
+        data (DataFrame): prediction data
+        plan (Dict): dtype by column name as returned by dtype_plan
+
+    Returns:
+        DataFrame: data with compact dtypes; columns not in the plan are kept
+    """
+    columns = {}
+    for col in data.columns:
+        dtype = plan.get(col)
+        if col.endswith(MISSING_FLAG_SUFFIX):
+            # encoders expect the "False"/"True" categories used in training
+            dtype = "category"
+
+        if dtype is None or data[col].dtype == dtype:
+            columns[col] = data[col]
+        elif col == "date":
+            columns[col] = dates_to_days(data[col])
+        elif dtype == "category":
+            columns[col] = data[col].astype(str).astype("category")
+        else:
+            columns[col] = data[col].astype(dtype)
+
+    return pd.DataFrame(columns, index=data.index)
+
+
+def dates_to_days(dates: pd.Series) -> pd.Series:
+    """
+    Dates as int32 days since EPOCH
+    """
+    return ((dates - EPOCH) // pd.Timedelta(days=1)).astype(np.int32)
+
+
+def days_to_date(days: int) -> pd.Timestamp:
+    """
+    Date for a number of days since EPOCH
+    """
+    return EPOCH + pd.Timedelta(days=int(days))
+
+
+def frame_bytes(data: pd.DataFrame) -> int:
+    """
+    Resident size of a DataFrame including Python objects
+    """
+    return int(data.memory_usage(deep=True).sum())
+
+
+def dataset_bytes(dataset: Any) -> int:
+    """
+    Resident size of the tensors and index of a TimeSeriesDataSet
+    """
+    tensors = [
+        tensor for value in dataset.data.values()
+        for tensor in (value if isinstance(value, (list, tuple)) else [value])
+        if hasattr(tensor, "element_size")
+    ]
+    return (
+        sum(t.numel() * t.element_size() for t in tensors)
+        + frame_bytes(dataset.index)
+    )
+
+
+def memory_report(stages: Dict[str, int]) -> str:
+    """
+    Format resident sizes per pipeline stage as a table
+
+    Args:
+        stages (Dict): bytes by stage name, in pipeline order
+
+    Returns:
+        str: one line per stage with its size in MB
+    """
+    width = max(len(stage) for stage in stages)
+    return "\n".join(
+        "{:{}s} {:10.2f} MB".format(stage, width, size / 1e6)
+        for stage, size in stages.items()
+    )
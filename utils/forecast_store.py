@@ -0,0 +1,400 @@
+"""
+Module containing a store for batch forecasts of all locations
+"""
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.interpretation import Interpretation
+from utils.metrics import metrics
+from utils.model_export import exported_artifact
+from utils.prediction_data import dataset_for_checkpoint
+from utils.single_flight import single_flight
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# bumped whenever the stored fields change, so older files are ignored
+FORMAT_VERSION: int = 4
+
+# suffix of the interpretation stored next to a forecast
+INTERPRETATION_SUFFIX: str = "-interpretation.npz"
+
+
+class RunnerUnavailable(RuntimeError):
+    """
+    Raised by a runner that can't take requests, e.g. an unhealthy
+    inference pool; the forecast is then computed inline
+    """
+
+
+class Forecast:
+    """
+    Quantile forecasts for every group of a prediction dataset, kept as
+    compact float32 arrays indexed by group
+
+    A forecast computed by a TFT carries the interpretation of the same
+    forward pass; it is stored in a separate file and only loaded on request.
+    """
+
+    FIELDS: Tuple[str, ...] = (
+        "locations",
+        "levels",
+        "quantiles",
+        "prediction",
+        "encoder_target",
+        "encoder_lengths",
+        "decoder_lengths"
+    )
+
+    def __init__(self, locations: np.ndarray, levels: np.ndarray, quantiles: np.ndarray,
+                 prediction: np.ndarray, encoder_target: np.ndarray,
+                 encoder_lengths: np.ndarray, decoder_lengths: np.ndarray,
+                 interpretation: Optional[Interpretation] = None):
+        # (groups,) location codes in prediction order
+        self.locations = locations
+        # (quantiles,) quantile levels of the last axis of quantiles
+        self.levels = levels
+        # (groups, horizon, quantiles)
+        self.quantiles = quantiles
+        # (groups, horizon)
+        self.prediction = prediction
+        # (groups, max encoder length)
+        self.encoder_target = encoder_target
+        # (groups,)
+        self.encoder_lengths = encoder_lengths
+        self.decoder_lengths = decoder_lengths
+        self.interpretation = interpretation
+        self.__rows = {location: row for row, location in enumerate(locations)}
+
+    def row(self, location: str) -> Optional[int]:
+        """
+        Row of a location in the forecast arrays, None if not forecasted
+        """
+        return self.__rows.get(location)
+
+    @classmethod
+    def from_predictions(cls, model: Any, predictions: Dict[str, Any],
+                         x: Dict[str, Any], dataset: Any) -> "Forecast":
+        """
+        Build forecast from raw model output
+
+        Args:
+            model (BaseModel): model used for prediction
+            predictions (Dict): raw predictions generated by model
+            x (dict): information on covariates returned by model prediction
+            dataset (TimeSeriesDataSet): dataset predicted on, in predict mode
+
+        Returns:
+            Forecast: forecast for all groups in the prediction
+        """
+        def to_numpy(tensor, dtype):
+            return tensor.detach().cpu().numpy().astype(dtype)
+
+        return cls(
+            # predict mode yields one sample per group in index order
+            locations=dataset.decoded_index["location"].to_numpy().astype(str),
+            levels=np.asarray(model.loss.quantiles, dtype=np.float32),
+            quantiles=to_numpy(model.loss.to_quantiles(predictions["prediction"]), np.float32),
+            prediction=to_numpy(model.loss.to_prediction(predictions["prediction"]), np.float32),
+            encoder_target=to_numpy(x["encoder_target"], np.float32),
+            encoder_lengths=to_numpy(x["encoder_lengths"], np.int32),
+            decoder_lengths=to_numpy(x["decoder_lengths"], np.int32),
+            # attention and variable weights are part of the raw TFT output
+            interpretation=(
+                Interpretation.from_predictions(model, predictions)
+                if hasattr(model, "interpret_output") else None
+            )
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Write forecast arrays to an npz file
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **{field: getattr(self, field) for field in self.FIELDS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Forecast":
+        """
+        Read forecast arrays from an npz file
+        """
+        with np.load(path) as arrays:
+            return cls(**{field: arrays[field] for field in cls.FIELDS})
+
+
+def predict_forecast(model: Any, dataset: Any) -> Forecast:
+    """
+    Run a model on a prediction dataset in a single batch
+
+    Args:
+        model (BaseModel): model in eval mode
+        dataset (TimeSeriesDataSet): dataset in predict mode
+
+    Returns:
+        Forecast: forecast for all groups in the dataset
+    """
+    predictions, x = model.predict(
+        dataset, mode="raw", return_x=True, batch_size=max(len(dataset), 1)
+    )
+    return Forecast.from_predictions(model, predictions, x, dataset)
+
+
+def predict_forecasts(model: Any, datasets: List[Any]) -> List[Forecast]:
+    """
+    Run a model on several prediction datasets in a single forward pass
+
+    The datasets must have been built for the model, e.g. from the same
+    parameters; samples keep their own target scales, so datasets built
+    from different data snapshots can share a batch.
+
+    Args:
+        model (BaseModel): model in eval mode
+        datasets (List): datasets in predict mode
+
+    Returns:
+        List: forecast for all groups of each dataset, in the same order
+    """
+    if len(datasets) == 1:
+        return [predict_forecast(model, datasets[0])]
+
+    from torch.utils.data import ConcatDataset, DataLoader
+
+    offsets = np.cumsum([0, *[len(dataset) for dataset in datasets]])
+    total = int(offsets[-1])
+    loader = DataLoader(
+        ConcatDataset(datasets), batch_size=max(total, 1), shuffle=False,
+        collate_fn=datasets[0]._collate_fn
+    )
+    predictions, x = model.predict(loader, mode="raw", return_x=True)
+
+    def rows(output: Dict[str, Any], start: int, stop: int) -> Dict[str, Any]:
+        # tensors of the raw output and of x are batch first
+        return {
+            name: value[start:stop] if getattr(value, "shape", ())[:1] == (total,) else value
+            for name, value in output.items()
+        }
+
+    forecasts = []
+    for dataset, start, stop in zip(datasets, offsets[:-1], offsets[1:]):
+        x_rows = rows(x, start, stop)
+        # encoders are padded to the longest one of the whole batch
+        encoder_length = int(x_rows["encoder_lengths"].max()) if stop > start else 0
+        x_rows["encoder_target"] = x_rows["encoder_target"][:, :encoder_length]
+        forecasts.append(Forecast.from_predictions(
+            model, rows(predictions, start, stop), x_rows, dataset
+        ))
+    return forecasts
+
+
+class ForecastStore:
+    """
+    Runs inference once per (checkpoint, data snapshot) and keeps the result
+    in memory and on disk, so selecting a location is a lookup instead of a
+    forward pass over all groups.
+    """
+
+    def __init__(self, location: str, max_entries: int = 4):
+        self.__location = location
+        self.__max_entries = max_entries
+        self.__runner: Optional[Callable[..., Forecast]] = None
+        self.__entries: "OrderedDict[Tuple[str, str], Forecast]" = OrderedDict()
+        self.__file_hashes: Dict[str, Tuple[float, int, str]] = {}
+        # hash of the most recently keyed prediction data
+        self.__data_hash: Tuple[Callable[[], Any], str] = (lambda: None, "")
+        self.__lock = threading.Lock()
+        os.makedirs(self.__location, exist_ok=True)
+
+    def get(self, model_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+            load_model: Callable[[str], Any],
+            shared_parameters: Optional[Dict[str, Any]] = None) -> Forecast:
+        """
+        Forecast for a model and prediction data, computed if not yet stored
+
+        Args:
+            model_path (str): path of the model checkpoint
+            pred_df (DataFrame): data the prediction dataset was built from
+            pred_ts (TimeSeriesDataSet): shared prediction dataset
+            load_model (Callable): loads the model for a checkpoint path
+            shared_parameters (Dict): training dataset parameters pred_ts was
+            built from; checkpoints stored with other parameters get their
+            own dataset
+
+        Returns:
+            Forecast: forecast for all groups in pred_ts
+        """
+        key = self.key(model_path, pred_df)
+
+        with self.__lock:
+            forecast = self.__entries.get(key)
+            if forecast is not None:
+                self.__entries.move_to_end(key)
+                metrics.increment("forecast_requests", result="memory")
+                return forecast
+
+        path = self._path(key)
+        computed = []
+
+        def compute() -> Forecast:
+            metrics.increment("forecast_requests", result="computed")
+            # includes waiting for a worker if inference runs in a pool
+            with metrics.time("predict"):
+                forecast = None
+                if self.__runner is not None:
+                    try:
+                        forecast = self.__runner(model_path, pred_df, pred_ts, shared_parameters)
+                    except RunnerUnavailable:
+                        metrics.increment("forecast_runner_unavailable")
+                if forecast is None:
+                    dataset = dataset_for_checkpoint(model_path, pred_df, pred_ts, shared_parameters)
+                    forecast = predict_forecast(load_model(model_path), dataset)
+            if forecast.interpretation is not None:
+                forecast.interpretation.save(self._interpretation_path(key))
+            forecast.save(path)
+            computed.append(True)
+            return forecast
+
+        def lookup() -> Optional[Forecast]:
+            if not os.path.exists(path):
+                return None
+            metrics.increment("forecast_requests", result="disk")
+            return Forecast.load(path)
+
+        # one computation per key: threads asking for it meanwhile share its
+        # result, other processes store it in path, so it is looked up after
+        # waiting for them
+        forecast = single_flight.do(
+            "forecast", "forecast-" + os.path.basename(path), compute, lookup
+        )
+
+        with self.__lock:
+            if computed:
+                self._prune(key)
+            self.__entries[key] = forecast
+            if len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+        return forecast
+
+    def interpretation(self, model_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+                       load_model: Callable[[str], Any],
+                       shared_parameters: Optional[Dict[str, Any]] = None
+                       ) -> Optional[Interpretation]:
+        """
+        Interpretation of the forecast for a model and prediction data, None
+        if the model doesn't provide one; arguments as for get
+
+        It is computed with the forecast, so requesting it never runs
+        another forward pass for stored forecasts.
+        """
+        forecast = self.get(model_path, pred_df, pred_ts, load_model, shared_parameters)
+        if forecast.interpretation is None:
+            path = self._interpretation_path(self.key(model_path, pred_df))
+            if os.path.exists(path):
+                # kept with the forecast in memory from now on
+                forecast.interpretation = Interpretation.load(path)
+        return forecast.interpretation
+
+    def key(self, model_path: str, pred_df: pd.DataFrame) -> Tuple[str, str]:
+        """
+        Key of the forecast for a model and prediction data: content hashes
+        of the served model file and of the data
+        """
+        # an exported artifact yields (slightly) different forecasts
+        served_path = exported_artifact(model_path) or model_path
+        return self.checkpoint_hash(served_path), self.data_hash(pred_df)
+
+    def modified(self, key: Tuple[str, str]) -> Optional[float]:
+        """
+        Time the forecast for a key was stored, None if it is not on disk
+        """
+        try:
+            return os.path.getmtime(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    def set_runner(self, runner: Optional[Callable[..., Forecast]]) -> None:
+        """
+        Compute forecasts with a runner instead of inline in the calling thread
+
+        Args:
+            runner (Callable): takes model path, prediction data, shared
+            prediction dataset and shared parameters and returns a Forecast,
+            e.g. InferencePool.forecast; None restores inline inference
+        """
+        self.__runner = runner
+
+    def _path(self, key: Tuple[str, str]) -> str:
+        return os.path.join(
+            self.__location, "{}-{}-v{}.npz".format(*key, FORMAT_VERSION)
+        )
+
+    def _interpretation_path(self, key: Tuple[str, str]) -> str:
+        return os.path.splitext(self._path(key))[0] + INTERPRETATION_SUFFIX
+
+    def checkpoint_hash(self, path: str) -> str:
+        """
+        Content hash of a checkpoint, recomputed only if the file changes
+        """
+        stat = os.stat(path)
+        known = self.__file_hashes.get(path)
+        if known is not None and known[:2] == (stat.st_mtime, stat.st_size):
+            return known[2]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+
+        file_hash = digest.hexdigest()[:16]
+        self.__file_hashes[path] = (stat.st_mtime, stat.st_size, file_hash)
+        return file_hash
+
+    def data_hash(self, data: pd.DataFrame) -> str:
+        """
+        Content hash of prediction data, reused while the same frame is
+        keyed again, as callers share the published frame of a refresh
+        """
+        data_ref, data_hash = self.__data_hash
+        if data_ref() is not data:
+            data_hash = self.snapshot_hash(data)
+            self.__data_hash = (weakref.ref(data), data_hash)
+        return data_hash
+
+    @staticmethod
+    def snapshot_hash(data: pd.DataFrame) -> str:
+        """
+        Content hash of prediction data
+        """
+        row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+        return hashlib.sha1(row_hashes.tobytes()).hexdigest()[:16]
+
+    def _prune(self, key: Tuple[str, str], keep: int = 2) -> None:
+        """
+        Remove stored forecasts of a model for outdated data from disk. The
+        most recent previous forecast is kept, as it is still served while
+        newer data is being published; memory is bounded by the LRU.
+        """
+        model_hash, data_hash = key
+        paths = [
+            os.path.join(self.__location, file)
+            for file in os.listdir(self.__location)
+            if file.startswith(model_hash + "-") and file.endswith(".npz")
+            and not file.endswith(INTERPRETATION_SUFFIX)
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[keep:]:
+            interpretation_path = os.path.splitext(path)[0] + INTERPRETATION_SUFFIX
+            if os.path.exists(interpretation_path):
+                os.remove(interpretation_path)
+            os.remove(path)
+
+
+# initialize store to be used in app
+forecast_store = ForecastStore("forecasts")
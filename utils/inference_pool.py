@@ -0,0 +1,408 @@
+"""
+Module containing a pool of worker processes running model inference
+"""
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import Future
+
+import pandas as pd
+
+from utils.forecast_store import Forecast, RunnerUnavailable, predict_forecasts
+from utils.prediction_data import load_dataset_parameters, timeseries_from_parameters
+
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class InferenceError(RuntimeError):
+    """
+    Raised in the calling thread if inference failed in a worker process
+    """
+
+
+class PoolUnhealthy(InferenceError, RunnerUnavailable):
+    """
+    Raised on submit once workers kept dying, so forecasts are computed
+    inline instead
+    """
+
+
+def _worker_main(worker_id: int, tasks: Any, results: Any, load_location: str,
+                 ending: str, num_threads: int, preload: List[str]) -> None:
+    """
+    Loop of a worker process: load models on first use and run each batch
+    of prediction requests sent to it in one forward pass until it receives
+    None
+    """
+    import torch
+
+    # one intra-op thread pool per worker, sized so workers don't
+    # oversubscribe the cores
+    torch.set_num_threads(num_threads)
+
+    from utils.asset_loader import ModelLoader
+
+    model_loader = ModelLoader(load_location, ending)
+    for path in preload:
+        model_loader.load_asset(path)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        batch_id, model_path, requests = task
+        try:
+            model = model_loader.load_asset(model_path)
+            parameters = load_dataset_parameters(model_path)
+            datasets = [
+                timeseries_from_parameters(parameters, pred_df) if dataset is None else dataset
+                for pred_df, dataset in requests
+            ]
+            with torch.no_grad():
+                forecasts = predict_forecasts(model, datasets)
+            results.put((batch_id, worker_id, forecasts, None))
+        except Exception:
+            results.put((batch_id, worker_id, None, traceback.format_exc()))
+
+
+class InferencePool:
+    """
+    Fixed pool of worker processes, each holding the models routed to it
+
+    Requests are put on a queue and dispatched in micro-batches: requests
+    arriving within batch_window seconds of each other are grouped by model,
+    and the datasets of each group are concatenated into a single forward
+    pass; requests for the same model and data share their dataset. Each
+    model is routed to the same worker, which keeps it loaded between
+    batches. Workers that die are restarted with exponential backoff,
+    failing the requests they held; a worker dying max_restarts times within
+    restart_window seconds marks the pool unhealthy.
+    """
+
+    def __init__(self, load_location: str, ending: str, workers: int = 2,
+                 threads_per_worker: int = 1, batch_window: float = 0.01,
+                 max_batch: int = 16, liveness_interval: float = 1.0,
+                 restart_backoff: float = 1.0, max_restarts: int = 5,
+                 restart_window: float = 600.0):
+        self.load_location = load_location
+        self.ending = ending
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.liveness_interval = liveness_interval
+        self.restart_backoff = restart_backoff
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.__requests: "queue.Queue[Optional[Tuple[str, str, pd.DataFrame, Any, Future]]]" = queue.Queue()
+        # futures per data group of each batch sent, when it was sent and
+        # the worker it was sent to
+        self.__pending: Dict[int, Tuple[List[List[Future]], float, int]] = {}
+        self.__pending_lock = threading.Lock()
+        self.__batch_ids = itertools.count()
+        self.__context: Any = None
+        self.__preload: List[str] = []
+        self.__stopping = threading.Event()
+        # restart times per worker within restart_window, and the earliest
+        # time each dead worker may be restarted
+        self.__restarts: List[List[float]] = []
+        self.__restart_at: List[float] = []
+        self.__unhealthy: Optional[str] = None
+        self.__processes: List[multiprocessing.Process] = []
+        self.__tasks: List[Any] = []
+        self.__results: Any = None
+        self.__threads: List[threading.Thread] = []
+        self.__stats: Dict[str, Any] = {
+            "requests": 0,
+            "batches": 0,
+            "forward_passes": 0,
+            "batch_seconds": 0.0,
+            "worker_batches": [0] * workers,
+            "worker_restarts": 0
+        }
+
+    @property
+    def running(self) -> bool:
+        return bool(self.__processes)
+
+    @property
+    def healthy(self) -> bool:
+        return self.__unhealthy is None
+
+    def worker_for(self, model_path: str) -> int:
+        """
+        Index of the worker a model is routed to
+        """
+        return zlib.crc32(model_path.encode()) % self.workers
+
+    def start(self, preload: Optional[List[str]] = None) -> None:
+        """
+        Start worker processes and the threads dispatching to them
+
+        Args:
+            preload (List): checkpoint paths each worker loads before taking
+            requests; each path is only loaded by the worker it is routed to
+        """
+        if self.running:
+            return
+
+        self.__stats["worker_batches"] = [0] * self.workers
+        self.__stopping.clear()
+        self.__restarts = [[] for _ in range(self.workers)]
+        self.__restart_at = [0.0] * self.workers
+        self.__unhealthy = None
+
+        # fork is unsafe once torch has started its thread pools
+        self.__context = multiprocessing.get_context("spawn")
+        self.__preload = list(preload or [])
+        self.__results = self.__context.Queue()
+        for worker_id in range(self.workers):
+            tasks, process = self._start_worker(worker_id)
+            self.__tasks.append(tasks)
+            self.__processes.append(process)
+
+        self.__threads = [
+            threading.Thread(target=self._dispatch, name="inference-dispatch", daemon=True),
+            threading.Thread(target=self._collect, name="inference-collect", daemon=True)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop workers after their current batch; pending requests fail
+        """
+        if not self.running:
+            return
+
+        self.__stopping.set()
+        self.__requests.put(None)
+        for tasks in self.__tasks:
+            tasks.put(None)
+        for process in self.__processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.__results.put(None)
+        for thread in self.__threads:
+            thread.join(timeout=5)
+
+        with self.__pending_lock:
+            pending, self.__pending = self.__pending, {}
+        for groups, _, _ in pending.values():
+            self._resolve(groups, error="inference pool stopped")
+
+        self.__processes, self.__tasks, self.__threads = [], [], []
+
+    def submit(self, model_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+               data_key: Optional[str] = None) -> "Future[Forecast]":
+        """
+        Queue a prediction request
+
+        Args:
+            model_path (str): path of the model checkpoint
+            pred_df (DataFrame): prediction data
+            pred_ts (TimeSeriesDataSet): shared prediction dataset; only sent
+            to the worker if the checkpoint has no stored dataset parameters
+            data_key (str): identifies pred_df, so requests for the same data
+            share a forward pass; defaults to the object's identity
+
+        Returns:
+            Future: resolves to the Forecast for all groups
+        """
+        if not self.running:
+            raise InferenceError("inference pool is not running")
+        if self.__unhealthy is not None:
+            raise PoolUnhealthy(self.__unhealthy)
+
+        future: "Future[Forecast]" = Future()
+        # workers rebuild the dataset from the checkpoint's parameters, which
+        # is cheaper than pickling the TimeSeriesDataSet
+        dataset = None if load_dataset_parameters(model_path) is not None else pred_ts
+        self.__requests.put((model_path, data_key or str(id(pred_df)), pred_df, dataset, future))
+        return future
+
+    def forecast(self, model_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+                 shared_parameters: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = 600) -> Forecast:
+        """
+        Forecast for a model and prediction data, waiting for a worker
+
+        Matches the runner signature of ForecastStore.set_runner.
+
+        Args:
+            model_path (str): path of the model checkpoint
+            pred_df (DataFrame): prediction data
+            pred_ts (TimeSeriesDataSet): shared prediction dataset
+            shared_parameters (Dict): unused, workers read the parameters
+            stored with the checkpoint
+            timeout (float): seconds to wait for the result
+
+        Returns:
+            Forecast: forecast for all groups
+        """
+        return self.submit(model_path, pred_df, pred_ts).result(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Request, batch and forward pass counts, time spent in batches,
+        number of batches per worker, number of worker restarts and whether
+        the pool is healthy
+        """
+        with self.__pending_lock:
+            return {
+                **self.__stats,
+                "worker_batches": list(self.__stats["worker_batches"]),
+                "pending_batches": len(self.__pending),
+                "healthy": self.healthy
+            }
+
+    def _dispatch(self) -> None:
+        """
+        Collect requests for up to batch_window seconds and send one batch per
+        model to its worker
+        """
+        while True:
+            request = self.__requests.get()
+            if request is None:
+                return
+
+            batch = [request]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.__requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.__requests.put(None)
+                    break
+                batch.append(request)
+
+            # group by model, then by data within the model
+            models: Dict[str, Dict[str, Tuple[pd.DataFrame, Any, List[Future]]]] = {}
+            for model_path, data_key, pred_df, dataset, future in batch:
+                data = models.setdefault(model_path, {})
+                data.setdefault(data_key, (pred_df, dataset, []))[2].append(future)
+
+            for model_path, data in models.items():
+                batch_id = next(self.__batch_ids)
+                worker_id = self.worker_for(model_path)
+                # sent under the lock, so a restarted worker's batches are
+                # either failed or sent to its new queue
+                with self.__pending_lock:
+                    self.__pending[batch_id] = (
+                        [futures for _, _, futures in data.values()], time.perf_counter(), worker_id
+                    )
+                    self.__stats["requests"] += sum(len(futures) for _, _, futures in data.values())
+                    self.__stats["batches"] += 1
+                    self.__stats["forward_passes"] += 1
+                    self.__stats["worker_batches"][worker_id] += 1
+                    self.__tasks[worker_id].put((
+                        batch_id,
+                        model_path,
+                        [(pred_df, dataset) for pred_df, dataset, _ in data.values()]
+                    ))
+
+    def _collect(self) -> None:
+        """
+        Resolve futures with the results sent back by workers, checking
+        between results that all workers are alive
+        """
+        while True:
+            try:
+                result = self.__results.get(timeout=self.liveness_interval)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if result is None:
+                return
+            self._check_workers()
+
+            batch_id, worker_id, forecasts, error = result
+            with self.__pending_lock:
+                pending = self.__pending.pop(batch_id, None)
+                if pending is not None:
+                    self.__stats["batch_seconds"] += time.perf_counter() - pending[1]
+            if pending is not None:
+                self._resolve(pending[0], forecasts, error)
+
+    def _start_worker(self, worker_id: int) -> Tuple[Any, multiprocessing.Process]:
+        """
+        Start a worker process with its own task queue
+        """
+        tasks = self.__context.Queue()
+        process = self.__context.Process(
+            target=_worker_main,
+            args=(
+                worker_id, tasks, self.__results, self.load_location, self.ending,
+                self.threads_per_worker,
+                [path for path in self.__preload if self.worker_for(path) == worker_id]
+            ),
+            name="inference-{}".format(worker_id),
+            daemon=True
+        )
+        process.start()
+        return tasks, process
+
+    def _check_workers(self) -> None:
+        """
+        Fail the batches sent to workers that died, so their callers don't
+        wait for the timeout, and restart these workers once their backoff
+        has passed
+        """
+        if self.__stopping.is_set():
+            return
+
+        failed = []
+        now = time.monotonic()
+        with self.__pending_lock:
+            for worker_id, process in enumerate(self.__processes):
+                if process.is_alive():
+                    continue
+
+                for batch_id, (groups, _, batch_worker) in list(self.__pending.items()):
+                    if batch_worker == worker_id:
+                        del self.__pending[batch_id]
+                        failed.append((groups, process.exitcode))
+
+                if self.__unhealthy is not None or now < self.__restart_at[worker_id]:
+                    continue
+
+                restarts = [t for t in self.__restarts[worker_id] if now - t < self.restart_window]
+                if len(restarts) >= self.max_restarts:
+                    self.__unhealthy = "inference worker {} died {} times within {:.0f} s".format(
+                        worker_id, len(restarts) + 1, self.restart_window
+                    )
+                    continue
+
+                self.__restarts[worker_id] = [*restarts, now]
+                # 1, 2, 4, ... times restart_backoff until the next restart
+                self.__restart_at[worker_id] = now + self.restart_backoff * 2 ** len(restarts)
+                self.__tasks[worker_id], self.__processes[worker_id] = self._start_worker(worker_id)
+                self.__stats["worker_restarts"] += 1
+
+        for groups, exitcode in failed:
+            self._resolve(groups, error="inference worker died with exit code {}".format(exitcode))
+
+    @staticmethod
+    def _resolve(groups: List[List[Future]], forecasts: Optional[List[Forecast]] = None,
+                 error: Optional[str] = None) -> None:
+        for index, futures in enumerate(groups):
+            for future in futures:
+                if error is not None:
+                    future.set_exception(InferenceError(error))
+                else:
+                    future.set_result(forecasts[index])
+
+
+# initialize pool to be used in app; workers are started by the entry point
+inference_pool = InferencePool("models", ".ckpt")
@@ -0,0 +1,87 @@
+"""
+Module containing variable importances and attention of TFT forecasts
+"""
+import os
+
+import numpy as np
+
+from typing import Any, Dict, Tuple
+
+
+class Interpretation:
+    """
+    Variable selection weights and attention of a TFT for every group of a
+    prediction dataset, derived from the raw output of the forecast's
+    forward pass and kept as compact float32 arrays in the same group order
+    """
+
+    FIELDS: Tuple[str, ...] = (
+        "static_variables",
+        "encoder_variables",
+        "decoder_variables",
+        "static_importance",
+        "encoder_importance",
+        "decoder_importance",
+        "attention"
+    )
+
+    def __init__(self, static_variables: np.ndarray, encoder_variables: np.ndarray,
+                 decoder_variables: np.ndarray, static_importance: np.ndarray,
+                 encoder_importance: np.ndarray, decoder_importance: np.ndarray,
+                 attention: np.ndarray):
+        # variable names of the columns of the importance arrays
+        self.static_variables = static_variables
+        self.encoder_variables = encoder_variables
+        self.decoder_variables = decoder_variables
+        # (groups, variables) selection weights averaged over time; each
+        # row sums to one
+        self.static_importance = static_importance
+        self.encoder_importance = encoder_importance
+        self.decoder_importance = decoder_importance
+        # (groups, encoder length) attention of the first prediction day on
+        # the encoder days, averaged over heads
+        self.attention = attention
+
+    @classmethod
+    def from_predictions(cls, model: Any, predictions: Dict[str, Any]) -> "Interpretation":
+        """
+        Build interpretation from raw model output
+
+        Args:
+            model (TemporalFusionTransformer): model used for prediction
+            predictions (Dict): raw predictions generated by model
+
+        Returns:
+            Interpretation: interpretation of all groups in the prediction
+        """
+        interpretation = model.interpret_output(predictions, reduction="none")
+
+        def to_numpy(tensor):
+            return tensor.detach().cpu().numpy().astype(np.float32)
+
+        return cls(
+            static_variables=np.asarray(model.static_variables, dtype=str),
+            encoder_variables=np.asarray(model.encoder_variables, dtype=str),
+            decoder_variables=np.asarray(model.decoder_variables, dtype=str),
+            static_importance=to_numpy(interpretation["static_variables"]),
+            encoder_importance=to_numpy(interpretation["encoder_variables"]),
+            decoder_importance=to_numpy(interpretation["decoder_variables"]),
+            attention=to_numpy(interpretation["attention"])
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Write interpretation arrays to an npz file
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **{field: getattr(self, field) for field in self.FIELDS})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Interpretation":
+        """
+        Read interpretation arrays from an npz file
+        """
+        with np.load(path) as arrays:
+            return cls(**{field: arrays[field] for field in cls.FIELDS})
@@ -0,0 +1,86 @@
+"""
+Module containing a catalog of the locations in a prediction dataset
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List
+
+# prefix OWID uses for aggregates such as continents or income groups
+AGGREGATE_PREFIX: str = "OWID"
+
+
+@lru_cache(maxsize=None)
+def load_iso_names(path: str = "iso3.csv") -> Dict[str, str]:
+    """
+    Mapping of ISO3 codes to country names, read once per path
+    """
+    iso_name_df = pd.read_csv(path)
+    return dict(zip(iso_name_df.ISO3, iso_name_df.name))
+
+
+class LocationCatalog:
+    """
+    Immutable lookup of the groups in a prediction dataset, built once per
+    data snapshot. Position in the arrays is the group index used by the
+    model's predictions.
+    """
+
+    def __init__(self, iso_codes: np.ndarray, names: np.ndarray):
+        self.iso_codes = iso_codes
+        self.names = names
+        self.is_aggregate = np.char.startswith(iso_codes.astype(str), AGGREGATE_PREFIX)
+        for array in (self.iso_codes, self.names, self.is_aggregate):
+            array.flags.writeable = False
+
+        self.__index = {iso: index for index, iso in enumerate(iso_codes)}
+        self.__options = [
+            {"label": name, "value": index}
+            for index, name in enumerate(names)
+        ]
+
+    @classmethod
+    def from_prediction_data(cls, pred_df: pd.DataFrame,
+                             iso_names: Dict[str, str]) -> "LocationCatalog":
+        """
+        Build catalog from prediction data
+
+        Args:
+            pred_df (DataFrame): prediction data sorted by location
+            iso_names (Dict): mapping of ISO3 codes to country names
+
+        Returns:
+            LocationCatalog: catalog in order of the prediction groups
+        """
+        iso_codes = pd.unique(pred_df.location).astype(object)
+
+        # OWID aggregates keep their code as display name
+        names = np.array([
+            iso if iso.startswith(AGGREGATE_PREFIX) else iso_names.get(iso, iso)
+            for iso in iso_codes
+        ], dtype=object)
+
+        return cls(iso_codes, names)
+
+    def __len__(self) -> int:
+        return len(self.iso_codes)
+
+    def name(self, index: int) -> str:
+        """
+        Display name of a group
+        """
+        return self.names[index]
+
+    def index(self, iso_code: str) -> int:
+        """
+        Group index of an ISO3 code
+        """
+        return self.__index[iso_code]
+
+    def dropdown_options(self) -> List[Dict[str, object]]:
+        """
+        List of Dictionaries to be passed to Dash Dropdown Menu
+        """
+        return self.__options
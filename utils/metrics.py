@@ -0,0 +1,179 @@
+"""
+Module containing lightweight latency and counter metrics exposed in the
+Prometheus text format
+"""
+import bisect
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+# prefix of all exported metric names
+PREFIX: str = "covid_dashboard"
+
+
+class Histogram:
+    """
+    Cumulative latency histogram with fixed buckets
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Records per-stage latency histograms and labelled counters
+
+    Recording takes a lock and a bisect, so instrumentation can stay on in
+    production.
+    """
+
+    def __init__(self):
+        self.__histograms: Dict[str, Histogram] = {}
+        self.__counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """
+        Record the duration of a stage
+        """
+        with self.__lock:
+            histogram = self.__histograms.get(stage)
+            if histogram is None:
+                histogram = self.__histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """
+        Increase a counter, e.g. increment("cache_requests", result="hit")
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """
+        Context manager recording the duration of its block as a stage,
+        including blocks left by an exception
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        Decorator recording the duration of each call as a stage
+        """
+        def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Copy of the recorded histograms and counters
+        """
+        with self.__lock:
+            return {
+                "histograms": {
+                    stage: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                    for stage, histogram in self.__histograms.items()
+                },
+                "counters": dict(self.__counters)
+            }
+
+    def render(self) -> str:
+        """
+        Metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP {}_stage_seconds Duration of instrumented stages".format(PREFIX),
+            "# TYPE {}_stage_seconds histogram".format(PREFIX)
+        ]
+        for stage, (buckets, counts, total, count) in sorted(snapshot["histograms"].items()):
+            cumulative = 0
+            for bound, bucket_count in zip([*buckets, "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append('{}_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(
+                    PREFIX, escape_label(stage), bound, cumulative
+                ))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {}'.format(
+                PREFIX, escape_label(stage), total
+            ))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(
+                PREFIX, escape_label(stage), count
+            ))
+
+        names = sorted({name for name, _ in snapshot["counters"]})
+        for name in names:
+            lines.append("# TYPE {}_{}_total counter".format(PREFIX, name))
+            for (counter, labels), value in sorted(snapshot["counters"].items()):
+                if counter != name:
+                    continue
+                label_text = ",".join(
+                    '{}="{}"'.format(key, escape_label(value)) for key, value in labels
+                )
+                lines.append("{}_{}_total{} {}".format(
+                    PREFIX, name, "{" + label_text + "}" if label_text else "", value
+                ))
+
+        peak_rss = peak_rss_bytes()
+        if peak_rss is not None:
+            lines.append("# HELP {}_peak_rss_bytes Peak resident set size of the process".format(PREFIX))
+            lines.append("# TYPE {}_peak_rss_bytes gauge".format(PREFIX))
+            lines.append("{}_peak_rss_bytes {}".format(PREFIX, peak_rss))
+
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: Any) -> str:
+    """
+    Label value escaped as the Prometheus text format requires: backslash,
+    double quote and line feed
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of the current process in bytes, None if the
+    platform doesn't report it
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# initialize registry to be used in app
+metrics = MetricsRegistry()
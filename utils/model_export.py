@@ -0,0 +1,250 @@
+"""
+Module containing the export of checkpoints to quantized CPU artifacts
+
+Usage:
+    python -m utils.model_export models/smooth_jazz_5.ckpt path/to/owid-covid-data.json
+
+Converts a checkpoint into a module whose LSTM and linear layers use dynamic
+int8 quantization and stores it next to the checkpoint, after checking that
+its forecasts on the given data stay within tolerance of the fp32 model.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils import data_retrieval
+from utils.prediction_data import (compact_imputed_data, fit_prediction_timeseries,
+                                   load_dataset_parameters, timeseries_from_parameters)
+from utils.run_config import load_run_config, referenced_columns
+
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import torch
+
+# suffix of the exported artifact stored next to a checkpoint
+ARTIFACT_SUFFIX: str = ".int8.pt"
+
+# largest accepted increase of MAE and quantile loss relative to fp32
+PARITY_TOLERANCE: float = 0.02
+
+
+def artifact_path(checkpoint_path: str) -> str:
+    """
+    Path of the exported artifact for a checkpoint
+    """
+    return os.path.splitext(checkpoint_path)[0] + ARTIFACT_SUFFIX
+
+
+def exported_artifact(checkpoint_path: str) -> Optional[str]:
+    """
+    Path of the exported artifact for a checkpoint, None if there is none or
+    it is older than the checkpoint
+    """
+    path = artifact_path(checkpoint_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(checkpoint_path):
+        return path
+    return None
+
+
+def quantize_model(model: "torch.nn.Module") -> "torch.nn.Module":
+    """
+    Copy of a model with dynamically int8-quantized LSTM and linear layers
+
+    Weights are stored as int8 and activations are quantized on the fly, so
+    no calibration data is needed.
+    """
+    import torch
+
+    quantized = torch.quantization.quantize_dynamic(
+        model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8
+    )
+    quantized.eval()
+    return quantized
+
+
+def load_artifact(path: str) -> "torch.nn.Module":
+    """
+    Load an exported artifact on CPU in eval mode
+    """
+    import torch
+
+    model = torch.load(path, map_location=torch.device("cpu"))
+    model.eval()
+    return model
+
+
+def serialized_size(model: "torch.nn.Module") -> int:
+    """
+    Size of a model's state in bytes, including packed quantized weights
+    """
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def fixture_dataset(data: pd.DataFrame, config: Any,
+                    parameters: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Dataset predicting the last max_pred_length known days of each
+    location, so forecasts can be compared with actual values
+
+    Args:
+        data (DataFrame): prepared OWID data
+        config (Config): run configuration as defined in run_config.yml
+        parameters (Dict): training dataset parameters stored with the
+        checkpoint; new encoders are fitted if None
+
+    Returns:
+        TimeSeriesDataSet: dataset in predict mode
+    """
+    data, impute_dummies = compact_imputed_data(data, config)
+    if parameters is not None:
+        return timeseries_from_parameters(parameters, data)
+    return fit_prediction_timeseries(data, config, impute_dummies)
+
+
+def evaluate(model: Any, dataset: Any, repeat: int = 3) -> Dict[str, float]:
+    """
+    Accuracy and latency of a model on a fixture dataset
+
+    Args:
+        model (BaseModel): model in eval mode
+        dataset (TimeSeriesDataSet): dataset with known decoder targets
+        repeat (int): number of timed predictions
+
+    Returns:
+        Dict: MAE of the point forecast, mean quantile loss and median
+        prediction time in seconds
+    """
+    import torch
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with torch.no_grad():
+            predictions, x = model.predict(
+                dataset, mode="raw", return_x=True, batch_size=max(len(dataset), 1)
+            )
+        times.append(time.perf_counter() - start)
+
+    output = predictions["prediction"]
+    target = x["decoder_target"]
+    point = model.loss.to_prediction(output)
+    return {
+        "mae": float((point - target).abs().mean()),
+        "quantile_loss": float(model.loss.loss(output, target).mean()),
+        "seconds": float(np.median(times))
+    }
+
+
+def parity_report(reference: Dict[str, float], candidate: Dict[str, float],
+                  tolerance: float = PARITY_TOLERANCE) -> Dict[str, Any]:
+    """
+    Compare evaluations of the fp32 model and an exported artifact
+
+    Args:
+        reference (Dict): evaluation of the fp32 model
+        candidate (Dict): evaluation of the artifact
+        tolerance (float): largest accepted relative increase of MAE and
+        quantile loss
+
+    Returns:
+        Dict: relative change per metric and whether the artifact passes
+    """
+    change = {
+        metric: candidate[metric] / reference[metric] - 1 if reference[metric] else 0.0
+        for metric in ("mae", "quantile_loss", "seconds")
+    }
+    return {
+        "change": change,
+        "passed": change["mae"] <= tolerance and change["quantile_loss"] <= tolerance
+    }
+
+
+def export_checkpoint(checkpoint_path: str, data: pd.DataFrame, config: Any,
+                      tolerance: float = PARITY_TOLERANCE, force: bool = False) -> Dict[str, Any]:
+    """
+    Quantize a checkpoint and store the artifact next to it if it passes the
+    parity check
+
+    Args:
+        checkpoint_path (str): path of the model checkpoint
+        data (DataFrame): prepared OWID data to check parity on
+        config (Config): run configuration as defined in run_config.yml
+        tolerance (float): largest accepted relative increase of MAE and
+        quantile loss
+        force (bool): store the artifact even if the check fails
+
+    Returns:
+        Dict: evaluations, sizes in bytes, parity report and artifact path
+        (None if not stored)
+    """
+    import torch
+    from pytorch_forecasting import TemporalFusionTransformer
+
+    model = TemporalFusionTransformer.load_from_checkpoint(
+        checkpoint_path, map_location=torch.device("cpu")
+    )
+    model.eval()
+    quantized = quantize_model(model)
+
+    dataset = fixture_dataset(data, config, load_dataset_parameters(checkpoint_path))
+    report = {
+        "fp32": {**evaluate(model, dataset), "bytes": serialized_size(model)},
+        "int8": {**evaluate(quantized, dataset), "bytes": serialized_size(quantized)},
+    }
+    report["parity"] = parity_report(report["fp32"], report["int8"], tolerance)
+
+    report["artifact"] = None
+    if report["parity"]["passed"] or force:
+        path = artifact_path(checkpoint_path)
+        tmp_path = path + ".tmp"
+        torch.save(quantized, tmp_path)
+        os.replace(tmp_path, path)
+        report["artifact"] = path
+
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export a checkpoint to a quantized CPU artifact")
+    parser.add_argument("checkpoint", help="path of the checkpoint in models/")
+    parser.add_argument("data", help="OWID JSON file or URL to check parity on")
+    parser.add_argument("--config", default="run_config.yml", help="run configuration")
+    parser.add_argument("--tolerance", type=float, default=PARITY_TOLERANCE,
+                        help="largest accepted relative increase of MAE and quantile loss")
+    parser.add_argument("--force", action="store_true",
+                        help="store the artifact even if the parity check fails")
+    args = parser.parse_args()
+
+    config = load_run_config(args.config)
+    data, _, _ = data_retrieval.stream_prepared_data(args.data, referenced_columns(config))
+    report = export_checkpoint(args.checkpoint, data, config, args.tolerance, args.force)
+
+    for name in ("fp32", "int8"):
+        result = report[name]
+        print("{}: MAE {:.3f}, quantile loss {:.3f}, {:.1f} ms, {:.2f} MB".format(
+            name, result["mae"], result["quantile_loss"],
+            result["seconds"] * 1e3, result["bytes"] / 1e6
+        ))
+    change = report["parity"]["change"]
+    print("change: MAE {:+.2%}, quantile loss {:+.2%}, latency {:+.2%}".format(
+        change["mae"], change["quantile_loss"], change["seconds"]
+    ))
+
+    if report["artifact"] is None:
+        print("parity check failed, no artifact written")
+        sys.exit(1)
+    print("artifact written to {}".format(report["artifact"]))
+
+
+if __name__ == "__main__":
+    main()
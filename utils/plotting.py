@@ -1,29 +1,47 @@
 """
 Module containing plotting function for predictions
 """
+import base64
+import json
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import torch
-from pytorch_forecasting.models import BaseModel
+from plotly.subplots import make_subplots
 from pandas import DataFrame, Timestamp
 from plotly.graph_objects import Figure
-from typing import Dict, Any
+from utils.forecast_store import Forecast
+from utils.interpretation import Interpretation
+from utils.metrics import metrics
+from utils.scenarios import SCENARIO_COVARIATES, ScenarioForecast
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# qualitative colors assigned to countries in comparison charts
+COMPARISON_COLORS: List[str] = [
+    "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+    "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf"
+]
 
-def plot_country_prediction(model: BaseModel, predictions: Dict[str,Any], x: Dict[str,Any], idx: int, country_name: str,
-                            day_zero: Timestamp, train_end: Timestamp=None) -> Figure:
+@metrics.timed("plot_country_prediction")
+def plot_country_prediction(forecast: Forecast, idx: int, country_name: str,
+                            last_known: Timestamp, train_end: Timestamp=None) -> Figure:
     """
     Adapted prediction function to make plotly line chart for predictions and
     quantiles
     see https://plotly.com/python/line-charts/
 
+    Single countries are drawn in the browser from the forecast bundle (see
+    assets/forecast_bundle.js, which matches this chart); the server draws
+    them with this function until the bundle has arrived.
+
     Args:
-        model (BaseModel): model used for prediction
-        predictions (Dict): predictions generated by model
-        x (dict): information on covariaates returned by model prediction
-        idx (int): index of country in model embbedding
+        forecast (Forecast): stored forecast for all countries
+        idx (int): row of country in forecast arrays
         country_name (type): Name of country to be ussed in plot title
-        day_zero (Timestamp): most recent date with known data
+        last_known (Timestamp): most recent date with known data, predictions
+        start the day after
         train_end (Timestamp): most recent date in training data; if specified,
         end of training period will be marked in plot
 
@@ -33,44 +51,34 @@ def plot_country_prediction(model: BaseModel, predictions: Dict[str,Any], x: Dic
     """
 
 
-  # these will be the same for all time series
-    encoder_length: int = x["encoder_lengths"].tolist()[0]
-    decoder_length: int = x["decoder_lengths"].tolist()[0]
-
-
-  # get predictions and quantiles for country
-    quantiles = model.loss.to_quantiles(predictions["prediction"])[idx]
-    quantiles_t = torch.transpose(quantiles[:decoder_length, :x["decoder_lengths"][idx]], 0, 1).tolist()
-    y_lower = quantiles_t[0]
-    y_upper = quantiles_t[-1]
-
-    pred_list = model.loss.to_prediction(predictions["prediction"])
-    y_pred = pred_list[idx].detach().cpu()[: x["decoder_lengths"][idx]].tolist()
-
-    y_known = x['encoder_target'][idx].tolist()
+  # longest encoder and decoder of all time series
+    encoder_length: int = int(forecast.encoder_target.shape[1])
+    decoder_length: int = int(forecast.prediction.shape[1])
 
-  # prepare ys and xs for correct display (see "Filled Lines" in plotly line chart docs)
-    x_range = pd.date_range((day_zero - pd.DateOffset(days=encoder_length)).strftime("%Y-%m-%d"),
-                    (day_zero + pd.DateOffset(days=decoder_length-1)).strftime("%Y-%m-%d"), freq="D").to_list()
-    x_rev = x_range[-1::-1]
-    y_known_p = y_known + (decoder_length*[np.nan])
-    y_pred_p = (encoder_length*[np.nan]) + y_pred
-    y_upper_p = (encoder_length*[np.nan]) + y_upper
-    y_lower_p =  (encoder_length*[np.nan]) + y_lower
-
-  # build plot
-    y1 = y_known_p
-    y1_upper = y_upper_p
-    y1_lower = y_lower_p.copy()
-    y1_lower = y1_lower[-1::-1]
+  # slice only the country's row; values before and after the known and
+  # predicted periods are padded with NaN
+    n_predicted = forecast.decoder_lengths[idx]
+    encoder_pad = np.full(encoder_length, np.nan, dtype=np.float32)
+    decoder_pad = np.full(decoder_length - n_predicted, np.nan, dtype=np.float32)
+    quantiles = forecast.quantiles[idx, :n_predicted]
+    y_known = known_history(forecast.encoder_target[[idx]], forecast.encoder_lengths[[idx]])[0]
 
+    y1 = np.concatenate([y_known, np.full(decoder_length, np.nan, dtype=np.float32)])
+    y_pred_p = np.concatenate([encoder_pad, forecast.prediction[idx, :n_predicted], decoder_pad])
+    y1_upper = np.concatenate([encoder_pad, quantiles[:, -1], decoder_pad])
+    y1_lower = np.concatenate([encoder_pad, quantiles[:, 0], decoder_pad])
 
+  # prepare xs for correct display (see "Filled Lines" in plotly line chart docs);
+  # the history ends on the last known day, predictions start the day after
+    x_range = (last_known.normalize() + pd.to_timedelta(
+        np.arange(1 - encoder_length, decoder_length + 1), unit="D"
+    )).to_numpy()
 
     fig = go.Figure()
 
     fig.add_trace(go.Scatter(
-        x=x_range+x_rev,
-        y=y1_upper+y1_lower,
+        x=np.concatenate([x_range, x_range[::-1]]),
+        y=np.concatenate([y1_upper, y1_lower[::-1]]),
         fill='toself',
         fillcolor='rgba(0,100,80,0.2)',
         line_color='rgba(255,255,255,0)',
@@ -110,7 +118,7 @@ def plot_country_prediction(model: BaseModel, predictions: Dict[str,Any], x: Dic
 
         fig.add_annotation(
             x = train_end, #+ pd.DateOffset(days=2),
-            y = max(y_known),
+            y = float(np.nanmax(y_known)),
             text = "End of Model Training Data",
             showarrow=False,
             xshift= -80
@@ -118,3 +126,405 @@ def plot_country_prediction(model: BaseModel, predictions: Dict[str,Any], x: Dic
         )
 
     return fig
+
+
+def known_history(encoder_target: np.ndarray, encoder_lengths: np.ndarray) -> np.ndarray:
+    """
+    Encoder targets of several groups aligned to end on the last known day
+
+    Encoders are right-padded to the longest one in the batch, so a group's
+    last known value is at its encoder length - 1; shorter histories are
+    padded with NaN in front instead.
+
+    Args:
+        encoder_target (ndarray): (groups, max encoder length) known values
+        encoder_lengths (ndarray): (groups,) encoder length of each group
+
+    Returns:
+        ndarray: (groups, max encoder length) known values, last known day last
+    """
+    width = encoder_target.shape[1]
+    columns = np.arange(width)[None, :] - (width - encoder_lengths[:, None])
+    rows = np.arange(len(encoder_target))[:, None]
+    return np.where(
+        columns >= 0, encoder_target[rows, np.maximum(columns, 0)], np.nan
+    ).astype(np.float32)
+
+
+def downsample_history(values: np.ndarray, max_points: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce encoder histories of several groups to at most max_points values
+    each by averaging consecutive days
+
+    Args:
+        values (ndarray): (groups, days) known values
+        max_points (int): largest number of values kept per group
+
+    Returns:
+        tuple: (groups, points) bucket means and (points,) day offset of each
+        bucket's center relative to the first day
+    """
+    n_days = values.shape[1]
+    bucket = max(int(np.ceil(n_days / max_points)), 1)
+    # drop the oldest days so buckets end on the most recent day
+    start = n_days % bucket
+    buckets = values[:, start:].reshape(len(values), -1, bucket)
+    centers = start + np.arange(buckets.shape[1]) * bucket + (bucket - 1) / 2
+    return buckets.mean(axis=2), centers
+
+
+@metrics.timed("plot_country_comparison")
+def plot_country_comparison(forecast: Forecast, rows: List[int], country_names: List[str],
+                            last_known: Timestamp, layout: str = "overlay",
+                            max_history_points: int = 60) -> Figure:
+    """
+    Chart comparing the forecasts of several countries, built from a single
+    batched forecast with WebGL traces
+
+    The encoder history is downsampled on the server, so the size of the
+    figure grows only by a few dozen points per country.
+
+    Args:
+        forecast (Forecast): stored forecast for all countries
+        rows (List): rows of the countries in the forecast arrays
+        country_names (List): names of the countries, in order of rows
+        last_known (Timestamp): most recent date with known data, predictions
+        start the day after
+        layout (str): "overlay" for one chart, "multiples" for one small chart
+        per country with its prediction interval
+        max_history_points (int): largest number of points drawn per
+        country for the encoder history
+
+    Returns:
+        figure: plotly figure comparing the countries
+    """
+    rows = np.asarray(rows)
+    encoder_lengths = forecast.encoder_lengths[rows]
+    encoder_length: int = int(forecast.encoder_target.shape[1])
+    decoder_length: int = int(forecast.prediction.shape[1])
+
+    # slice all selected rows at once; predictions beyond a country's
+    # decoder length are NaN
+    history, centers = downsample_history(
+        known_history(forecast.encoder_target[rows], encoder_lengths), max_history_points
+    )
+    predicted = np.arange(decoder_length)[None, :] < forecast.decoder_lengths[rows][:, None]
+    predictions = np.where(predicted, forecast.prediction[rows], np.nan)
+    quantiles = np.where(predicted[..., None], forecast.quantiles[rows], np.nan)
+
+    first_day = last_known.normalize() - pd.Timedelta(days=encoder_length - 1)
+    x_history = (first_day + pd.to_timedelta(centers, unit="D")).to_numpy()
+    # predictions continue from the last known value
+    x_prediction = (last_known.normalize() + pd.to_timedelta(
+        np.arange(decoder_length + 1), unit="D"
+    )).to_numpy()
+    last_values = forecast.encoder_target[rows, encoder_lengths - 1][:, None]
+    predictions = np.concatenate([last_values, predictions], axis=1)
+
+    n_cols = min(len(rows), 3)
+    n_rows = int(np.ceil(len(rows) / n_cols))
+
+    traces = []
+    positions = []
+    for i, name in enumerate(country_names):
+        color = COMPARISON_COLORS[i % len(COMPARISON_COLORS)]
+        if layout == "multiples":
+            # prediction interval from the outermost quantiles
+            traces.append(go.Scattergl(
+                x=x_prediction[1:], y=quantiles[i, :, -1], mode="lines",
+                line={"width": 0}, hoverinfo="skip", showlegend=False
+            ))
+            traces.append(go.Scattergl(
+                x=x_prediction[1:], y=quantiles[i, :, 0], mode="lines",
+                line={"width": 0}, fill="tonexty", fillcolor="rgba(0,100,80,0.2)",
+                hoverinfo="skip", showlegend=False
+            ))
+
+        traces.append(go.Scattergl(
+            x=x_history, y=history[i], mode="lines", name=name,
+            legendgroup=name, line={"color": color}
+        ))
+        traces.append(go.Scattergl(
+            x=x_prediction, y=predictions[i], mode="lines", name=name + " (predicted)",
+            legendgroup=name, showlegend=False, line={"color": color, "dash": "dash"}
+        ))
+        positions += [(i // n_cols + 1, i % n_cols + 1)] * (len(traces) - len(positions))
+
+    if layout == "multiples":
+        fig = make_subplots(
+            rows=n_rows, cols=n_cols, subplot_titles=country_names,
+            shared_xaxes=True, vertical_spacing=0.3 / n_rows
+        )
+        # adding all traces in one call avoids revalidating the figure per trace
+        fig.add_traces(
+            traces,
+            rows=[row for row, _ in positions],
+            cols=[col for _, col in positions]
+        )
+    else:
+        fig = go.Figure(data=traces)
+
+    fig.update_layout(
+        yaxis_title="New Cases (7-day Avg.)",
+        showlegend=layout != "multiples",
+        height=300 * n_rows if layout == "multiples" else None
+    )
+
+    return fig
+
+
+@metrics.timed("plot_interpretation")
+def plot_interpretation(interpretation: Interpretation, idx: int, country_name: str,
+                        last_known: Timestamp, max_variables: int = 10) -> Figure:
+    """
+    Chart of a country's attention over the encoder days and the importance
+    of static, encoder and decoder variables, read from stored arrays
+
+    Args:
+        interpretation (Interpretation): stored interpretation for all countries
+        idx (int): row of country in interpretation arrays
+        country_name (str): name of country to be used in plot title
+        last_known (Timestamp): most recent date with known data, predictions
+        start the day after
+        max_variables (int): number of most important variables shown per kind
+
+    Returns:
+        figure: plotly figure with attention and variable importances
+    """
+    fig = make_subplots(
+        rows=2, cols=3,
+        specs=[[{"colspan": 3}, None, None], [{}, {}, {}]],
+        subplot_titles=("Attention", "Static Variables", "Encoder Variables", "Decoder Variables"),
+        vertical_spacing=0.15,
+        horizontal_spacing=0.15
+    )
+
+    # attention of the first prediction day on the encoder days
+    attention = interpretation.attention[idx]
+    x_range = (last_known.normalize() + pd.to_timedelta(
+        np.arange(1 - len(attention), 1), unit="D"
+    )).to_numpy()
+    fig.add_trace(go.Scatter(
+        x=x_range, y=attention, line_color="rgb(0,100,80)", showlegend=False
+    ), row=1, col=1)
+
+    kinds = [
+        (interpretation.static_variables, interpretation.static_importance),
+        (interpretation.encoder_variables, interpretation.encoder_importance),
+        (interpretation.decoder_variables, interpretation.decoder_importance)
+    ]
+    for col, (names, importance) in enumerate(kinds, start=1):
+        # most important variables on top
+        order = np.argsort(importance[idx])[-max_variables:]
+        fig.add_trace(go.Bar(
+            x=importance[idx, order] * 100, y=names[order], orientation="h",
+            marker_color="rgb(0,100,80)", showlegend=False
+        ), row=2, col=col)
+        fig.update_xaxes(title_text="Importance in %", row=2, col=col)
+
+    fig.update_layout(
+        title="{}: Model Interpretation".format(country_name),
+        height=700,
+        margin={"l": 160}
+    )
+
+    return fig
+
+
+@metrics.timed("plot_scenarios")
+def plot_scenarios(scenario: ScenarioForecast, country_names: List[str], last_known: Timestamp,
+                   history_days: int = 60) -> Figure:
+    """
+    Chart of the predictions of every variant of a scenario for each of its
+    countries, with the interval of the fully changed variant
+
+    Args:
+        scenario (ScenarioForecast): forecasts per variant and country
+        country_names (List): names in the order of the scenario's locations
+        last_known (Timestamp): most recent date with known data, predictions
+        start the day after
+        history_days (int): number of most recent known days shown
+
+    Returns:
+        figure: plotly figure with one subplot per country
+    """
+    n_variants, n_locations, decoder_length = scenario.prediction.shape
+
+    # say which changes are scaled from other countries for lack of own values
+    titles = []
+    for loc, country_name in enumerate(country_names):
+        peers = [
+            col.replace("_", " ") for col, changed, peer in
+            zip(SCENARIO_COVARIATES, scenario.changes[-1], scenario.peer_reference[loc])
+            if changed and peer
+        ]
+        titles.append(country_name + (
+            " ({} relative to other countries' per-capita level, no own data)".format(
+                " and ".join(peers)
+            ) if peers else ""
+        ))
+
+    fig = make_subplots(
+        rows=n_locations, cols=1, subplot_titles=titles, vertical_spacing=0.08
+    )
+
+    history = known_history(scenario.encoder_target, scenario.encoder_lengths)[:, -history_days:]
+    x_known = (last_known.normalize() + pd.to_timedelta(
+        np.arange(1 - history.shape[1], 1), unit="D"
+    )).to_numpy()
+    x_pred = (last_known.normalize() + pd.to_timedelta(
+        np.arange(1, decoder_length + 1), unit="D"
+    )).to_numpy()
+
+    # label variants by their change of each adjusted covariate
+    adjusted = [col for col, change in zip(SCENARIO_COVARIATES, scenario.changes[-1]) if change]
+    labels = [
+        ", ".join("{} {:+.0f}%".format(col, changes[SCENARIO_COVARIATES.index(col)] * 100)
+                  for col in adjusted) if changes.any() else "No change"
+        for changes in scenario.changes
+    ]
+
+    for loc in range(n_locations):
+        n_predicted = scenario.decoder_lengths[loc]
+        first = loc == 0
+
+        # interval of the fully changed variant
+        lower = scenario.quantiles[-1, loc, :n_predicted, 0]
+        upper = scenario.quantiles[-1, loc, :n_predicted, -1]
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([x_pred[:n_predicted], x_pred[:n_predicted][::-1]]),
+            y=np.concatenate([upper, lower[::-1]]),
+            fill="toself",
+            fillcolor="rgba(0,100,80,0.2)",
+            line_color="rgba(255,255,255,0)",
+            showlegend=False
+        ), row=loc + 1, col=1)
+
+        fig.add_trace(go.Scatter(
+            x=x_known, y=history[loc], name="Observed", line_color="rgb(31,119,180)",
+            legendgroup="observed", showlegend=first
+        ), row=loc + 1, col=1)
+
+        # from grey for no change to green for the requested change
+        for variant in range(n_variants):
+            weight = variant / max(n_variants - 1, 1)
+            fig.add_trace(go.Scatter(
+                x=x_pred[:n_predicted],
+                y=scenario.prediction[variant, loc, :n_predicted],
+                name=labels[variant],
+                line_color="rgb({:.0f},{:.0f},{:.0f})".format(
+                    150 * (1 - weight), 150 - 50 * weight, 150 - 70 * weight
+                ),
+                line_dash="dot" if variant == 0 else "solid",
+                legendgroup="variant-{}".format(variant),
+                showlegend=first
+            ), row=loc + 1, col=1)
+
+        fig.update_yaxes(title_text="New Cases (7-day Avg.)", row=loc + 1, col=1)
+
+    fig.update_layout(title="What-If Scenario", height=350 * n_locations)
+
+    return fig
+
+
+@metrics.timed("forecast_bundle")
+def forecast_bundle(forecast: Forecast, iso_codes: np.ndarray, country_names: np.ndarray,
+                    last_known: Timestamp, version: str) -> Dict[str, Any]:
+    """
+    Everything needed to draw the prediction chart of any country in the
+    browser (see assets/forecast_bundle.js), for storing in a dcc.Store
+
+    Arrays are float32 in catalog order and base64-encoded; they are
+    gzipped with the rest of the callback response on their way to the
+    browser.
+
+    Args:
+        forecast (Forecast): stored forecast for all countries
+        iso_codes (ndarray): ISO codes in the order of the country selector
+        country_names (ndarray): names used as chart titles, same order
+        last_known (Timestamp): most recent date with known data, predictions
+        start the day after
+        version (str): identifies model and data snapshot of the forecast
+
+    Returns:
+        Dict: JSON-serializable bundle; "rows" maps a selector index to the
+        row in the arrays, -1 if the country has no forecast
+    """
+    positions: List[int] = []
+    forecast_rows: List[int] = []
+    for iso_code in iso_codes:
+        row = forecast.row(iso_code)
+        positions.append(-1 if row is None else len(forecast_rows))
+        if row is not None:
+            forecast_rows.append(row)
+    forecast_rows = np.asarray(forecast_rows, dtype=np.int64)
+
+    # predictions beyond a country's decoder length are NaN, as in the charts
+    decoder_length = forecast.prediction.shape[1]
+    predicted = np.arange(decoder_length)[None, :] < forecast.decoder_lengths[forecast_rows][:, None]
+    quantiles = forecast.quantiles[forecast_rows]
+
+    def encode(values: np.ndarray) -> str:
+        return base64.b64encode(np.ascontiguousarray(values, dtype="<f4").tobytes()).decode()
+
+    return {
+        "version": version,
+        "last_known": str(last_known.date()),
+        "encoder_length": int(forecast.encoder_target.shape[1]),
+        "decoder_length": decoder_length,
+        "names": [str(name) for name in country_names],
+        "rows": positions,
+        "history": encode(known_history(
+            forecast.encoder_target[forecast_rows], forecast.encoder_lengths[forecast_rows]
+        )),
+        "prediction": encode(np.where(predicted, forecast.prediction[forecast_rows], np.nan)),
+        "lower": encode(np.where(predicted, quantiles[..., 0], np.nan)),
+        "upper": encode(np.where(predicted, quantiles[..., -1], np.nan))
+    }
+
+
+class FigureCache:
+    """
+    LRU cache of serialized figures, so selecting a country again returns
+    the stored JSON without building Plotly objects
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.__max_entries = max_entries
+        self.__entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """
+        Figure stored under a key as a dictionary, None if not stored
+
+        Args:
+            key (Hashable): e.g. (model hash, snapshot hash, country, train end)
+        """
+        with self.__lock:
+            figure_json = self.__entries.get(key)
+            if figure_json is None:
+                metrics.increment("figure_cache_requests", result="miss")
+                return None
+            self.__entries.move_to_end(key)
+        metrics.increment("figure_cache_requests", result="hit")
+        return json.loads(figure_json)
+
+    def put(self, key: Hashable, figure: Figure) -> None:
+        """
+        Store a figure's JSON under a key
+        """
+        figure_json = figure.to_json()
+        with self.__lock:
+            self.__entries[key] = figure_json
+            self.__entries.move_to_end(key)
+            if len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+
+# initialize figure cache to be used in app
+figure_cache = FigureCache()
@@ -0,0 +1,327 @@
+"""
+Module containing the construction of prediction data from prepared OWID data
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.dtype_plan import apply_dtype_plan, days_to_date, dtype_plan
+
+# suffix of the file holding the fitted training dataset parameters that is
+# stored next to a checkpoint
+PARAMETERS_SUFFIX: str = ".dataset.pkl"
+
+# loaded parameters by path, reloaded if the file changes
+_parameters: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+
+def build_prediction_timeseries(data: pd.DataFrame, config: Any,
+                                parameters: Optional[Dict[str, Any]] = None) -> List[Any]:
+    """
+    Construct data for the prediction horizon and the Timeseries object to run
+    predictions on
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml
+        parameters (Dict): fitted parameters of a training dataset; if given,
+        its encoders and normalizers are reused instead of fitting new ones
+
+    Returns:
+        List: prediction data and TimeSeriesDataSet built from it
+    """
+    new_prediction_data, impute_dummies = build_prediction_frame(data, config)
+
+    if parameters is not None:
+        pred_ts = timeseries_from_parameters(parameters, new_prediction_data)
+        return [new_prediction_data, pred_ts]
+
+    pred_ts = fit_prediction_timeseries(new_prediction_data, config, impute_dummies)
+
+    return [new_prediction_data, pred_ts]
+
+
+def fit_prediction_timeseries(data: pd.DataFrame, config: Any, impute_dummies: List[str],
+                              predict: bool = True) -> Any:
+    """
+    Fit a TimeSeriesDataSet on imputed data, with new encoders and
+    normalizers
+
+    Args:
+        data (DataFrame): imputed data with compact dtypes
+        config (Config): run configuration as defined in run_config.yml
+        impute_dummies (List): names of the imputation dummy columns
+        predict (bool): if True, only the last max_pred_length days of each
+        location are predicted; otherwise the dataset holds every window
+
+    Returns:
+        TimeSeriesDataSet: dataset built from data
+    """
+    # imported here to keep application startup fast
+    from pytorch_forecasting.data import GroupNormalizer
+    from pytorch_forecasting.data.timeseries import TimeSeriesDataSet
+
+    # create time series object
+    return TimeSeriesDataSet(
+        data,
+        group_ids=["location"],
+        time_idx="time_idx",
+        static_categoricals=['location', 'continent', 'tests_units'],
+        static_reals = config.static_reals,
+        time_varying_known_categoricals=['month', *impute_dummies], #allow for missings to be flagged on country-level over time - needs to be assumed in forecasts
+        time_varying_known_reals=config.time_varying_known_reals,
+        target_normalizer=GroupNormalizer(groups=['location'], transformation=config.transformation),
+        add_relative_time_idx=True,
+        add_target_scales=True,
+        add_encoder_length=True,
+        target= config.targets,
+        max_encoder_length=config.max_encoder_length,
+        max_prediction_length=config.max_pred_length,
+        predict_mode=predict,
+        allow_missings=True,
+    )
+
+
+def impute_data(data: pd.DataFrame, config: Any) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Drop locations with too few observations, fill missing values and flag
+    them in "_was_missing" dummy columns
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml
+
+    Returns:
+        tuple: imputed data sorted by location and names of the dummy columns
+    """
+
+    # get observations with insufficient data points
+
+    indices_to_drop = data.groupby("location").agg("size").loc[
+       (data.groupby("location").agg("size") <
+        config.max_encoder_length)
+       |
+       (data.groupby("location").agg("size") <
+        config.max_pred_length)
+    ].index.to_list()
+
+    #set training cutoff programatically
+    config.training_cutoff = data['time_idx'].max() - config.max_pred_length
+
+    # adjust data to match training format
+    data.drop(index=data.loc[data.location.isin(indices_to_drop)].index, inplace=True)
+    data = data.sort_values('location')
+
+    # make new columns indicating what will be imputed
+    cols_with_missing = (col for col in [
+        *config.static_reals,
+        *config.time_varying_known_reals,
+        config.targets
+    ] if data[col].isnull().any())
+
+    for col in cols_with_missing:
+        data[col + '_was_missing'] = data[col].isnull()
+
+    data[[
+        *config.static_reals,
+        *config.time_varying_known_reals,
+        config.targets
+    ]] = data[[
+    *config.static_reals,
+    *config.time_varying_known_reals,
+    config.targets]].fillna(0)
+
+
+    impute_dummies = [col for
+                      col in data.columns if col.endswith("_was_missing")]
+
+    data[impute_dummies] = data[impute_dummies].astype("str").astype("category")
+
+    # if the dataset still contains missing values for the target, count them and drop them
+    missing_targets = data.loc[data[config.targets].isna()][["location","date"]].copy(deep=True)
+    data.drop(index=missing_targets.index, inplace=True)
+
+    return data, impute_dummies
+
+
+def compact_imputed_data(data: pd.DataFrame, config: Any) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Imputed data with the compact dtypes of the prediction data, covering the
+    full history of each location
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml
+
+    Returns:
+        tuple: imputed data and names of the imputation dummy columns
+    """
+    data, impute_dummies = impute_data(data, config)
+    return apply_dtype_plan(data, dtype_plan(config)), impute_dummies
+
+
+def build_prediction_frame(data: pd.DataFrame, config: Any) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Impute prepared data and append the prediction horizon to the last
+    encoder window of each location
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml
+
+    Returns:
+        tuple: prediction data with compact dtypes (see dtype_plan) and names
+        of the imputation dummy columns
+    """
+    data, impute_dummies = impute_data(data, config)
+
+    # from pytorch tutorial
+    # select last 180 days
+    encoder_data = data[
+    lambda x: x.time_idx > x.time_idx.max() - config.max_encoder_length
+    ]
+
+    # repeat the last known day of each location once per horizon day
+    last_data = data[lambda x: x.time_idx == x.time_idx.max()]
+    horizon = np.tile(np.arange(1, config.max_pred_length + 1), len(last_data))
+    decoder_data = last_data.loc[last_data.index.repeat(config.max_pred_length)]
+    decoder_data = decoder_data.reset_index(drop=True)
+
+    # shift dates and keep time index consistent with "data"
+    decoder_data["date"] = decoder_data["date"] + pd.to_timedelta(horizon, unit="D")
+    decoder_data["time_idx"] = decoder_data["time_idx"] + horizon
+
+    # adjust additional time feature(s)
+    decoder_data["month"] = decoder_data.date.dt.month.astype(str).astype("category")  # categories have be strings
+
+    # combine encoder and decoder data
+    new_prediction_data = pd.concat([encoder_data, decoder_data], ignore_index=True)
+
+    # downcast reals, store strings as categoricals and dates as day offsets
+    new_prediction_data = apply_dtype_plan(new_prediction_data, dtype_plan(config))
+
+    return new_prediction_data, impute_dummies
+
+
+def last_known_date(pred_df: pd.DataFrame, max_pred_length: int) -> pd.Timestamp:
+    """
+    Most recent date with known data in prediction data, leaving out the
+    days of the prediction horizon appended by build_prediction_frame
+
+    Args:
+        pred_df (DataFrame): prediction data as built by build_prediction_frame
+        max_pred_length (int): number of days appended per location
+
+    Returns:
+        Timestamp: date of the last encoder day
+    """
+    known = pred_df.time_idx <= pred_df.time_idx.max() - max_pred_length
+    return days_to_date(pred_df.date[known].max())
+
+
+def timeseries_from_parameters(parameters: Dict[str, Any], data: pd.DataFrame,
+                               predict: bool = True) -> Any:
+    """
+    Build prediction dataset reusing the fitted encoders and normalizers of
+    a training dataset
+
+    Locations unknown to the training dataset's encoders are dropped, and
+    imputation dummies the training data had but the prediction data lacks
+    are added as all "False".
+
+    Args:
+        parameters (Dict): parameters as returned by TimeSeriesDataSet.get_parameters
+        data (DataFrame): prediction data as built by build_prediction_frame
+        predict (bool): if True, only the last window of each location is
+        predicted; otherwise the dataset holds every window
+
+    Returns:
+        TimeSeriesDataSet: dataset built from data
+    """
+    from pytorch_forecasting.data.timeseries import TimeSeriesDataSet
+
+    data = data.copy(deep=False)
+    for col in parameters["time_varying_known_categoricals"]:
+        if col not in data.columns:
+            data[col] = pd.Categorical(["False"] * len(data))
+
+    location_encoder = parameters["categorical_encoders"].get("__group_id__location")
+    if location_encoder is not None:
+        data = data.loc[data.location.isin(list(location_encoder.classes_))]
+        if isinstance(data.location.dtype, pd.CategoricalDtype):
+            data["location"] = data.location.cat.remove_unused_categories()
+
+    return TimeSeriesDataSet.from_parameters(
+        parameters, data, predict=predict, stop_randomization=True
+    )
+
+
+def parameters_path(checkpoint_path: str) -> str:
+    """
+    Path of the training dataset parameters stored next to a checkpoint
+    """
+    return os.path.splitext(checkpoint_path)[0] + PARAMETERS_SUFFIX
+
+
+def save_dataset_parameters(dataset: Any, checkpoint_path: str) -> str:
+    """
+    Store the fitted parameters of a training dataset next to a checkpoint
+    """
+    path = parameters_path(checkpoint_path)
+    with open(path, "wb") as file:
+        pickle.dump(dataset.get_parameters(), file)
+    return path
+
+
+def load_dataset_parameters(checkpoint_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Fitted training dataset parameters stored next to a checkpoint, or None
+    if there are none. The same object is returned until the file changes.
+    """
+    path = parameters_path(checkpoint_path)
+    if not os.path.exists(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    known = _parameters.get(path)
+    if known is None or known[0] != mtime:
+        with open(path, "rb") as file:
+            known = _parameters[path] = (mtime, pickle.load(file))
+    return known[1]
+
+
+def reference_parameters(checkpoint_paths: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Parameters of the first checkpoint that has them stored, used to build
+    the shared prediction dataset without fitting
+    """
+    for checkpoint_path in sorted(checkpoint_paths):
+        parameters = load_dataset_parameters(checkpoint_path)
+        if parameters is not None:
+            return parameters
+    return None
+
+
+def dataset_for_checkpoint(checkpoint_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+                           shared_parameters: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Prediction dataset to run a checkpoint on: the shared dataset, unless the
+    checkpoint was trained with different stored parameters
+
+    Args:
+        checkpoint_path (str): path of the model checkpoint
+        pred_df (DataFrame): prediction data
+        pred_ts (TimeSeriesDataSet): shared prediction dataset
+        shared_parameters (Dict): parameters pred_ts was built from, if any
+
+    Returns:
+        TimeSeriesDataSet: dataset matching the checkpoint's encoders
+    """
+    parameters = load_dataset_parameters(checkpoint_path)
+    if parameters is None or parameters is shared_parameters:
+        return pred_ts
+    return timeseries_from_parameters(parameters, pred_df)
@@ -0,0 +1,59 @@
+"""
+Module containing helpers for working with the parameters in run_config.yml
+"""
+import yaml
+
+from types import SimpleNamespace
+from typing import Any, List
+
+# columns needed besides those referenced in run_config.yml
+KEY_COLUMNS: List[str] = ["location", "date", "continent", "tests_units"]
+
+# columns computed during data preparation rather than read from OWID
+DERIVED_COLUMNS: List[str] = ["time_idx", "month"]
+
+
+def load_run_config(path: str = "run_config.yml") -> SimpleNamespace:
+    """
+    Read run configuration, exposing each entry's value as an attribute
+
+    This reads the same format as wandb's config files, without importing
+    wandb at startup.
+
+    Args:
+        path (str): path of the config file
+
+    Returns:
+        SimpleNamespace: config values by entry name
+    """
+    with open(path) as file:
+        entries = yaml.safe_load(file)
+
+    return SimpleNamespace(**{
+        key: entry["value"] for key, entry in entries.items()
+        if isinstance(entry, dict) and "value" in entry
+    })
+
+
+def referenced_columns(config: Any) -> List[str]:
+    """
+    List of OWID columns needed to build prediction data for a run config
+
+    Args:
+        config (Config): run configuration exposing static_reals,
+        time_varying_known_reals and targets as attributes
+
+    Returns:
+        List: column names, keys first, without duplicates
+    """
+    columns = [
+        *KEY_COLUMNS,
+        *config.static_reals,
+        *config.time_varying_known_reals,
+        config.targets
+    ]
+
+    return [
+        col for col in dict.fromkeys(columns)
+        if col not in DERIVED_COLUMNS
+    ]
@@ -0,0 +1,305 @@
+"""
+Module containing what-if forecasts with adjusted known covariates
+
+A scenario changes known covariates such as the stringency index over the
+prediction horizon of a few locations, relative to each location's own
+values or, where these are all zero (e.g. vaccinations imputed as 0), to the
+median per-capita level of the other locations scaled to its population. The prediction data of these
+locations is sliced from the shared prediction data and turned into a small
+dataset with the fitted encoders and scalers of the model; all variants of a
+scenario are then predicted in a single forward pass on copies of its batch.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils.metrics import metrics
+from utils.prediction_data import load_dataset_parameters, timeseries_from_parameters
+
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+# known covariates that can be adjusted in scenarios
+SCENARIO_COVARIATES: List[str] = ["stringency_index", "new_vaccinations_smoothed"]
+
+# range of valid values per covariate, changed values are clipped to it
+COVARIATE_BOUNDS: Dict[str, Tuple[float, float]] = {
+    "stringency_index": (0.0, 100.0),
+    "new_vaccinations_smoothed": (0.0, np.inf)
+}
+
+# number of variants predicted per scenario, sweeping from no change to the
+# requested change
+SWEEP_STEPS: int = 5
+
+# largest number of locations in a scenario
+MAX_SCENARIO_LOCATIONS: int = 4
+
+
+def scenario_variants(changes: Dict[str, float], steps: int = SWEEP_STEPS) -> np.ndarray:
+    """
+    Relative changes of each variant, from no change to the requested one
+
+    Args:
+        changes (Dict): relative change per covariate, e.g. -0.2 for -20%
+        steps (int): number of variants
+
+    Returns:
+        ndarray: (steps, covariates) changes in order of SCENARIO_COVARIATES
+    """
+    requested = np.array([changes.get(col, 0.0) for col in SCENARIO_COVARIATES])
+    return np.linspace(0, 1, steps)[:, None] * requested[None, :]
+
+
+def per_capita_level(pred_df: pd.DataFrame, col: str) -> float:
+    """
+    Median value of a covariate per inhabitant over the days and locations
+    where it is known, i.e. not zero
+
+    Args:
+        pred_df (DataFrame): shared prediction data
+        col (str): name of the covariate
+
+    Returns:
+        float: median per-capita value, 0 if the covariate is never known
+    """
+    values = pred_df[col].to_numpy(dtype=np.float64)
+    population = pred_df["population"].to_numpy(dtype=np.float64)
+    known = (values > 0) & (population > 0)
+    return float(np.median(values[known] / population[known])) if known.any() else 0.0
+
+
+class ScenarioForecast:
+    """
+    Quantile forecasts of the variants of a scenario for a few locations
+    """
+
+    def __init__(self, locations: np.ndarray, changes: np.ndarray, levels: np.ndarray,
+                 quantiles: np.ndarray, prediction: np.ndarray,
+                 encoder_target: np.ndarray, encoder_lengths: np.ndarray,
+                 decoder_lengths: np.ndarray, peer_reference: np.ndarray):
+        # (locations,) location codes
+        self.locations = locations
+        # (variants, covariates) relative change of each variant
+        self.changes = changes
+        # (locations, covariates) True where a change is relative to the
+        # population-scaled level of other locations, as the location's own
+        # values are all zero
+        self.peer_reference = peer_reference
+        # (quantiles,) quantile levels of the last axis of quantiles
+        self.levels = levels
+        # (variants, locations, horizon, quantiles)
+        self.quantiles = quantiles
+        # (variants, locations, horizon)
+        self.prediction = prediction
+        # (locations, max encoder length), right-padded
+        self.encoder_target = encoder_target
+        # (locations,)
+        self.encoder_lengths = encoder_lengths
+        # (locations,)
+        self.decoder_lengths = decoder_lengths
+
+
+class ScenarioRunner:
+    """
+    Predicts scenarios for a few locations without touching the others
+
+    The batch of the locations' prediction windows is built once per model,
+    data snapshot and set of locations and kept in an LRU, so moving a
+    slider only runs the forward pass.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self.__max_entries = max_entries
+        self.__entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def prepare(self, key: Hashable, model_path: str, pred_df: pd.DataFrame, pred_ts: Any,
+                iso_codes: List[str]) -> Dict[str, Any]:
+        """
+        Batch of the prediction windows of some locations, with the raw
+        decoder values of the scenario covariates, the levels changes are
+        relative to and the covariates' scalers
+
+        Args:
+            key (Hashable): identifies model, data snapshot and locations
+            model_path (str): path of the model checkpoint
+            pred_df (DataFrame): shared prediction data
+            pred_ts (TimeSeriesDataSet): shared prediction dataset, whose
+            parameters are used if the checkpoint has none stored
+            iso_codes (List): locations of the scenario
+
+        Returns:
+            Dict: batch, locations, raw decoder covariates, reference levels,
+            whether these come from other locations, positions in the batch's
+            continuous variables and scalers of the covariates
+        """
+        with self.__lock:
+            prepared = self.__entries.get(key)
+            if prepared is not None:
+                self.__entries.move_to_end(key)
+                return prepared
+
+        parameters = load_dataset_parameters(model_path) or pred_ts.get_parameters()
+        sliced = pred_df.loc[pred_df.location.isin(iso_codes)]
+        dataset = timeseries_from_parameters(parameters, sliced)
+        if len(dataset) == 0:
+            raise ValueError("no prediction window for locations {}".format(", ".join(iso_codes)))
+        x, _ = next(iter(dataset.to_dataloader(
+            train=False, batch_size=max(len(dataset), 1), num_workers=0
+        )))
+
+        # raw covariate values on the decoder days of each window
+        windows = dataset.decoded_index
+        horizon = x["decoder_cont"].shape[1]
+        decoder_days = pd.MultiIndex.from_arrays([
+            np.repeat(windows.location.astype(str).to_numpy(), horizon),
+            (windows.time_idx_first_prediction.to_numpy()[:, None] + np.arange(horizon)).ravel()
+        ])
+        indexed = sliced.assign(location=sliced.location.astype(str)).set_index(["location", "time_idx"])
+        covariates = [col for col in SCENARIO_COVARIATES if col in dataset.reals]
+        locations = windows.location.astype(str).to_numpy()
+        raw = {
+            col: indexed[col].reindex(decoder_days).to_numpy(dtype=np.float64).reshape(-1, horizon)
+            for col in covariates
+        }
+
+        # changes are relative to a location's own values, unless they are
+        # all zero, which imputation makes of missing values
+        population = (
+            sliced.assign(location=sliced.location.astype(str))
+            .groupby("location")["population"].first()
+            .reindex(locations).to_numpy(dtype=np.float64)
+        )
+        peer_reference = {col: ~(np.nan_to_num(raw[col]) > 0).any(axis=1) for col in covariates}
+        reference = {
+            col: np.where(
+                peer_reference[col][:, None],
+                (per_capita_level(pred_df, col) * population)[:, None],
+                raw[col]
+            )
+            for col in covariates
+        }
+
+        prepared = {
+            "x": x,
+            "locations": locations,
+            "raw": raw,
+            "reference": reference,
+            "peer_reference": peer_reference,
+            "positions": {col: dataset.reals.index(col) for col in covariates},
+            "scalers": {col: dataset.scalers[col] for col in covariates}
+        }
+        with self.__lock:
+            self.__entries[key] = prepared
+            if len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+        return prepared
+
+    @staticmethod
+    def variant_batch(prepared: Dict[str, Any], variants: np.ndarray) -> Dict[str, Any]:
+        """
+        Copies of a prepared batch, one per variant, with the changed
+        covariates on the decoder days
+
+        Args:
+            prepared (Dict): as returned by prepare
+            variants (ndarray): (variants, covariates) relative changes in
+            order of SCENARIO_COVARIATES
+
+        Returns:
+            Dict: batch with variants * locations samples, variant-major
+        """
+        import torch
+
+        n_variants = len(variants)
+        x = {
+            name: value.repeat(n_variants, *[1] * (value.dim() - 1))
+            if isinstance(value, torch.Tensor) else value
+            for name, value in prepared["x"].items()
+        }
+
+        for col, raw in prepared["raw"].items():
+            low, high = COVARIATE_BOUNDS.get(col, (-np.inf, np.inf))
+            change = variants[:, SCENARIO_COVARIATES.index(col), None, None]
+            changed = raw[None] + change * prepared["reference"][col][None]
+            changed = np.clip(changed, low, high).reshape(n_variants * len(raw), -1)
+            # days after a location's decoder length keep their padding
+            known = ~np.isnan(changed)
+
+            # scale like the dataset did when it was built
+            scaled = prepared["scalers"][col].transform(
+                pd.DataFrame({col: changed[known]})
+            ).ravel()
+            column = x["decoder_cont"][:, :, prepared["positions"][col]]
+            column[torch.from_numpy(known)] = torch.from_numpy(scaled).to(column.dtype)
+        return x
+
+    @metrics.timed("scenario_forecast")
+    def forecast(self, model: Any, prepared: Dict[str, Any], variants: np.ndarray) -> ScenarioForecast:
+        """
+        Predict all variants of a scenario in a single forward pass
+
+        Args:
+            model (BaseModel): model in eval mode
+            prepared (Dict): as returned by prepare
+            variants (ndarray): (variants, covariates) relative changes
+
+        Returns:
+            ScenarioForecast: forecasts per variant and location
+        """
+        import torch
+
+        x = self.variant_batch(prepared, variants)
+        with torch.no_grad():
+            output = model(x)["prediction"]
+
+        n_variants, n_locations = len(variants), len(prepared["locations"])
+        quantiles = model.loss.to_quantiles(output).cpu().numpy().astype(np.float32)
+        prediction = model.loss.to_prediction(output).cpu().numpy().astype(np.float32)
+        return ScenarioForecast(
+            locations=prepared["locations"],
+            changes=variants,
+            levels=np.asarray(model.loss.quantiles, dtype=np.float32),
+            quantiles=quantiles.reshape(n_variants, n_locations, *quantiles.shape[1:]),
+            prediction=prediction.reshape(n_variants, n_locations, -1),
+            encoder_target=prepared["x"]["encoder_target"].cpu().numpy().astype(np.float32),
+            encoder_lengths=prepared["x"]["encoder_lengths"].cpu().numpy().astype(np.int32),
+            decoder_lengths=prepared["x"]["decoder_lengths"].cpu().numpy().astype(np.int32),
+            peer_reference=np.stack([
+                prepared["peer_reference"].get(col, np.zeros(n_locations, dtype=bool))
+                for col in SCENARIO_COVARIATES
+            ], axis=1)
+        )
+
+    def run(self, model_path: str, pred_df: pd.DataFrame, pred_ts: Any, iso_codes: List[str],
+            changes: Dict[str, float], load_model: Callable[[str], Any],
+            data_key: Hashable) -> ScenarioForecast:
+        """
+        Forecasts of a scenario for a few locations
+
+        Args:
+            model_path (str): path of the model checkpoint
+            pred_df (DataFrame): shared prediction data
+            pred_ts (TimeSeriesDataSet): shared prediction dataset
+            iso_codes (List): locations of the scenario, at most
+            MAX_SCENARIO_LOCATIONS
+            changes (Dict): relative change per covariate
+            load_model (Callable): loads the model for a checkpoint path
+            data_key (Hashable): identifies model and data snapshot, e.g.
+            ForecastStore.key
+
+        Returns:
+            ScenarioForecast: forecasts of SWEEP_STEPS variants
+        """
+        if len(iso_codes) > MAX_SCENARIO_LOCATIONS:
+            raise ValueError("scenarios are limited to {} locations".format(MAX_SCENARIO_LOCATIONS))
+
+        prepared = self.prepare((data_key, tuple(sorted(iso_codes))), model_path,
+                                pred_df, pred_ts, iso_codes)
+        return self.forecast(load_model(model_path), prepared, scenario_variants(changes))
+
+
+# initialize scenario runner to be used in app
+scenario_runner = ScenarioRunner()
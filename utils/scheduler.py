@@ -0,0 +1,144 @@
+"""
+Module containing a background scheduler precomputing data for callbacks
+"""
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from typing import Any, Callable, Dict, Optional
+
+from utils.metrics import metrics
+
+
+class NotReady(RuntimeError):
+    """
+    Raised to readers while the first round of a started scheduler is still
+    running, so requests don't wait for all of it
+    """
+
+
+class PrecomputeScheduler:
+    """
+    Runs registered jobs in order on a fixed interval in a background thread.
+
+    Each job receives the results of the jobs before it in the same round.
+    Results are only published once all jobs of a round succeeded, so readers
+    keep getting the previous round's results (stale-while-revalidate) until
+    the new ones are complete. Until the background thread has published its
+    first round, readers wait for it at most first_round_timeout seconds.
+    """
+
+    def __init__(self, first_round_timeout: float = 5.0):
+        self.first_round_timeout = first_round_timeout
+        self.__jobs: "OrderedDict[str, Callable[[Dict[str, Any]], Any]]" = OrderedDict()
+        self.__results: Dict[str, Any] = {}
+        self.__refresh_lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__published = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+        self.last_refresh: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def register(self, name: str, job: Callable[[Dict[str, Any]], Any]) -> None:
+        """
+        Add a job to run in each round
+
+        Args:
+            name (str): name the job's result is published under
+            job (Callable): function taking the results of previous jobs
+        """
+        self.__jobs[name] = job
+
+    @property
+    def ready(self) -> bool:
+        return self.__published.is_set()
+
+    def get(self, name: str) -> Any:
+        """
+        Latest published result of a job. If nothing has been published yet,
+        the caller waits for the first round (or runs it, if the scheduler
+        isn't started).
+        """
+        return self.latest()[name]
+
+    def latest(self) -> Dict[str, Any]:
+        """
+        All results of the latest published round, so callers reading
+        several results see a consistent set
+
+        Raises:
+            NotReady: if the background thread hasn't published a round
+            within first_round_timeout seconds
+        """
+        if not self.__results:
+            if self.__thread is not None and self.__thread.is_alive():
+                if not self.__published.wait(self.first_round_timeout):
+                    metrics.increment("scheduler_not_ready")
+                    raise NotReady("precomputed data is still loading")
+            else:
+                self.refresh(only_if_missing=next(iter(self.__jobs)))
+        return self.__results
+
+    def refresh(self, only_if_missing: Optional[str] = None) -> None:
+        """
+        Run all jobs and publish their results
+
+        Args:
+            only_if_missing (str): skip the round if a result for this job was
+            published while waiting for a running round to finish
+        """
+        with self.__refresh_lock:
+            if only_if_missing is not None and only_if_missing in self.__results:
+                return
+
+            start = time.perf_counter()
+            results: Dict[str, Any] = {}
+            for name, job in self.__jobs.items():
+                results[name] = job(results)
+
+            # swap in all results at once
+            self.__results = results
+            self.__published.set()
+            self.last_refresh = time.time()
+            self.last_duration = time.perf_counter() - start
+            metrics.observe("scheduler_refresh", self.last_duration)
+            self.last_error = None
+
+    def start(self, interval: float) -> threading.Thread:
+        """
+        Start refreshing in a daemon thread, beginning immediately
+
+        Args:
+            interval (float): seconds between the end of a round and the
+            start of the next one
+        """
+        if self.__thread is not None and self.__thread.is_alive():
+            return self.__thread
+
+        self.__stop.clear()
+
+        def run() -> None:
+            while not self.__stop.is_set():
+                try:
+                    self.refresh()
+                except Exception:
+                    # keep serving the previous results
+                    self.last_error = traceback.format_exc()
+                    metrics.increment("scheduler_errors")
+                self.__stop.wait(interval)
+
+        self.__thread = threading.Thread(target=run, name="precompute", daemon=True)
+        self.__thread.start()
+        return self.__thread
+
+    def stop(self) -> None:
+        """
+        Stop refreshing after the current round
+        """
+        self.__stop.set()
+
+
+# initialize scheduler to be used in app
+scheduler = PrecomputeScheduler()
@@ -0,0 +1,168 @@
+"""
+Module containing single-flight coalescing of expensive computations across
+threads and processes
+"""
+import functools
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.metrics import metrics
+
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, coalescing is per process there
+    fcntl = None
+
+# suffix of the lock files kept in the lock directory
+LOCK_SUFFIX: str = ".lock"
+
+
+class _Call:
+    """
+    A computation in flight and its outcome, shared with waiting threads
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Makes sure only one caller computes a result for a key at a time
+
+    Threads of a process asking for a key while it is being computed wait
+    for and share the result of the computing thread. Across processes, the
+    computing thread holds an exclusive lock on a file in the lock
+    directory; processes waiting on it look the result up (e.g. in the
+    shared cache) once the lock is released instead of computing it again.
+    The lock is released by the OS if its holder dies.
+
+    Outcomes are counted in metrics as single_flight_calls per kind of
+    computation, with result "computed", "shared_thread", "shared_process"
+    or "lock_timeout"; keys (e.g. data hashes) aren't labels, so the number
+    of label sets stays bounded.
+    """
+
+    def __init__(self, lock_dir: str, lock_timeout: float = 600):
+        self.__lock_dir = lock_dir
+        self.__lock_timeout = lock_timeout
+        self.__calls: Dict[str, _Call] = {}
+        self.__lock = threading.Lock()
+        os.makedirs(self.__lock_dir, exist_ok=True)
+
+    def do(self, kind: str, key: str, compute: Callable[[], Any],
+           lookup: Optional[Callable[[], Any]] = None) -> Any:
+        """
+        Result for a key, computed by at most one caller at a time
+
+        Args:
+            kind (str): kind of computation, used as metric label
+            key (str): identifies the computation
+            compute (Callable): computes and, if it should be shared across
+            processes, stores the result
+            lookup (Callable): returns the stored result, or None if there
+            is none; called after acquiring the lock across processes
+
+        Returns:
+            Any: the computed or shared result
+        """
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            metrics.increment("single_flight_calls", kind=kind, result="shared_thread")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._file_lock(key) as locked:
+                result = lookup() if lookup is not None else None
+                if result is not None:
+                    outcome = "shared_process"
+                else:
+                    result = compute()
+                    outcome = "computed" if locked else "lock_timeout"
+            metrics.increment("single_flight_calls", kind=kind, result=outcome)
+            call.result = result
+            return result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+    def cached(self, cache: Any, key: str, timeout: Optional[int] = None
+               ) -> Callable[[Callable[[], Any]], Callable[[], Any]]:
+        """
+        Decorator caching the result of a function without arguments under a
+        key, with concurrent misses coalesced into a single computation
+
+        Args:
+            cache (Cache): flask_caching cache shared by the app's processes
+            key (str): cache key, also used as metric label
+            timeout (int): seconds until the cached result expires
+        """
+        def decorator(function: Callable[[], Any]) -> Callable[[], Any]:
+            def compute() -> Any:
+                result = function()
+                cache.set(key, result, timeout=timeout)
+                return result
+
+            @functools.wraps(function)
+            def wrapper() -> Any:
+                result = cache.get(key)
+                if result is not None:
+                    return result
+                return self.do(key, key, compute, lookup=lambda: cache.get(key))
+
+            wrapper.uncached = function
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def _file_lock(self, key: str) -> Iterator[bool]:
+        """
+        Hold an exclusive lock on the key's lock file, waiting at most
+        lock_timeout seconds; yields False if the lock wasn't acquired
+        """
+        if fcntl is None:
+            yield True
+            return
+
+        name = hashlib.sha1(key.encode()).hexdigest() + LOCK_SUFFIX
+        with open(os.path.join(self.__lock_dir, name), "a") as file:
+            deadline = time.monotonic() + self.__lock_timeout
+            locked = False
+            while True:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.05)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+# initialize single-flight coalescing to be used in app; lock files live
+# next to the cache entries
+single_flight = SingleFlight("cache")
@@ -0,0 +1,111 @@
+"""
+Module containing a columnar on-disk store for prepared OWID data
+"""
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from typing import Any, Dict, List, Optional
+
+# key under which snapshot info is stored in the parquet schema metadata
+METADATA_KEY: bytes = b"covid_dashboard"
+
+
+class SnapshotStore:
+    """
+    Stores prepared DataFrames as typed parquet files. Categoricals are kept
+    via the pandas metadata written by pyarrow, and summary info on each
+    snapshot is stored in the file's schema metadata so it can be read without
+    loading any data.
+    """
+
+    def __init__(self, location: str):
+        self.__location = location
+        os.makedirs(self.__location, exist_ok=True)
+
+    def path_for(self, name: str) -> str:
+        """
+        Path of the snapshot file for a snapshot name
+        """
+        return os.path.join(self.__location, name + ".parquet")
+
+    def is_fresh(self, name: str, source: Optional[str] = None) -> bool:
+        """
+        Whether a snapshot exists and is not older than its source file
+
+        Args:
+            name (str): name of the snapshot
+            source (str): path of the file the snapshot was built from
+
+        Returns:
+            bool: True if the snapshot can be used instead of the source
+        """
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            return False
+        if source is None or not os.path.exists(source):
+            return True
+
+        return os.path.getmtime(path) >= os.path.getmtime(source)
+
+    def save(self, name: str, data: pd.DataFrame, **info: Any) -> str:
+        """
+        Write a prepared DataFrame to a snapshot file
+
+        Args:
+            name (str): name of the snapshot
+            data (DataFrame): prepared data as returned by prepare_data
+            info: additional JSON-serializable entries for the metadata
+
+        Returns:
+            str: path of the written snapshot
+        """
+        table = pa.Table.from_pandas(data)
+
+        snapshot_info = {
+            "rows": len(data),
+            "locations": int(data["location"].nunique()),
+            "date_min": data["date"].min().isoformat(),
+            "date_max": data["date"].max().isoformat(),
+            **info
+        }
+        table = table.replace_schema_metadata({
+            **table.schema.metadata,
+            METADATA_KEY: json.dumps(snapshot_info).encode()
+        })
+
+        path = self.path_for(name)
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+        return path
+
+    def load(self, name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Load a snapshot, memory-mapping the file and reading only the
+        requested columns
+
+        Args:
+            name (str): name of the snapshot
+            columns (List): columns to load; all columns if None
+
+        Returns:
+            DataFrame: prepared data with dtypes as saved
+        """
+        table = pq.read_table(
+            self.path_for(name),
+            columns=columns,
+            memory_map=True
+        )
+        return table.to_pandas()
+
+    def metadata(self, name: str) -> Dict[str, Any]:
+        """
+        Summary info on a snapshot read from the file footer only
+        """
+        schema = pq.read_schema(self.path_for(name), memory_map=True)
+        return json.loads(schema.metadata[METADATA_KEY])
@@ -0,0 +1,228 @@
+"""
+Module containing a headless training pipeline for TFT models
+
+Usage:
+    python -m utils.training --name my_model [--data URL_OR_PATH]
+        [--batch-size 128] [--loader-workers 4] [--processes 2]
+
+Hyperparameters are read from run_config.yml. The data is prepared and
+imputed the same way as for predictions in the dashboard, and the best
+checkpoint is written to models/ together with the fitted dataset
+parameters, so the dashboard can pick it up on its next start.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from utils import data_retrieval
+from utils.prediction_data import compact_imputed_data, save_dataset_parameters
+from utils.run_config import load_run_config
+
+from typing import Any, Dict, List, Tuple
+
+URL: str = "https://covid.ourworldindata.org/data/owid-covid-data.json"
+
+
+def load_training_data(source: str) -> pd.DataFrame:
+    """
+    Prepared OWID data from a URL or a local JSON file
+    """
+    if source.startswith(("http://", "https://")):
+        raw = data_retrieval.retrieve_data_from_url(source)
+    else:
+        raw = pd.read_json(source, orient="index")
+    data, _, _ = data_retrieval.prepare_data(raw)
+    return data
+
+
+def build_training_datasets(data: pd.DataFrame, config: Any) -> Tuple[Any, Any]:
+    """
+    Training dataset up to the training cutoff and validation dataset
+    predicting the last max_pred_length days of each location
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml;
+        training_cutoff is set on it
+
+    Returns:
+        tuple: training and validation TimeSeriesDataSet
+    """
+    from pytorch_forecasting.data import GroupNormalizer
+    from pytorch_forecasting.data.timeseries import TimeSeriesDataSet
+
+    data, impute_dummies = compact_imputed_data(data, config)
+
+    training = TimeSeriesDataSet(
+        data[lambda x: x.time_idx <= config.training_cutoff],
+        time_idx="time_idx",
+        target=config.targets,
+        group_ids=["location"],
+        min_encoder_length=int(config.max_encoder_length // 2),
+        max_encoder_length=config.max_encoder_length,
+        min_prediction_length=1,
+        max_prediction_length=config.max_pred_length,
+        static_categoricals=["location", "continent", "tests_units"],
+        static_reals=config.static_reals,
+        time_varying_known_categoricals=["month", *impute_dummies],
+        time_varying_known_reals=config.time_varying_known_reals,
+        target_normalizer=GroupNormalizer(groups=["location"], transformation=config.transformation),
+        add_relative_time_idx=True,
+        add_target_scales=True,
+        add_encoder_length=True,
+        allow_missings=True
+    )
+    validation = TimeSeriesDataSet.from_dataset(
+        training, data, predict=True, stop_randomization=True
+    )
+    return training, validation
+
+
+def make_throughput_logger() -> Any:
+    """
+    Lightning callback printing wall-clock time and training samples per
+    second of each epoch, summed over all training processes
+    """
+    import pytorch_lightning as pl
+
+    class ThroughputLogger(pl.Callback):
+
+        def __init__(self):
+            self.history: List[Dict[str, float]] = []
+            self.__start = 0.0
+            self.__samples = 0
+
+        def on_train_epoch_start(self, trainer, pl_module) -> None:
+            self.__start = time.perf_counter()
+            self.__samples = 0
+
+        def on_train_batch_end(self, trainer, pl_module, outputs, batch, *args) -> None:
+            x, (target, weight) = batch
+            self.__samples += target.size(0)
+
+        def on_train_epoch_end(self, trainer, pl_module, *args) -> None:
+            seconds = time.perf_counter() - self.__start
+            samples = self.__samples * trainer.world_size
+            self.history.append({
+                "epoch": trainer.current_epoch,
+                "seconds": seconds,
+                "samples_per_second": samples / seconds if seconds else 0.0
+            })
+            if trainer.is_global_zero:
+                print("epoch {}: {:.1f}s, {:.0f} samples/s".format(
+                    trainer.current_epoch, seconds, samples / seconds if seconds else 0.0
+                ))
+
+    return ThroughputLogger()
+
+
+def train(data: pd.DataFrame, config: Any, name: str, model_dir: str = "models",
+          batch_size: int = 128, loader_workers: int = 4, processes: int = 1,
+          seed: int = 42) -> str:
+    """
+    Train a TFT and store its best checkpoint and dataset parameters
+
+    Args:
+        data (DataFrame): prepared OWID data as returned by prepare_data
+        config (Config): run configuration as defined in run_config.yml
+        name (str): file name of the checkpoint, without ending
+        model_dir (str): directory the dashboard loads models from
+        batch_size (int): samples per batch in each training process;
+        incomplete last batches are dropped so every step has the same size
+        loader_workers (int): data loading worker processes per dataloader
+        processes (int): number of CPU processes training data-parallel
+        seed (int): random seed
+
+    Returns:
+        str: path of the stored checkpoint
+    """
+    import pytorch_lightning as pl
+    from pytorch_lightning.callbacks import EarlyStopping, ModelCheckpoint
+    from pytorch_forecasting import TemporalFusionTransformer
+    from pytorch_forecasting.metrics import QuantileLoss
+
+    pl.seed_everything(seed)
+    training, validation = build_training_datasets(data, config)
+
+    loader_options = {
+        "num_workers": loader_workers,
+        "persistent_workers": loader_workers > 0
+    }
+    train_dataloader = training.to_dataloader(
+        train=True, batch_size=batch_size, drop_last=True, **loader_options
+    )
+    val_dataloader = validation.to_dataloader(
+        train=False, batch_size=batch_size * 4, **loader_options
+    )
+
+    model = TemporalFusionTransformer.from_dataset(
+        training,
+        learning_rate=config.learning_rate,
+        hidden_size=config.hidden_size,
+        attention_head_size=config.attention_head_size,
+        dropout=config.dropout,
+        hidden_continuous_size=config.hidden_continuous_size,
+        output_size=config.output_size,
+        loss=QuantileLoss(),
+        reduce_on_plateau_patience=config.reduce_on_plateau_patience
+    )
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        checkpoint = ModelCheckpoint(dirpath=checkpoint_dir, monitor="val_loss", save_top_k=1)
+        trainer = pl.Trainer(
+            max_epochs=config.max_epochs,
+            gradient_clip_val=config.gradient_clip_val,
+            # processes > 1 trains data-parallel in CPU processes with DDP
+            accelerator="ddp_cpu" if processes > 1 else None,
+            num_processes=processes,
+            callbacks=[
+                checkpoint,
+                EarlyStopping(monitor="val_loss", patience=config.early_stopping_patience),
+                make_throughput_logger()
+            ],
+            logger=False,
+            weights_summary=None
+        )
+        trainer.fit(model, train_dataloader, val_dataloader)
+
+        os.makedirs(model_dir, exist_ok=True)
+        path = os.path.join(model_dir, name + ".ckpt")
+        best_path = checkpoint.best_model_path
+        if best_path:
+            shutil.copyfile(best_path, path)
+        else:
+            trainer.save_checkpoint(path)
+
+    save_dataset_parameters(training, path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train a TFT model for the dashboard")
+    parser.add_argument("--name", default="tft-" + time.strftime("%Y%m%d"),
+                        help="checkpoint file name in models/, without ending")
+    parser.add_argument("--data", default=URL, help="OWID JSON file or URL")
+    parser.add_argument("--config", default="run_config.yml")
+    parser.add_argument("--model-dir", default="models")
+    parser.add_argument("--batch-size", type=int, default=128,
+                        help="samples per batch and training process")
+    parser.add_argument("--loader-workers", type=int, default=4,
+                        help="data loading processes per dataloader")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="CPU processes training data-parallel")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    config = load_run_config(args.config)
+    data = load_training_data(args.data)
+    path = train(data, config, args.name, args.model_dir, args.batch_size,
+                 args.loader_workers, args.processes, args.seed)
+    print("checkpoint written to {}".format(path))
+
+
+if __name__ == "__main__":
+    main()